@@ -0,0 +1,269 @@
+# app/admission.py
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+import psutil
+from dotenv import load_dotenv
+from app.metrics import ADMISSION_REJECTIONS
+
+load_dotenv()
+
+# New book generations are only started while the host has room for them. When a limit is
+# crossed, /generate-book/ waits up to ADMISSION_QUEUE_SECONDS for it to clear and then
+# answers 503 with Retry-After; queued /jobs/ wait as long as it takes. 0 disables a limit.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() not in ("0", "false", "no")
+# Resident memory of this server process and its render workers; 0 means 60% of the RAM
+ADMISSION_MAX_RSS_MB = int(os.getenv("ADMISSION_MAX_RSS_MB", "0"))
+# Memory the rest of the host (or container) must still have free
+ADMISSION_MIN_AVAILABLE_MB = int(os.getenv("ADMISSION_MIN_AVAILABLE_MB", "1024"))
+# 1-minute load average divided by the usable CPUs
+ADMISSION_MAX_LOAD_PER_CPU = float(os.getenv("ADMISSION_MAX_LOAD_PER_CPU", "2.0"))
+# Books generated at once by this process. Memory and load lag behind a burst of orders,
+# so this is what keeps one burst from being admitted all at once.
+ADMISSION_MAX_GENERATIONS = int(os.getenv("ADMISSION_MAX_GENERATIONS", "8"))
+ADMISSION_QUEUE_SECONDS = float(os.getenv("ADMISSION_QUEUE_SECONDS", "30"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "60"))
+ADMISSION_SAMPLE_SECONDS = 1.0 # psutil readings are reused for this long
+ADMISSION_POLL_SECONDS = 1.0
+
+# PDF renders run only while their estimated peak memory fits in this budget (per process);
+# 0 means half the RAM. A 50k-word book with its images holds far more than a 15k one
+# while WeasyPrint lays it out.
+RENDER_MEMORY_BUDGET_MB = int(os.getenv("RENDER_MEMORY_BUDGET_MB", "0"))
+DEFAULT_RENDER_MEMORY_MB_BY_TIER = {15000: 300, 30000: 550, 50000: 900}
+
+
+def parse_tier_costs(text: str) -> dict:
+    """
+    Parses "tier:MB,..." (e.g. "15000:300,30000:550"). Malformed entries are reported and
+    skipped; with no valid entry at all the defaults are used.
+    """
+    costs = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        try:
+            tier, mb = (int(part) for part in item.split(":"))
+            if tier <= 0 or mb <= 0:
+                raise ValueError
+        except ValueError:
+            print(f"Ignoring malformed RENDER_MEMORY_MB_BY_TIER entry {item.strip()!r}; expected tier:MB.")
+            continue
+        costs[tier] = mb
+    return costs or dict(DEFAULT_RENDER_MEMORY_MB_BY_TIER)
+
+
+# "tier:MB,..." -- a book is charged at the tier closest to its actual word count
+RENDER_MEMORY_MB_BY_TIER = parse_tier_costs(os.getenv("RENDER_MEMORY_MB_BY_TIER", ""))
+
+CGROUP_DIR = "/sys/fs/cgroup"
+
+
+class OverloadedError(Exception):
+    """Raised when a generation is not admitted because the server is under pressure."""
+
+    def __init__(self, message: str, retry_after: int = ADMISSION_RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _read_cgroup(name: str) -> Optional[str]:
+    try:
+        with open(os.path.join(CGROUP_DIR, name)) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _cgroup_memory() -> Optional[tuple]:
+    """(limit, usage) in bytes of this container's cgroup v2 memory limit, or None if unlimited."""
+    limit = _read_cgroup("memory.max")
+    usage = _read_cgroup("memory.current")
+    if not limit or not usage or limit.strip() == "max":
+        return None
+    used = int(usage)
+    # Page cache counts as usage but is given back under pressure
+    for line in (_read_cgroup("memory.stat") or "").splitlines():
+        key, _, value = line.partition(" ")
+        if key == "inactive_file":
+            used -= int(value)
+    return int(limit), max(0, used)
+
+
+def _usable_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return psutil.cpu_count() or 1
+
+
+def memory_total_mb() -> float:
+    total = psutil.virtual_memory().total
+    cgroup = _cgroup_memory()
+    if cgroup:
+        total = min(total, cgroup[0])
+    return total / 2**20
+
+
+def _process_tree_rss() -> int:
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True): # the render workers
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:
+            pass # exited meanwhile
+    return rss
+
+
+_last_sample = None
+_last_sample_at = 0.0
+
+
+def sample_pressure() -> dict:
+    """Memory and CPU readings for this server, at most ADMISSION_SAMPLE_SECONDS old."""
+    global _last_sample, _last_sample_at
+    now = time.monotonic()
+    if _last_sample is not None and now - _last_sample_at < ADMISSION_SAMPLE_SECONDS:
+        return _last_sample
+    memory = psutil.virtual_memory()
+    total, available = memory.total, memory.available
+    cgroup = _cgroup_memory()
+    if cgroup:
+        limit, used = cgroup
+        total, available = min(total, limit), min(available, limit - used)
+    _last_sample = {
+        "rss_mb": round(_process_tree_rss() / 2**20, 1),
+        "available_mb": round(available / 2**20, 1),
+        "total_mb": round(total / 2**20, 1),
+        "load_per_cpu": round(psutil.getloadavg()[0] / _usable_cpus(), 2),
+    }
+    _last_sample_at = now
+    return _last_sample
+
+
+def admission_limits() -> dict:
+    return {
+        "max_rss_mb": ADMISSION_MAX_RSS_MB or round(memory_total_mb() * 0.6),
+        "min_available_mb": ADMISSION_MIN_AVAILABLE_MB,
+        "max_load_per_cpu": ADMISSION_MAX_LOAD_PER_CPU,
+        "max_generations": ADMISSION_MAX_GENERATIONS,
+    }
+
+
+_generations = 0
+
+
+def pressure_reasons(pressure: dict) -> list:
+    """[(reason, message)] for every limit that is crossed; empty when a book can start."""
+    limits = admission_limits()
+    reasons = []
+    if limits["max_rss_mb"] and pressure["rss_mb"] > limits["max_rss_mb"]:
+        reasons.append(("rss", f"server memory {pressure['rss_mb']:.0f} MB is over {limits['max_rss_mb']} MB"))
+    if limits["min_available_mb"] and pressure["available_mb"] < limits["min_available_mb"]:
+        reasons.append(("memory", f"only {pressure['available_mb']:.0f} MB of memory is free"))
+    if limits["max_load_per_cpu"] and pressure["load_per_cpu"] > limits["max_load_per_cpu"]:
+        reasons.append(("cpu", f"CPU load is {pressure['load_per_cpu']:.2f} per core"))
+    if limits["max_generations"] and _generations >= limits["max_generations"]:
+        reasons.append(("concurrency", f"{_generations} books are already being generated"))
+    return reasons
+
+
+@asynccontextmanager
+async def admitted(wait_seconds: Optional[float] = ADMISSION_QUEUE_SECONDS, on_wait=None):
+    """
+    Holds one generation slot for the duration of the block. While the server is under
+    pressure it waits, up to `wait_seconds` (None: indefinitely), then raises OverloadedError.
+    `on_wait(messages)` is called once if the generation has to wait.
+    """
+    global _generations
+    if ADMISSION_ENABLED:
+        deadline = None if wait_seconds is None else time.monotonic() + wait_seconds
+        waiting = False
+        while True:
+            # No await between this check and taking the slot, so concurrent waiters can't overshoot
+            reasons = pressure_reasons(sample_pressure())
+            if not reasons:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                for reason, _ in reasons:
+                    ADMISSION_REJECTIONS.labels(reason=reason).inc()
+                raise OverloadedError(
+                    "The server is busy (" + "; ".join(message for _, message in reasons) + "). Please try again shortly."
+                )
+            if not waiting and on_wait:
+                on_wait([message for _, message in reasons])
+            waiting = True
+            await asyncio.sleep(ADMISSION_POLL_SECONDS)
+    _generations += 1
+    try:
+        yield
+    finally:
+        _generations -= 1
+
+
+def book_word_count(book_data: dict) -> int:
+    texts = [book_data.get("prologue_text") or "", book_data.get("epilogue_text") or ""]
+    texts += [chapter.get("content") or "" for chapter in book_data.get("chapters", [])]
+    return sum(len(text.split()) for text in texts)
+
+
+def tier_memory_mb(word_count: int) -> int:
+    """Estimated peak render memory of a book of `word_count` words, from the nearest tier."""
+    return RENDER_MEMORY_MB_BY_TIER[min(RENDER_MEMORY_MB_BY_TIER, key=lambda tier: abs(tier - word_count))]
+
+
+def render_cost_mb(book_data: dict) -> int:
+    """Estimated peak memory of rendering this book."""
+    return tier_memory_mb(book_word_count(book_data))
+
+
+class MemoryBudget:
+    """
+    A semaphore weighted by megabytes: each holder reserves its estimated cost, and a new
+    holder waits until its cost fits. A cost larger than the whole budget is capped to it,
+    so such a book still renders, on its own.
+    """
+
+    def __init__(self, capacity_mb: int):
+        self.capacity_mb = capacity_mb
+        self.reserved_mb = 0
+        self.waiting = 0
+        self._changed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, cost_mb: int):
+        cost_mb = min(cost_mb, self.capacity_mb)
+        async with self._changed:
+            self.waiting += 1
+            try:
+                await self._changed.wait_for(lambda: self.reserved_mb + cost_mb <= self.capacity_mb)
+            finally:
+                self.waiting -= 1
+            self.reserved_mb += cost_mb
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self.reserved_mb -= cost_mb
+                self._changed.notify_all()
+
+    def report(self) -> dict:
+        return {"reserved_mb": self.reserved_mb, "capacity_mb": self.capacity_mb, "waiting": self.waiting}
+
+
+render_memory = MemoryBudget(RENDER_MEMORY_BUDGET_MB or round(memory_total_mb() / 2))
+
+
+def health_report() -> dict:
+    """What GET /health returns: current pressure, the limits, and whether books are admitted."""
+    pressure = sample_pressure()
+    reasons = pressure_reasons(pressure) if ADMISSION_ENABLED else []
+    return {
+        "status": "overloaded" if reasons else "ok",
+        "reasons": [message for _, message in reasons],
+        "pressure": {**pressure, "generations": _generations},
+        "limits": admission_limits(),
+        "render_memory": render_memory.report(),
+    }
@@ -1,16 +1,72 @@
 # app/astrology_api_client.py
-import httpx
 import os
 from dotenv import load_dotenv
+from app.cache import SQLiteCache, SingleFlight, canonical_hash
+from app.http_clients import get_http_client
 
 # Load environment variables from .env file
 load_dotenv()
 
-API_BASE_URL = "https://json.astrologyapi.com/v1"
+# Overridable so benchmarks can point the client at a local stand-in
+API_BASE_URL = os.getenv("ASTROLOGY_API_BASE_URL", "https://json.astrologyapi.com/v1")
 USER_ID = os.getenv("ASTROLOGY_API_USER_ID")
 API_KEY = os.getenv("ASTROLOGY_API_KEY")
 
+# A natal chart for a given moment and place never changes, so charts are cached on disk.
+# The TTL only guards against upstream response format changes.
+CHART_CACHE_ENABLED = os.getenv("CHART_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+CHART_CACHE_PATH = os.getenv("CHART_CACHE_PATH", "cache/natal_charts.sqlite3")
+CHART_CACHE_TTL_SECONDS = int(os.getenv("CHART_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+CHART_CACHE_MAX_ENTRIES = int(os.getenv("CHART_CACHE_MAX_ENTRIES", "10000"))
+
+_chart_cache = None
+_chart_requests = SingleFlight()
+
+
+def _get_chart_cache() -> SQLiteCache:
+    global _chart_cache
+    if _chart_cache is None:
+        _chart_cache = SQLiteCache(CHART_CACHE_PATH, CHART_CACHE_TTL_SECONDS, CHART_CACHE_MAX_ENTRIES)
+    return _chart_cache
+
+
+def chart_cache_key(day: int, month: int, year: int, hour: int, minute: int, lat: float, lon: float, tzone: float) -> str:
+    """
+    Normalizes the birth inputs so equivalent requests share a cache entry
+    (e.g. "4" vs 4, or coordinates that differ only past the 4th decimal, ~10 m).
+    """
+    normalized = [
+        int(day), int(month), int(year), int(hour), int(minute),
+        round(float(lat), 4), round(float(lon), 4), round(float(tzone), 2),
+    ]
+    return canonical_hash(normalized)
+
+
 async def get_natal_chart_data(day: int, month: int, year: int, hour: int, minute: int, lat: float, lon: float, tzone: float) -> dict:
+    """
+    Returns the detailed western horoscope (natal chart) data for the given birth inputs.
+    Results are served from the on-disk cache when possible, and concurrent lookups for
+    the same inputs share a single upstream request.
+    """
+    if not CHART_CACHE_ENABLED:
+        return await fetch_natal_chart_data(day, month, year, hour, minute, lat, lon, tzone)
+
+    key = chart_cache_key(day, month, year, hour, minute, lat, lon, tzone)
+
+    async def load() -> dict:
+        cache = _get_chart_cache()
+        cached = await cache.aget(key)
+        if cached is not None:
+            print(f"Using cached chart data for {month}/{day}/{year}.")
+            return cached
+        chart = await fetch_natal_chart_data(day, month, year, hour, minute, lat, lon, tzone)
+        await cache.aset(key, chart)
+        return chart
+
+    return await _chart_requests.do(key, load)
+
+
+async def fetch_natal_chart_data(day: int, month: int, year: int, hour: int, minute: int, lat: float, lon: float, tzone: float) -> dict:
     """
     Fetches the detailed western horoscope (natal chart) data from AstrologyAPI.com.
     """
@@ -30,19 +86,19 @@ async def get_natal_chart_data(day: int, month: int, year: int, hour: int, minut
     }
     
     auth = (USER_ID, API_KEY)
-    
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        try:
-            print(f"Requesting chart data from AstrologyAPI for {month}/{day}/{year}...")
-            response = await client.post(api_url, auth=auth, json=payload)
-            response.raise_for_status()  # Raise exception for 4xx/5xx errors
-            print("Successfully received chart data.")
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            error_message = f"Error fetching chart: {e.response.status_code} - {e.response.text}"
-            print(error_message)
-            raise Exception(error_message)
-        except Exception as e:
-            error_message = f"An unexpected error occurred while contacting AstrologyAPI: {e}"
-            print(error_message)
-            raise Exception(error_message)
\ No newline at end of file
+    import httpx # already loaded by get_http_client; deferred so importing the app doesn't pay for it
+
+    try:
+        print(f"Requesting chart data from AstrologyAPI for {month}/{day}/{year}...")
+        response = await get_http_client().post(api_url, auth=auth, json=payload)
+        response.raise_for_status()  # Raise exception for 4xx/5xx errors
+        print("Successfully received chart data.")
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        error_message = f"Error fetching chart: {e.response.status_code} - {e.response.text}"
+        print(error_message)
+        raise Exception(error_message)
+    except Exception as e:
+        error_message = f"An unexpected error occurred while contacting AstrologyAPI: {e}"
+        print(error_message)
+        raise Exception(error_message)
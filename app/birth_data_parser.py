@@ -0,0 +1,160 @@
+# app/birth_data_parser.py
+import csv
+import os
+import re
+import unicodedata
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Offline city index used to geocode birth locations without a network call.
+GAZETTEER_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'gazetteer.csv'))
+
+DATE_FORMATS = [
+    "%Y-%m-%d", "%Y/%m/%d", "%m/%d/%Y", "%m-%d-%Y", "%d.%m.%Y",
+    "%B %d, %Y", "%B %d %Y", "%b %d, %Y", "%b %d %Y", "%d %B %Y", "%d %b %Y",
+]
+TIME_FORMATS = ["%H:%M", "%H:%M:%S", "%I:%M %p", "%I:%M%p", "%I:%M:%S %p", "%I %p", "%I%p"]
+
+REGION_ABBREVIATIONS = {
+    # US states
+    "al": "alabama", "ak": "alaska", "az": "arizona", "ar": "arkansas", "ca": "california",
+    "co": "colorado", "ct": "connecticut", "de": "delaware", "dc": "district of columbia",
+    "fl": "florida", "ga": "georgia", "hi": "hawaii", "id": "idaho", "il": "illinois",
+    "in": "indiana", "ia": "iowa", "ks": "kansas", "ky": "kentucky", "la": "louisiana",
+    "me": "maine", "md": "maryland", "ma": "massachusetts", "mi": "michigan", "mn": "minnesota",
+    "ms": "mississippi", "mo": "missouri", "mt": "montana", "ne": "nebraska", "nv": "nevada",
+    "nh": "new hampshire", "nj": "new jersey", "nm": "new mexico", "ny": "new york",
+    "nc": "north carolina", "nd": "north dakota", "oh": "ohio", "ok": "oklahoma", "or": "oregon",
+    "pa": "pennsylvania", "ri": "rhode island", "sc": "south carolina", "sd": "south dakota",
+    "tn": "tennessee", "tx": "texas", "ut": "utah", "vt": "vermont", "va": "virginia",
+    "wa": "washington", "wv": "west virginia", "wi": "wisconsin", "wy": "wyoming",
+    # Canadian provinces
+    "on": "ontario", "qc": "quebec", "bc": "british columbia", "ab": "alberta", "mb": "manitoba",
+    "sk": "saskatchewan", "ns": "nova scotia", "nl": "newfoundland and labrador",
+    # Australian states
+    "nsw": "new south wales", "vic": "victoria", "qld": "queensland",
+    "act": "australian capital territory", "tas": "tasmania", "nt": "northern territory",
+}
+COUNTRY_ALIASES = {
+    "usa": "united states", "us": "united states",
+    "united states of america": "united states", "america": "united states",
+    "uk": "united kingdom", "great britain": "united kingdom", "britain": "united kingdom",
+    "uae": "united arab emirates", "czechia": "czech republic", "korea": "south korea",
+    "holland": "netherlands", "the netherlands": "netherlands",
+}
+
+
+def _normalize(text: str) -> str:
+    """Lowercases, strips accents and punctuation, and expands "St." to "Saint"."""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+    text = text.replace(".", "") # "D.C." -> "dc", "U.S.A." -> "usa"
+    text = re.sub(r"[^a-z0-9 ]+", " ", text)
+    text = re.sub(r"\b(st|ste)\b", "saint", text)
+    return " ".join(text.split())
+
+
+@lru_cache(maxsize=1)
+def _load_gazetteer() -> dict:
+    """Builds the name -> [places] index once per process."""
+    index = {}
+    with open(GAZETTEER_PATH, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            place = {
+                "region": _normalize(row["region"]),
+                "country": _normalize(row["country"]),
+                "lat": float(row["latitude"]),
+                "lon": float(row["longitude"]),
+                "timezone": row["timezone"],
+            }
+            names = {_normalize(name) for name in [row["name"]] + row["aliases"].split(";") if name}
+            for name in names:
+                index.setdefault(name, []).append(place)
+    return index
+
+
+def _expand_qualifier(qualifier: str) -> str:
+    return COUNTRY_ALIASES.get(qualifier, REGION_ABBREVIATIONS.get(qualifier, qualifier))
+
+
+def _match(city: str, qualifiers: list) -> Optional[dict]:
+    candidates = _load_gazetteer().get(city, [])
+    for qualifier in qualifiers:
+        expanded = _expand_qualifier(qualifier)
+        candidates = [p for p in candidates if expanded in (p["region"], p["country"])]
+    # Ambiguous names without enough qualifiers (e.g. just "Portland") are left to the LLM
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def geocode_location(location: str) -> Optional[dict]:
+    """
+    Resolves "City, Region, Country"-style text against the bundled gazetteer.
+    Returns {"lat", "lon", "timezone"} or None if the place is unknown or ambiguous.
+    """
+    parts = [_normalize(p) for p in location.split(",")]
+    parts = [re.sub(r"\b\d+\b", "", p).strip() for p in parts] # drop postal codes
+    parts = [p for p in parts if p]
+    if not parts:
+        return None
+
+    place = _match(parts[0], parts[1:])
+    if place is None and len(parts) == 1:
+        # No commas, e.g. "West Palm Beach Florida": try each split between city and qualifier
+        words = parts[0].split()
+        for split in range(len(words) - 1, 0, -1):
+            place = _match(" ".join(words[:split]), [" ".join(words[split:])])
+            if place:
+                break
+    if place is None:
+        return None
+    return {"lat": place["lat"], "lon": place["lon"], "timezone": place["timezone"]}
+
+
+def _parse_with_formats(text: str, formats: list) -> Optional[datetime]:
+    cleaned = " ".join(text.split())
+    for fmt in formats:
+        try:
+            return datetime.strptime(cleaned, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def timezone_offset_hours(timezone: str, year: int, month: int, day: int, hour: int, minute: int) -> float:
+    """The UTC offset in hours (DST included) in effect at that local time and place."""
+    local_time = datetime(year, month, day, hour, minute, tzinfo=ZoneInfo(timezone))
+    return local_time.utcoffset().total_seconds() / 3600
+
+
+def parse_birth_data(birth_date: str, birth_time: str, birth_location: str) -> Optional[dict]:
+    """
+    Deterministically converts the form fields into the structured birth data expected by
+    get_natal_chart_data(), without any network calls. Returns None if any field can't be
+    resolved, in which case the caller should fall back to the LLM extractor.
+    """
+    date_text = re.sub(r"(\d)(st|nd|rd|th)\b", r"\1", birth_date.strip(), flags=re.IGNORECASE) # "4th" -> "4"
+    time_text = re.sub(r"\b([AP])\.?M\.?", r"\1M", birth_time.strip().upper()) # "p.m." -> "PM"
+    time_text = re.sub(r"(\d)\.(\d)", r"\1:\2", time_text) # "3.30" -> "3:30"
+    date = _parse_with_formats(date_text, DATE_FORMATS)
+    time_of_day = _parse_with_formats(time_text, TIME_FORMATS)
+    place = geocode_location(birth_location)
+    if date is None or time_of_day is None or place is None:
+        return None
+
+    try:
+        tzone = timezone_offset_hours(place["timezone"], date.year, date.month, date.day,
+                                      time_of_day.hour, time_of_day.minute)
+    except ZoneInfoNotFoundError:
+        return None
+
+    return {
+        "day": date.day,
+        "month": date.month,
+        "year": date.year,
+        "hour": time_of_day.hour,
+        "minute": time_of_day.minute,
+        "lat": place["lat"],
+        "lon": place["lon"],
+        "tzone": tzone,
+    }
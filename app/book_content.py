@@ -0,0 +1,411 @@
+# app/book_content.py
+import os
+from datetime import datetime
+from functools import lru_cache
+import pathlib
+from typing import TYPE_CHECKING
+from app.image_processing import prepare_print_image
+from app.file_store import get_image_store
+
+if TYPE_CHECKING:
+    from jinja2 import Environment
+
+# The book's templates, stylesheet and data preparation, shared by the PDF exporter and
+# the HTML/EPUB exporter. Nothing here needs WeasyPrint.
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+FONTS_DIR = os.path.join(PROJECT_ROOT, 'fonts')
+
+# --- The book templates ---
+# "book.html" is the whole book in one document. The other entries are its sections, which
+# the incremental renderer also lays out as separate documents ("part.html") and stitches.
+# "reflowable.html" is the same content as a web page or EPUB document (autoescaped, so the
+# markup is also valid XHTML).
+BOOK_TEMPLATES = {
+    "document.html": """
+    <!DOCTYPE html>
+    <html>
+    <head><meta charset="UTF-8"><title>{{ book_title }}</title></head>
+    <body>
+        {% block body %}{% endblock %}
+    </body>
+    </html>
+    """,
+
+    "book.html": """{% extends "document.html" %}{% block body %}{% include "book_body.html" %}{% endblock %}""",
+
+    "book_body.html": """
+        {% include "front_matter.html" %}
+        {% include "contents.html" %}
+        {% include "opening.html" %}
+        {% for chapter in chapters %}{% set chapter_number = loop.index %}{% include "chapter.html" %}{% endfor %}
+        {% include "closing.html" %}
+    """,
+
+    # `parts` are the templates making up this document: ["book_body.html"] for the whole
+    # book, or one section per EPUB file. The stylesheet is either linked or inlined.
+    # `xhtml` adds the XML declaration EPUB readers expect.
+    "reflowable.html": """{% if xhtml %}<?xml version="1.0" encoding="UTF-8"?>
+{% endif %}<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" lang="en" xml:lang="en">
+<head>
+    <meta charset="UTF-8"/>
+    <title>{{ book_title }}</title>
+    {% if stylesheet_href %}<link rel="stylesheet" type="text/css" href="{{ stylesheet_href }}"/>{% else %}<style>{{ stylesheet|safe }}</style>{% endif %}
+</head>
+<body class="reflowable">
+    {% for part in parts %}{% include part %}{% endfor %}
+</body>
+</html>
+""",
+
+    # One section of the book. `padding_pages` blank pages come first so that page counters
+    # continue from the previous sections; the caller drops them after layout. Sections
+    # other than the first/last lose the body margin they wouldn't have mid-book.
+    "part.html": """{% extends "document.html" %}{% block body %}
+        <style>body { {% if not first_part %}margin-top: 0;{% endif %} {% if not last_part %}margin-bottom: 0;{% endif %} }</style>
+        {% for _ in range(padding_pages) %}<div class="page blank-page"></div>{% endfor %}
+        {% include part %}
+    {% endblock %}""",
+
+    "front_matter.html": """
+        <div class="page swapi-call-page debug-page"><h1>Data Source</h1><pre>{{ swapi_call_text }}</pre></div>
+        <div class="page swapi-json-page debug-page"><pre>{{ swapi_json_output }}</pre></div>
+       
+        <div class="page blank-page"></div>
+        <div class="page blank-page"></div>
+        <div class="page blank-page"></div>
+        <div class="page blank-page"></div>
+        
+        {% if image_path %}
+        <div class="page image-page">
+            <div class="image-container">
+                <img src="{{ image_path }}" alt="AI Generated Book Image"/>
+            </div>
+        </div>
+        {% endif %}
+        
+        <div class="page title-page">
+            <div class="title-main-block">
+                <div class="title-decoration">✧</div>
+                <h1 class="book-title">{{ book_title }}</h1>
+                <div class="title-decoration">✦</div>
+                <h2 class="subtitle">A PERSONAL INTERPRETATION</h2>
+            </div>
+        </div>
+        
+        <div class="page print-date-page">
+            <p>A personalized edition created on<br/>{{ print_date }}</p>
+        </div>
+
+        <div class="page blank-page"></div><div class="page blank-page"></div>
+    """,
+
+    # Entries with a precomputed `page` (incremental renders) print it instead of target-counter().
+    # Reflowable books have no page numbers, so the titles link to the sections instead.
+    "contents.html": """
+        <div class="page toc-page">
+            <h1>Contents</h1>
+            <div class="toc-list">
+            {% for entry in toc_entries %}
+                <div class="toc-entry">{% if reflowable %}<a class="entry-title" href="{{ entry.href }}">{{ entry.title }}</a>{% else %}
+                    <span class="entry-title">{{ entry.title }}</span>
+                    <span class="leader"></span>
+                    {% if entry.page %}<a class="resolved-page" href="{{ entry.href }}">{{ entry.page }}</a>{% else %}<a href="{{ entry.href }}"></a>{% endif %}{% endif %}
+                </div>
+            {% endfor %}
+            </div>
+        </div>
+    """,
+
+    "opening.html": """
+        <div class="page blank-page"></div>
+        
+        <!-- FIX #3: Added the Preface block -->
+        {% if preface_text %}
+        <div class="page content-page" id="preface">
+            <h2>Preface</h2>
+            <div class="content-block">{% for p in preface_text.split('\\n\\n') %}<p>{{ p }}</p>{% endfor %}</div>
+        </div>
+        <div class="page blank-page"></div>
+        {% endif %}
+        
+        {% if has_prologue %}
+        <div class="page content-page" id="prologue">
+            <h2>Prologue</h2>
+            <div class="content-block">{% for p in prologue_text.split('\\n\\n') %}<p>{{ p }}</p>{% endfor %}</div>
+        </div>
+        <div class="page blank-page"></div>
+        {% endif %}
+    """,
+
+    "chapter.html": """
+        <div class="page chapter-title-page">
+            <div class="chapter-title-content">
+                <span class="chapter-number">Chapter {{ chapter_number }}</span>
+                <h2>{{ chapter.heading }}</h2>
+            </div>
+        </div>
+
+        {% if chapter.image_path %}
+        <div class="page image-page">
+            <div class="image-container">
+                <img src="{{ chapter.image_path }}" alt="Image for Chapter {{ chapter_number }}"/>
+            </div>
+        </div>
+        {% endif %}
+
+        <div class="page content-page" id="chapter-{{ chapter_number }}">
+            <div class="content-block">
+            {% for p in chapter.content.split('\\n\\n') %}<p>{{ p }}</p>{% endfor %}
+            </div>
+        </div>
+    """,
+
+    "closing.html": """
+        {% if has_epilogue %}
+        <div class="page blank-page"></div>
+        <div class="page content-page" id="epilogue">
+            <h2>Epilogue</h2>
+            <div class="content-block">{% for p in epilogue_text.split('\\n\\n') %}<p>{{ p }}</p>{% endfor %}</div>
+        </div>
+        {% endif %}
+    """,
+}
+
+# --- CSS Styling with Restored Print Date Page Style ---
+MAIN_CSS = """
+    @page { size: 140mm 216mm; margin: 25mm; }
+    @page:blank { @bottom-center { content: ""; } }
+    @page main { @bottom-center { content: counter(page); font-family: 'Baskerville', serif; font-size: 9pt; } }
+    @page image-page-style { margin: 0; }
+
+    body { font-family: 'Baskerville', serif; font-size: 11pt; line-height: 1.6; -webkit-font-smoothing: antialiased; }
+
+    .page { page-break-after: always; position: relative; height: 100%; }
+    body > div:last-of-type { page-break-after: auto; }
+
+    h1, h2, h3 { font-weight: bold; margin: 0; text-align: center; }
+
+    .debug-page pre {
+        white-space: pre-wrap;
+        word-wrap: break-word;
+        font-size: 8pt;
+        line-height: 1.5;
+    }
+
+    .image-page {
+        page: image-page-style;
+        display: flex;
+        justify-content: center;
+        align-items: center;
+        width: 100%;
+        height: 100%;
+        background-color: #000000;
+    }
+    .image-container img { max-width: 100%; max-height: 100%; object-fit: contain; }
+
+    .title-page { display: flex; flex-direction: column; align-items: center; text-align: center; }
+    .title-main-block { margin: auto 0; }
+    .book-title { font-size: 38pt; font-weight: bold; margin: 0.5em 0; line-height: 1.2; }
+    .subtitle { font-size: 14pt; margin: 1em 0; letter-spacing: 0.2em; text-transform: uppercase; }
+    .title-decoration { font-size: 24pt; margin: 1em 0; color: #555; }
+    
+   .print-date-page {
+        display: flex;
+        flex-direction: column;
+        justify-content: flex-end;
+        height: 100vh;
+        width: 100%;
+        padding: 32mm; /* Your book's margin */
+        box-sizing: border-box;
+        }
+
+    .print-date-page p {
+        text-align: center;
+        font-style: italic;
+        font-size: 10pt;
+        margin-bottom: 20pt; /* Push it a bit above the bottom */
+        }
+
+    /* --- THIS IS THE ONLY CSS BLOCK THAT HAS CHANGED --- */
+    .toc-page { padding: 2em 0; page: main; }
+    .toc-page h1 { font-size: 32pt; margin-bottom: 1.2em; letter-spacing: 0.1em; }
+    .toc-list { width: 85%; margin: 0 auto; }
+
+    /* New robust styling for each TOC entry */
+    .toc-entry {
+        display: grid;
+        grid-template-columns: auto 1fr auto; /* Title | Leader | Page Number */
+        align-items: baseline;
+        gap: 0 0.5em; /* Add a small gap between columns */
+        margin-bottom: 1.2em;
+        font-size: 12pt;
+    }
+    .entry-title {
+        grid-column: 1; /* First column */
+        text-align: left;
+    }
+    .leader {
+        grid-column: 2; /* Second column, takes up remaining space */
+        border-bottom: 1px dotted rgba(0,0,0,0.5);
+    }
+    .toc-entry a {
+        grid-column: 3; /* Third column */
+        text-align: right;
+        text-decoration: none;
+        color: black;
+    }
+    /* This pseudo-element gets the page number and puts it in the link */
+    .toc-entry a::after {
+        content: target-counter(attr(href), page);
+    }
+    .toc-entry a.resolved-page::after { content: none; }
+    /* --- END OF THE CHANGED CSS BLOCK --- */
+    
+
+    .chapter-title-page { display: flex; align-items: center; justify-content: center; }
+    .chapter-title-content { text-align: center; padding: 2em; }
+    .chapter-number { display: block; font-size: 16pt; font-style: italic; color: #666; margin-bottom: 1.5em; text-transform: uppercase; }
+    .chapter-title-content h2 { font-size: 32pt; font-weight: bold; text-transform: uppercase; letter-spacing: 0.1em; line-height: 1.3; }
+
+    .content-page {
+        padding: 0;
+    }
+
+    .main-content-body {
+        /* This resets the page counter to 1 right before the first chapter starts */
+        counter-reset: page 1;
+    }
+
+    /* This applies the 'main' page style (with numbers) to ALL pages inside the main-content-body */
+    .main-content-body .page {
+        page: main;
+    }
+
+    /* This applies the 'main' page style ONLY to the epilogue */
+    #epilogue.page {
+        page: main;
+    }
+
+    /* --- General Content Styling --- */
+    .content-page h2 { font-size: 20pt; text-transform: uppercase; margin-bottom: 2.5em; letter-spacing: 0.1em; }
+    .content-block { margin: 0 auto; max-width: 100%; }
+    .content-block p { text-align: justify; text-indent: 2em; margin-bottom: 0; line-height: 1.7; hyphens: auto; }
+    .content-block p + p { margin-top: 1em; }
+    .content-block p:first-child { text-indent: 0; }
+    .content-block p:first-child::first-letter { font-size: 3.5em;font-weight: bold; margin-right: -0.1em; }
+
+    .print-date-page {
+        display: flex;
+        align-items: center;
+        justify-content: center;
+    }
+
+    .print-date-page p {
+        text-align: center;
+        font-style: italic;
+        font-size: 10pt;
+    }
+-
+    """
+
+# Added after MAIN_CSS for the web page and EPUB: one continuous column, no print-only pages.
+REFLOWABLE_CSS = """
+    body.reflowable { max-width: 38em; margin: 0 auto; padding: 2em 1.5em; }
+    .reflowable .page { height: auto; }
+    .reflowable .blank-page, .reflowable .debug-page { display: none; }
+    .reflowable .title-page, .reflowable .chapter-title-page { display: block; padding: 4em 0 2em; }
+    .reflowable .print-date-page { display: block; height: auto; padding: 1em 0 3em; }
+    .reflowable .image-page { display: block; height: auto; background-color: transparent; }
+    .reflowable .image-container img { display: block; margin: 0 auto 3em; max-height: 90vh; }
+    .reflowable .toc-page { padding: 2em 0 4em; }
+    .reflowable .toc-entry { display: block; margin-bottom: 0.8em; }
+    .reflowable .toc-entry a { color: inherit; text-decoration: none; }
+    .reflowable .toc-entry a::after { content: none; }
+    .reflowable .content-page { margin-bottom: 4em; }
+    """
+
+FONT_FILES = {
+    "regular": "LibreBaskerville-Regular.ttf",
+    "italic": "LibreBaskerville-Italic.ttf",
+    "bold": "LibreBaskerville-Bold.ttf",
+}
+
+
+def font_file_uri(path: str) -> str:
+    return pathlib.Path(path).as_uri()
+
+
+def build_font_face_css(font_url=font_file_uri) -> str:
+    """@font-face rules for the book fonts; `font_url(path)` gives each font file's URL."""
+    baskerville_regular_uri = font_url(os.path.join(FONTS_DIR, FONT_FILES["regular"]))
+    baskerville_italic_uri = font_url(os.path.join(FONTS_DIR, FONT_FILES["italic"]))
+    baskerville_bold_uri = font_url(os.path.join(FONTS_DIR, FONT_FILES["bold"]))
+
+    return f"""
+    @font-face  {{ font-family: 'Baskerville'; src: url('{baskerville_regular_uri}'); }}
+    @font-face {{ font-family: 'Baskerville'; font-style: italic; src: url('{baskerville_italic_uri}'); }}
+    @font-face {{ font-family: 'Baskerville'; font-weight: bold; src: url('{baskerville_bold_uri}'); }}
+    """
+
+
+# The template, stylesheet and fonts are identical for every book, so they are built once
+# per process and reused; each render then only pays for the book's own content.
+# The PDF uses the unescaped environment as it always has; the reflowable outputs escape.
+@lru_cache(maxsize=2)
+def get_template_environment(autoescape: bool = False) -> "Environment":
+    from jinja2 import Environment, DictLoader
+    environment = Environment(loader=DictLoader(BOOK_TEMPLATES), autoescape=autoescape)
+    for name in BOOK_TEMPLATES:
+        environment.get_template(name) # compile now; the environment keeps them cached
+    return environment
+
+
+def build_template_context(title: str, book_data: dict) -> dict:
+    # --- Prepare all data for the template ---
+    all_sections_for_toc = []
+    has_prologue = bool(book_data.get('prologue_text'))
+    has_epilogue = bool(book_data.get('epilogue_text'))
+    # Use preface_text directly in template context
+    
+    # Correctly build the TOC including a check for the preface
+    if book_data.get('preface_text'):
+        all_sections_for_toc.append({"title": "Preface", "href": "#preface"})
+    if has_prologue:
+        all_sections_for_toc.append({"title": "Prologue", "href": "#prologue"})
+    for i, ch in enumerate(book_data.get("chapters", [])):
+        all_sections_for_toc.append({"title": ch["heading"], "href": f"#chapter-{i+1}"})
+    if has_epilogue:
+        all_sections_for_toc.append({"title": "Epilogue", "href": "#epilogue"})
+
+    return {
+        "book_title": title,
+        "print_date": datetime.now().strftime("%B %d, %Y"),
+        "toc_entries": all_sections_for_toc,
+        "has_prologue": has_prologue,
+        "has_epilogue": has_epilogue,
+        **book_data
+    }
+
+
+def with_print_images(book_data: dict) -> dict:
+    """
+    Returns a copy of book_data whose images point at print-sized JPEG/WebP derivatives
+    instead of the full-size DALL-E PNGs (much smaller PDFs and faster rendering).
+    """
+    prepared = dict(book_data)
+    if prepared.get("image_path"):
+        prepared["image_path"] = prepare_print_image(prepared["image_path"])
+    prepared["chapters"] = [
+        {**ch, "image_path": prepare_print_image(ch["image_path"]) if ch.get("image_path") else ch.get("image_path")}
+        for ch in book_data.get("chapters", [])
+    ]
+    return prepared
+
+
+def pin_book_images(book_data: dict, book_id: str):
+    """Pins the chapter images to this book so quota eviction leaves them alone."""
+    image_store = get_image_store()
+    for ch in book_data.get("chapters", []):
+        if ch.get("image_path"):
+            image_store.add_reference(ch["image_path"], book_id)
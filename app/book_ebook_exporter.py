@@ -0,0 +1,238 @@
+# app/book_ebook_exporter.py
+import base64
+import json
+import os
+import tempfile
+import uuid
+import zipfile
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
+from app.book_content import (
+    FONTS_DIR, FONT_FILES, MAIN_CSS, REFLOWABLE_CSS, build_font_face_css, get_template_environment,
+    build_template_context, with_print_images, pin_book_images
+)
+from app.file_store import BOOK_DATA_DIR, book_data_path, get_book_store
+
+if TYPE_CHECKING:
+    from jinja2 import Environment
+
+# Web page and e-reader editions of a book. They use the same templates and fonts as the
+# PDF but need no layout engine, so they take milliseconds instead of a WeasyPrint render.
+# The book's content is stored next to them, so the PDF can still be rendered on demand.
+OUTPUT_FORMATS = ("pdf", "html", "epub")
+
+MEDIA_TYPES = {
+    ".xhtml": "application/xhtml+xml",
+    ".css": "text/css",
+    ".ttf": "font/ttf",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+}
+
+EPUB_TEMPLATES = {
+    "container.xml": """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+    <rootfiles>
+        <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+    </rootfiles>
+</container>
+""",
+
+    "content.opf": """<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id" xml:lang="en">
+    <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+        <dc:identifier id="book-id">urn:uuid:{{ book_id }}</dc:identifier>
+        <dc:title>{{ book_title }}</dc:title>
+        <dc:language>en</dc:language>
+        <meta property="dcterms:modified">{{ modified }}</meta>
+    </metadata>
+    <manifest>
+        <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+        {% for item in manifest %}<item id="{{ item.id }}" href="{{ item.href }}" media-type="{{ item.media_type }}"/>
+        {% endfor %}
+    </manifest>
+    <spine>
+        {% for id in spine %}<itemref idref="{{ id }}"/>
+        {% endfor %}
+    </spine>
+</package>
+""",
+
+    "nav.xhtml": """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="en" xml:lang="en">
+<head><meta charset="UTF-8"/><title>{{ book_title }}</title></head>
+<body>
+    <nav epub:type="toc" id="toc">
+        <h1>Contents</h1>
+        <ol>
+        {% for entry in toc_entries %}<li><a href="{{ entry.href }}">{{ entry.title }}</a></li>
+        {% endfor %}
+        </ol>
+    </nav>
+</body>
+</html>
+""",
+}
+
+
+def media_type(path: str) -> str:
+    return MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+
+
+def data_uri(path: str) -> str:
+    with open(path, "rb") as f:
+        return f"data:{media_type(path)};base64,{base64.b64encode(f.read()).decode('ascii')}"
+
+
+@lru_cache(maxsize=1)
+def get_epub_environment() -> "Environment":
+    from jinja2 import Environment, DictLoader
+    return Environment(loader=DictLoader(EPUB_TEMPLATES), autoescape=True)
+
+
+@lru_cache(maxsize=1)
+def get_inline_stylesheet() -> str:
+    """The book stylesheet with the fonts embedded, for the self-contained HTML edition."""
+    return build_font_face_css(data_uri) + MAIN_CSS + REFLOWABLE_CSS
+
+
+def _usable_image(path: Optional[str]) -> bool:
+    return bool(path) and os.path.exists(path)
+
+
+def render_book_html(title: str, book_data: dict) -> str:
+    """The whole book as one self-contained web page: images and fonts are inlined."""
+    book = with_print_images(book_data)
+    if book.get("image_path"):
+        book["image_path"] = data_uri(book["image_path"]) if _usable_image(book["image_path"]) else None
+    book["chapters"] = [
+        {**ch, "image_path": data_uri(ch["image_path"]) if _usable_image(ch.get("image_path")) else None}
+        for ch in book["chapters"]
+    ]
+    return get_template_environment(autoescape=True).get_template("reflowable.html").render(
+        build_template_context(title, book), parts=["book_body.html"], reflowable=True, stylesheet=get_inline_stylesheet()
+    )
+
+
+def render_book_epub(title: str, book_data: dict, book_id: str, target):
+    """
+    Writes the book as a reflowable EPUB 3 to `target` (a path or file object): the front
+    matter, each chapter and the closing are separate XHTML files sharing one stylesheet.
+    """
+    book = with_print_images(book_data)
+    context = build_template_context(title, book)
+    files = {} # path inside OEBPS/ -> bytes
+    manifest, spine = [], []
+
+    def add_file(href: str, data: bytes, item_id: str, in_spine: bool = False):
+        files[href] = data
+        manifest.append({"id": item_id, "href": href, "media_type": media_type(href)})
+        if in_spine:
+            spine.append(item_id)
+
+    def add_image(path: Optional[str], name: str) -> Optional[str]:
+        if not _usable_image(path):
+            return None
+        href = f"images/{name}{os.path.splitext(path)[1].lower()}"
+        with open(path, "rb") as f:
+            add_file(href, f.read(), f"image-{name}")
+        return href
+
+    context["image_path"] = add_image(book.get("image_path"), "cover")
+    chapters = [
+        {**ch, "image_path": add_image(ch.get("image_path"), f"chapter-{number}")}
+        for number, ch in enumerate(book["chapters"], start=1)
+    ]
+
+    # (file, templates, extra context) in reading order
+    documents = [("front.xhtml", ["front_matter.html", "contents.html", "opening.html"], {})]
+    documents += [
+        (f"chapter-{number}.xhtml", ["chapter.html"], {"chapter": ch, "chapter_number": number})
+        for number, ch in enumerate(chapters, start=1)
+    ]
+    if context["has_epilogue"]:
+        documents.append(("closing.xhtml", ["closing.html"], {}))
+
+    # The contents links point into whichever file holds each section
+    section_files = {"#preface": "front.xhtml", "#prologue": "front.xhtml", "#epilogue": "closing.xhtml"}
+    section_files.update({f"#chapter-{number}": f"chapter-{number}.xhtml" for number in range(1, len(chapters) + 1)})
+    toc_entries = [{**entry, "href": section_files[entry["href"]] + entry["href"]} for entry in context["toc_entries"]]
+
+    book_template = get_template_environment(autoescape=True).get_template("reflowable.html")
+    for href, parts, extra in documents:
+        markup = book_template.render(
+            context, **extra, toc_entries=toc_entries, parts=parts, reflowable=True, xhtml=True,
+            stylesheet_href="style.css"
+        )
+        add_file(href, markup.encode("utf-8"), os.path.splitext(href)[0], in_spine=True)
+
+    add_file("style.css", (build_font_face_css(lambda path: f"fonts/{os.path.basename(path)}") + MAIN_CSS + REFLOWABLE_CSS).encode("utf-8"), "style")
+    for style, font_file in FONT_FILES.items():
+        with open(os.path.join(FONTS_DIR, font_file), "rb") as f:
+            add_file(f"fonts/{font_file}", f.read(), f"font-{style}")
+
+    environment = get_epub_environment()
+    files["nav.xhtml"] = environment.get_template("nav.xhtml").render(book_title=title, toc_entries=toc_entries).encode("utf-8")
+    files["content.opf"] = environment.get_template("content.opf").render(
+        book_id=book_id, book_title=title, manifest=manifest, spine=spine,
+        modified=datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+    ).encode("utf-8")
+
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as epub:
+        # The mimetype entry must come first and be stored uncompressed
+        epub.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        epub.writestr("META-INF/container.xml", environment.get_template("container.xml").render())
+        for href, data in files.items():
+            epub.writestr(f"OEBPS/{href}", data)
+
+
+def save_book_data(title: str, book_data: dict, name: str) -> str:
+    """
+    Keeps the book's content in BOOK_DATA_DIR (not the public book store), so the PDF can
+    be rendered later. It is deleted when the book is evicted from the store.
+    """
+    path = book_data_path(name)
+    os.makedirs(BOOK_DATA_DIR, exist_ok=True)
+    pin_book_images(book_data, os.path.basename(path))
+    fd, partial_path = tempfile.mkstemp(dir=BOOK_DATA_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"title": title, "book_data": book_data}, f)
+        os.replace(partial_path, path)
+    except BaseException:
+        os.remove(partial_path)
+        raise
+    return path
+
+
+def load_book_data(name: str) -> Optional[dict]:
+    """The {"title", "book_data"} saved by save_book_data, or None if it is gone."""
+    try:
+        with open(book_data_path(name), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_book_as_ebook(output_format: str, title: str, book_data: dict, name: str) -> str:
+    """
+    Stores the book as `name`.html or `name`.epub (plus its content for a later PDF) and
+    returns the stored path.
+    """
+    save_book_data(title, book_data, name)
+    if output_format == "html":
+        return get_book_store().put_bytes(render_book_html(title, book_data).encode("utf-8"), name=f"{name}.html")
+    if output_format == "epub":
+        book_store = get_book_store()
+        partial_path = book_store.temp_path(".epub")
+        try:
+            render_book_epub(title, book_data, str(uuid.uuid5(uuid.NAMESPACE_URL, name)), partial_path)
+            return book_store.put_file(partial_path, name=f"{name}.epub")
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+    raise ValueError(f"Unsupported output format: {output_format}")
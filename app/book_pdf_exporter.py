@@ -1,297 +1,165 @@
 # app/book_pdf_exporter.py
 from weasyprint import HTML, CSS
-from jinja2 import Template
+from weasyprint.text.fonts import FontConfiguration
 import os
-from datetime import datetime
-import pathlib
+from functools import lru_cache
+import threading
+from app.book_content import (
+    PROJECT_ROOT, MAIN_CSS, build_font_face_css, get_template_environment,
+    build_template_context, with_print_images, pin_book_images
+)
+from app.file_store import get_book_store
 
-def save_book_as_pdf(title: str, book_data: dict, filename: str) -> str:
-    """
-    Generates the final, professionally formatted PDF with all structure requirements met.
-    """
-    output_dir = "generated_books"
-    os.makedirs(output_dir, exist_ok=True)
-    output_path = os.path.join(output_dir, filename)
-
-    # --- Prepare all data for the template ---
-    all_sections_for_toc = []
-    has_prologue = bool(book_data.get('prologue_text'))
-    has_epilogue = bool(book_data.get('epilogue_text'))
-    # Use preface_text directly in template context
-    
-    # Correctly build the TOC including a check for the preface
-    if book_data.get('preface_text'):
-        all_sections_for_toc.append({"title": "Preface", "href": "#preface"})
-    if has_prologue:
-        all_sections_for_toc.append({"title": "Prologue", "href": "#prologue"})
-    for i, ch in enumerate(book_data.get("chapters", [])):
-        all_sections_for_toc.append({"title": ch["heading"], "href": f"#chapter-{i+1}"})
-    if has_epilogue:
-        all_sections_for_toc.append({"title": "Epilogue", "href": "#epilogue"})
-
-    template_context = {
-        "book_title": title,
-        "print_date": datetime.now().strftime("%B %d, %Y"),
-        "toc_entries": all_sections_for_toc,
-        "has_prologue": has_prologue,
-        "has_epilogue": has_epilogue,
-        **book_data
-    }
-    
-    # --- YOUR ORIGINAL HTML TEMPLATE (UNCHANGED) ---
-    html_template = Template("""
-    <!DOCTYPE html>
-    <html>
-    <head><meta charset="UTF-8"><title>{{ book_title }}</title></head>
-    <body>
-        <div class="page swapi-call-page debug-page"><h1>Data Source</h1><pre>{{ swapi_call_text }}</pre></div>
-        <div class="page swapi-json-page debug-page"><pre>{{ swapi_json_output }}</pre></div>
-       
-        <div class="page blank-page"></div>
-        <div class="page blank-page"></div>
-        <div class="page blank-page"></div>
-        <div class="page blank-page"></div>
-        
-        {% if image_path %}
-        <div class="page image-page">
-            <div class="image-container">
-                <img src="{{ image_path }}" alt="AI Generated Book Image">
-            </div>
-        </div>
-        {% endif %}
-        
-        <div class="page title-page">
-            <div class="title-main-block">
-                <div class="title-decoration">✧</div>
-                <h1 class="book-title">{{ book_title }}</h1>
-                <div class="title-decoration">✦</div>
-                <h2 class="subtitle">A PERSONAL INTERPRETATION</h2>
-            </div>
-        </div>
-        
-        <div class="page print-date-page">
-            <p>A personalized edition created on<br>{{ print_date }}</p>
-        </div>
-
-        <div class="page blank-page"></div><div class="page blank-page"></div>
-        
-        <div class="page toc-page">
-            <h1>Contents</h1>
-            <div class="toc-list">
-            {% for entry in toc_entries %}
-                <div class="toc-entry">
-                    <span class="entry-title">{{ entry.title }}</span>
-                    <span class="leader"></span>
-                    <a href="{{ entry.href }}"></a>
-                </div>
-            {% endfor %}
-            </div>
-        </div>
-
-        <div class="page blank-page"></div>
-        
-        <!-- FIX #3: Added the Preface block -->
-        {% if preface_text %}
-        <div class="page content-page" id="preface">
-            <h2>Preface</h2>
-            <div class="content-block">{% for p in preface_text.split('\\n\\n') %}<p>{{ p }}</p>{% endfor %}</div>
-        </div>
-        <div class="page blank-page"></div>
-        {% endif %}
-        
-        {% if has_prologue %}
-        <div class="page content-page" id="prologue">
-            <h2>Prologue</h2>
-            <div class="content-block">{% for p in prologue_text.split('\\n\\n') %}<p>{{ p }}</p>{% endfor %}</div>
-        </div>
-        <div class="page blank-page"></div>
-        {% endif %}
-
-        {% for chapter in chapters %}
-        <div class="page chapter-title-page">
-            <div class="chapter-title-content">
-                <span class="chapter-number">Chapter {{ loop.index }}</span>
-                <h2>{{ chapter.heading }}</h2>
-            </div>
-        </div>
-
-        {% if chapter.image_path %}
-        <div class="page image-page">
-            <div class="image-container">
-                <img src="{{ chapter.image_path }}" alt="Image for Chapter {{ loop.index }}">
-            </div>
-        </div>
-        {% endif %} <!-- <<< ADD THIS LINE -->
 
-        <div class="page content-page" id="chapter-{{ loop.index }}">
-            <div class="content-block">
-            {% for p in chapter.content.split('\\n\\n') %}<p>{{ p }}</p>{% endfor %}
-            </div>
-        </div>
-        {% endfor %} 
-        
-        {% if has_epilogue %}
-        <div class="page blank-page"></div>
-        <div class="page content-page" id="epilogue">
-            <h2>Epilogue</h2>
-            <div class="content-block">{% for p in epilogue_text.split('\\n\\n') %}<p>{{ p }}</p>{% endfor %}</div>
-        </div>
-        {% endif %}
-    </body>
-    </html>
-    """)
-    rendered_html = html_template.render(template_context)
+# Like the templates (see book_content), the stylesheet and fonts are loaded once per process.
+@lru_cache(maxsize=1)
+def get_render_resources() -> tuple:
+    """Returns the shared (FontConfiguration, CSS) pair; the @font-face fonts load only once."""
+    font_config = FontConfiguration()
+    css = CSS(string=build_font_face_css() + MAIN_CSS, font_config=font_config)
+    return font_config, css
 
-    # --- CSS Styling with Restored Print Date Page Style ---
-    fonts_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'fonts'))
-    baskerville_regular_uri = pathlib.Path(os.path.abspath(os.path.join(fonts_dir, 'LibreBaskerville-Regular.ttf'))).as_uri()
-    baskerville_italic_uri = pathlib.Path(os.path.abspath(os.path.join(fonts_dir, 'LibreBaskerville-Italic.ttf'))).as_uri()
-    baskerville_bold_uri = pathlib.Path(os.path.abspath(os.path.join(fonts_dir, 'LibreBaskerville-Bold.ttf'))).as_uri()
 
-    font_config = f"""
-    @font-face  {{ font-family: 'Baskerville'; src: url('{baskerville_regular_uri}'); }}
-    @font-face {{ font-family: 'Baskerville'; font-style: italic; src: url('{baskerville_italic_uri}'); }}
-    @font-face {{ font-family: 'Baskerville'; font-weight: bold; src: url('{baskerville_bold_uri}'); }}
-    """
-    
-    main_css = """
-    @page { size: 140mm 216mm; margin: 25mm; }
-    @page:blank { @bottom-center { content: ""; } }
-    @page main { @bottom-center { content: counter(page); font-family: 'Baskerville', serif; font-size: 9pt; } }
-    @page image-page-style { margin: 0; }
-
-    body { font-family: 'Baskerville', serif; font-size: 11pt; line-height: 1.6; -webkit-font-smoothing: antialiased; }
+# The shared FontConfiguration isn't documented as thread-safe, so renders sharing it
+# take turns. WeasyPrint layout holds the GIL anyway, so little concurrency is lost.
+_render_lock = threading.Lock()
 
-    .page { page-break-after: always; position: relative; height: 100%; }
-    body > div:last-of-type { page-break-after: auto; }
 
-    h1, h2, h3 { font-weight: bold; margin: 0; text-align: center; }
+def warm_up():
+    """Compiles the template and loads the stylesheet and fonts ahead of the first book."""
+    get_template_environment()
+    get_render_resources()
 
-    .debug-page pre {
-        white-space: pre-wrap;
-        word-wrap: break-word;
-        font-size: 8pt;
-        line-height: 1.5;
-    }
 
-    .image-page {
-        page: image-page-style;
-        display: flex;
-        justify-content: center;
-        align-items: center;
-        width: 100%;
-        height: 100%;
-        background-color: #000000;
-    }
-    .image-container img { max-width: 100%; max-height: 100%; object-fit: contain; }
+def layout_book(title: str, book_data: dict):
+    """Lays out the whole book in one pass and returns the WeasyPrint Document."""
+    rendered_html = get_template_environment().get_template("book.html").render(build_template_context(title, book_data))
+    font_config, css = get_render_resources()
+    with _render_lock:
+        return HTML(string=rendered_html, base_url=PROJECT_ROOT).render(stylesheets=[css], font_config=font_config)
 
-    .title-page { display: flex; flex-direction: column; align-items: center; text-align: center; }
-    .title-main-block { margin: auto 0; }
-    .book-title { font-size: 38pt; font-weight: bold; margin: 0.5em 0; line-height: 1.2; }
-    .subtitle { font-size: 14pt; margin: 1em 0; letter-spacing: 0.2em; text-transform: uppercase; }
-    .title-decoration { font-size: 24pt; margin: 1em 0; color: #555; }
-    
-   .print-date-page {
-        display: flex;
-        flex-direction: column;
-        justify-content: flex-end;
-        height: 100vh;
-        width: 100%;
-        padding: 32mm; /* Your book's margin */
-        box-sizing: border-box;
-        }
 
-    .print-date-page p {
-        text-align: center;
-        font-style: italic;
-        font-size: 10pt;
-        margin-bottom: 20pt; /* Push it a bit above the bottom */
-        }
+def render_book_pdf(title: str, book_data: dict, target) -> None:
+    """Lays out the book and writes the PDF to `target` (a path or file object)."""
+    document = layout_book(title, book_data)
+    with _render_lock:
+        document.write_pdf(target)
 
-    /* --- THIS IS THE ONLY CSS BLOCK THAT HAS CHANGED --- */
-    .toc-page { padding: 2em 0; page: main; }
-    .toc-page h1 { font-size: 32pt; margin-bottom: 1.2em; letter-spacing: 0.1em; }
-    .toc-list { width: 85%; margin: 0 auto; }
 
-    /* New robust styling for each TOC entry */
-    .toc-entry {
-        display: grid;
-        grid-template-columns: auto 1fr auto; /* Title | Leader | Page Number */
-        align-items: baseline;
-        gap: 0 0.5em; /* Add a small gap between columns */
-        margin-bottom: 1.2em;
-        font-size: 12pt;
-    }
-    .entry-title {
-        grid-column: 1; /* First column */
-        text-align: left;
-    }
-    .leader {
-        grid-column: 2; /* Second column, takes up remaining space */
-        border-bottom: 1px dotted rgba(0,0,0,0.5);
-    }
-    .toc-entry a {
-        grid-column: 3; /* Third column */
-        text-align: right;
-        text-decoration: none;
-        color: black;
-    }
-    /* This pseudo-element gets the page number and puts it in the link */
-    .toc-entry a::after {
-        content: target-counter(attr(href), page);
-    }
-    /* --- END OF THE CHANGED CSS BLOCK --- */
-    
+def store_pdf(filename: str, write) -> str:
+    """
+    Calls `write(path)` on a temp file and moves the result into the book store, so a
+    half-written PDF is never served. Returns the stored path.
+    """
+    book_store = get_book_store()
+    partial_path = book_store.temp_path(".pdf")
+    try:
+        write(partial_path)
+        return book_store.put_file(partial_path, name=filename)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
 
-    .chapter-title-page { display: flex; align-items: center; justify-content: center; }
-    .chapter-title-content { text-align: center; padding: 2em; }
-    .chapter-number { display: block; font-size: 16pt; font-style: italic; color: #666; margin-bottom: 1.5em; text-transform: uppercase; }
-    .chapter-title-content h2 { font-size: 32pt; font-weight: bold; text-transform: uppercase; letter-spacing: 0.1em; line-height: 1.3; }
 
-    .content-page {
-        padding: 0;
-    }
+def save_book_as_pdf(title: str, book_data: dict, filename: str) -> str:
+    """
+    Generates the final, professionally formatted PDF with all structure requirements met.
+    """
+    pin_book_images(book_data, filename)
+    book_data = with_print_images(book_data)
+    return store_pdf(filename, lambda path: render_book_pdf(title, book_data, path))
 
-    .main-content-body {
-        /* This resets the page counter to 1 right before the first chapter starts */
-        counter-reset: page 1;
-    }
 
-    /* This applies the 'main' page style (with numbers) to ALL pages inside the main-content-body */
-    .main-content-body .page {
-        page: main;
-    }
+def render_part(part: str, context: dict, padding_pages: int = 0, first_part: bool = False, last_part: bool = False):
+    """Lays out one section of the book as its own WeasyPrint Document (padding removed)."""
+    rendered_html = get_template_environment().get_template("part.html").render(
+        context, part=part, padding_pages=padding_pages, first_part=first_part, last_part=last_part
+    )
+    font_config, css = get_render_resources()
+    with _render_lock:
+        document = HTML(string=rendered_html, base_url=PROJECT_ROOT).render(stylesheets=[css], font_config=font_config)
+    return document.copy(document.pages[padding_pages:])
 
-    /* This applies the 'main' page style ONLY to the epilogue */
-    #epilogue.page {
-        page: main;
-    }
 
-    /* --- General Content Styling --- */
-    .content-page h2 { font-size: 20pt; text-transform: uppercase; margin-bottom: 2.5em; letter-spacing: 0.1em; }
-    .content-block { margin: 0 auto; max-width: 100%; }
-    .content-block p { text-align: justify; text-indent: 2em; margin-bottom: 0; line-height: 1.7; hyphens: auto; }
-    .content-block p + p { margin-top: 1em; }
-    .content-block p:first-child { text-indent: 0; }
-    .content-block p:first-child::first-letter { font-size: 3.5em;font-weight: bold; margin-right: -0.1em; }
+def anchor_page_index(document, anchor: str) -> int:
+    return next(i for i, page in enumerate(document.pages) if anchor in page.anchors)
 
-    .print-date-page {
-        display: flex;
-        align-items: center;
-        justify-content: center;
-    }
 
-    .print-date-page p {
-        text-align: center;
-        font-style: italic;
-        font-size: 10pt;
-    }
--
+class IncrementalBookRenderer:
     """
-    
-    css = CSS(string=font_config + main_css)
-    # Ensure you have renamed your project folder to have a clean path
-    base_url = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-    HTML(string=rendered_html, base_url=base_url).write_pdf(output_path, stylesheets=[css])
-    
-    return output_path
\ No newline at end of file
+    Lays out a book section by section instead of in one pass at the end.
+
+    Chapters are laid out through add_chapter() as soon as they are written, while the
+    rest of the book is still being generated. finish() then lays out the front matter,
+    opening and epilogue, fills in the table of contents with the page numbers the
+    chapters actually landed on, and writes all pages as one PDF. Every section uses the
+    same templates and stylesheet as save_book_as_pdf(), and blank padding pages keep the
+    page counter continuous, so the result has the same pages and numbers.
+    """
+
+    def __init__(self, title: str, filename: str):
+        self.title = title
+        self.filename = filename
+        self.chapter_documents = {}
+
+    def add_chapter(self, index: int, chapter: dict):
+        """Lays out chapter `index` (0-based); the chapter dict is as in book_data["chapters"]."""
+        pin_book_images({"chapters": [chapter]}, self.filename)
+        chapter = with_print_images({"chapters": [chapter]})["chapters"][0]
+        context = {"book_title": self.title, "chapter": chapter, "chapter_number": index + 1}
+        self.chapter_documents[index] = render_part("chapter.html", context)
+
+    def layout(self, book_data: dict) -> tuple:
+        """
+        Lays out the remaining sections and stitches the book. Returns the Document and the
+        page number of every table-of-contents entry ({href: page}).
+        """
+        chapters = book_data.get("chapters", [])
+        for index, chapter in enumerate(chapters):
+            if index not in self.chapter_documents:
+                self.add_chapter(index, chapter)
+        chapter_documents = [self.chapter_documents[index] for index in range(len(chapters))]
+
+        context = build_template_context(self.title, with_print_images({**book_data, "chapters": []}))
+        has_closing = context["has_epilogue"]
+        front = render_part("front_matter.html", context, first_part=True)
+        opening = render_part("opening.html", context)
+
+        # The contents page count shifts every later page, so lay it out until it is stable
+        # (a long contents list may need a second page; usually one pass is enough).
+        contents_pages = 1
+        while True:
+            page = len(front.pages) + contents_pages + 1
+            page_numbers = {}
+            for anchor in ("preface", "prologue"):
+                if any(anchor in p.anchors for p in opening.pages):
+                    page_numbers[f"#{anchor}"] = page + anchor_page_index(opening, anchor)
+            page += len(opening.pages)
+            for number, document in enumerate(chapter_documents, start=1):
+                page_numbers[f"#chapter-{number}"] = page + anchor_page_index(document, f"chapter-{number}")
+                page += len(document.pages)
+            closing = None
+            if has_closing:
+                closing = render_part("closing.html", context, padding_pages=page - 1, last_part=True)
+                page_numbers["#epilogue"] = page + anchor_page_index(closing, "epilogue")
+
+            toc_entries = [{**entry, "page": page_numbers.get(entry["href"])} for entry in context["toc_entries"]]
+            contents = render_part("contents.html", {**context, "toc_entries": toc_entries}, padding_pages=len(front.pages))
+            if len(contents.pages) == contents_pages:
+                break
+            contents_pages = len(contents.pages)
+
+        documents = [front, contents, opening] + chapter_documents + ([closing] if closing else [])
+        all_pages = [p for document in documents for p in document.pages]
+        return front.copy(all_pages), page_numbers
+
+    def finish(self, book_data: dict) -> str:
+        """Lays out the remaining sections, stitches the book and returns the stored PDF path."""
+        document, _ = self.layout(book_data)
+        pin_book_images(book_data, self.filename)
+
+        def write(path):
+            with _render_lock:
+                document.write_pdf(path)
+
+        return store_pdf(self.filename, write)
@@ -0,0 +1,79 @@
+# app/book_reuse.py
+import asyncio
+import os
+from typing import Optional
+from dotenv import load_dotenv
+from app.cache import SQLiteCache, SingleFlight
+from app.file_store import get_book_store
+
+load_dotenv()
+
+# Identical orders (same normalized birth details and length) are answered with the book
+# an earlier order produced, as long as it finished within the reuse window and its PDF is
+# still in generated_books/. Double-clicks, client retries and re-orders then cost nothing.
+BOOK_REUSE_ENABLED = os.getenv("BOOK_REUSE_ENABLED", "true").lower() not in ("0", "false", "no")
+BOOK_REUSE_WINDOW_SECONDS = int(os.getenv("BOOK_REUSE_WINDOW_SECONDS", str(24 * 3600)))
+BOOK_REUSE_INDEX_PATH = os.getenv("BOOK_REUSE_INDEX_PATH", "cache/finished_books.sqlite3")
+BOOK_REUSE_MAX_ENTRIES = int(os.getenv("BOOK_REUSE_MAX_ENTRIES", "10000"))
+
+_book_index = None
+# Orders arriving while an identical one is being generated wait for that generation
+book_runs = SingleFlight()
+
+
+def _get_book_index() -> SQLiteCache:
+    global _book_index
+    if _book_index is None:
+        _book_index = SQLiteCache(BOOK_REUSE_INDEX_PATH, BOOK_REUSE_WINDOW_SECONDS, BOOK_REUSE_MAX_ENTRIES)
+    return _book_index
+
+
+async def find_finished_book(key: str) -> Optional[dict]:
+    """The response of a recent identical order, or None if there is none or its PDF is gone."""
+    entry = await _get_book_index().aget(key)
+    if entry is None:
+        return None
+    book_store = await asyncio.to_thread(get_book_store)
+    if not book_store.exists(entry["filename"]):
+        # Evicted from the book store; the next order regenerates it
+        await _get_book_index().adelete(key)
+        return None
+    await asyncio.to_thread(book_store.touch, entry["filename"])
+    return entry["result"]
+
+
+async def remember_finished_book(key: str, filename: str, result: dict):
+    await _get_book_index().aset(key, {"filename": filename, "result": result})
+
+
+class EventFanout:
+    """
+    Forwards the progress events of a shared generation to every order waiting on it.
+    Orders that attach late only see the events emitted after they joined. Chapter text
+    ("token" events) only goes to the streaming orders.
+    """
+
+    def __init__(self):
+        self._listeners = []
+        self._streaming = []
+
+    @property
+    def streaming(self) -> bool:
+        """Whether any waiting order streams the chapter text."""
+        return bool(self._streaming)
+
+    def add(self, listener, streaming: bool = False):
+        if listener:
+            self._listeners.append(listener)
+            if streaming:
+                self._streaming.append(listener)
+
+    def remove(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+        if listener in self._streaming:
+            self._streaming.remove(listener)
+
+    def __call__(self, event: str, payload: dict):
+        for listener in list(self._streaming if event == "token" else self._listeners):
+            listener(event, payload)
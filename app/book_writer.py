@@ -1,52 +1,114 @@
 # app/book_writer.py
 
-from openai import AsyncOpenAI
 import os
 import asyncio
 import json
-import random
-import string
-import httpx
+from typing import Callable, Optional, Union
 from app.prompt_builder import (
     build_book_structure_prompt, # <-- NEW
     build_dynamic_chapter_prompt, # <-- NEW
+    build_chapter_outline_prompt,
+    build_chapter_section_prompt,
     build_summarization_prompt,
-    build_safe_image_prompt_generation_prompt
+    build_safe_image_prompt_generation_prompt,
+    build_image_brief_prompt,
+    build_batch_image_brief_prompt
 )
+from app.rate_limiter import limited_chat_completion, limited_chat_completion_stream, limited_image_generation
+from app.http_clients import get_http_client, get_openai_client
+from app.image_processing import prepare_print_image
+from app.file_store import get_image_store
+from app.chart_digest import build_chart_digest
+from app.metrics import stage_timer
+from app.checkpoints import BookCheckpoint
+from app.cache import SQLiteCache, SingleFlight, canonical_hash
 from dotenv import load_dotenv
 
 load_dotenv()
 
-openai = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 MODEL_TEXT = "gpt-4-1106-preview"
 MODEL_IMAGE = "dall-e-3"
+# How many chapter texts may be written at once.
+# Set to 1 to fall back to the old strictly sequential behaviour.
+# Request/token throttling is handled by app.rate_limiter, not by sleeping.
+MAX_CONCURRENT_CHAPTERS = int(os.getenv("MAX_CONCURRENT_CHAPTERS", "4"))
+# Illustrations (summary -> safe prompt -> DALL-E -> download) run as a separate stage
+# that overlaps with text generation, with their own limit.
+MAX_CONCURRENT_IMAGES = int(os.getenv("MAX_CONCURRENT_IMAGES", "2"))
+# How a chapter's image summary and DALL-E prompt are produced:
+#   separate - a summary call, then a safe-prompt call (two round trips per chapter; default)
+#   combined - one JSON call per chapter returning both
+#   batch    - JSON calls for up to IMAGE_BRIEF_BATCH_SIZE chapters each, once every chapter
+#              is written. Fewest calls, but the images no longer overlap with the writing.
+IMAGE_BRIEF_MODE = os.getenv("IMAGE_BRIEF_MODE", "separate").lower()
+IMAGE_BRIEF_MAX_TOKENS = 500 # per chapter
+# The model returns at most 4096 tokens, so one batch call covers at most 8 chapters
+IMAGE_BRIEF_BATCH_SIZE = 4096 // IMAGE_BRIEF_MAX_TOKENS
+# Chapters longer than this are planned as an outline and written as concurrent sections
+# of about SECTION_TARGET_WORDS each; one completion can't return much more than ~3k words.
+SECTIONED_CHAPTER_THRESHOLD_WORDS = int(os.getenv("SECTIONED_CHAPTER_THRESHOLD_WORDS", "3000"))
+SECTION_TARGET_WORDS = int(os.getenv("SECTION_TARGET_WORDS", "1500"))
+# Completion budget per section: ~1.33 tokens per word, with room to run over.
+SECTION_MAX_TOKENS = 4096
+IMAGE_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Book structures from the architect, cached per chart and tier: retries, upgrades to a
+# longer tier of the same chart, and duplicate orders skip the planning call.
+ARCHITECT_CACHE_ENABLED = os.getenv("ARCHITECT_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+ARCHITECT_CACHE_PATH = os.getenv("ARCHITECT_CACHE_PATH", "cache/book_structures.sqlite3")
+ARCHITECT_CACHE_TTL_SECONDS = int(os.getenv("ARCHITECT_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+ARCHITECT_CACHE_MAX_ENTRIES = int(os.getenv("ARCHITECT_CACHE_MAX_ENTRIES", "5000"))
+
+_architect_cache = None
+_architect_requests = SingleFlight()
+
+
+def _get_architect_cache() -> SQLiteCache:
+    global _architect_cache
+    if _architect_cache is None:
+        _architect_cache = SQLiteCache(ARCHITECT_CACHE_PATH, ARCHITECT_CACHE_TTL_SECONDS, ARCHITECT_CACHE_MAX_ENTRIES)
+    return _architect_cache
+# Optional progress callback signature: on_event(event_name, payload_dict).
+# Used by the job API to report which stage a book is in.
+ProgressCallback = Callable[[str, dict], None]
+# Whether to stream chapter text: fixed, or asked again as each chapter starts
+StreamText = Union[bool, Callable[[], bool]]
 # We no longer use WORDS_PER_SECTION_TARGET as the chapter sizes are now dynamic
 
 # generate_chapter_image and summarize_section remain unchanged.
 # ... (paste your existing generate_chapter_image and summarize_section functions here) ...
 
-async def generate_chapter_image(chapter_summary: str) -> str:
+async def generate_chapter_image(chapter_summary: str, image_prompt: Optional[str] = None) -> str:
     print(f"  - Generating image based on summary: '{chapter_summary[:80]}...'")
-    safe_prompt_request = build_safe_image_prompt_generation_prompt(chapter_summary)
     try:
-        sanitized_prompt_response = await openai.chat.completions.create(
-            model=MODEL_TEXT, messages=[{"role": "user", "content": safe_prompt_request}], 
-            temperature=0.7, max_tokens=300
-        )
-        image_prompt = sanitized_prompt_response.choices[0].message.content.strip().strip('"')
+        if not image_prompt:
+            safe_prompt_request = build_safe_image_prompt_generation_prompt(chapter_summary)
+            with stage_timer("image_prompt"):
+                sanitized_prompt_response = await limited_chat_completion(
+                    get_openai_client(), model=MODEL_TEXT, messages=[{"role": "user", "content": safe_prompt_request}], 
+                    temperature=0.7, max_tokens=300
+                )
+            image_prompt = sanitized_prompt_response.choices[0].message.content.strip().strip('"')
         print(f"    - Sanitized DALL-E Prompt: {image_prompt}")
-        response = await openai.images.generate(
-            model=MODEL_IMAGE, prompt=image_prompt, size="1024x1792", quality="standard", n=1
-        )
+        with stage_timer("image_generation"):
+            response = await limited_image_generation(
+                get_openai_client(), model=MODEL_IMAGE, prompt=image_prompt, size="1024x1792", quality="standard", n=1
+            )
         image_url = response.data[0].url
-        output_dir = "generated_images"
-        os.makedirs(output_dir, exist_ok=True)
-        image_filename = f"{''.join(random.choices(string.ascii_letters + string.digits, k=12))}.png"
-        output_path = os.path.join(output_dir, image_filename)
-        async with httpx.AsyncClient() as client:
-            image_response = await client.get(image_url)
-            image_response.raise_for_status()
-            with open(output_path, "wb") as f: f.write(image_response.content)
+        store = get_image_store()
+        # Stream to a temporary file so a failed download never leaves a truncated PNG behind
+        partial_path = store.temp_path(".png")
+        try:
+            with stage_timer("image_download"):
+                async with get_http_client().stream("GET", image_url) as image_response:
+                    image_response.raise_for_status()
+                    with open(partial_path, "wb") as f:
+                        async for chunk in image_response.aiter_bytes(IMAGE_DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+            # Hashing and indexing touch the disk, so keep them off the event loop
+            output_path = await asyncio.to_thread(store.put_file, partial_path, ".png")
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
         print(f"  - Chapter image saved to: {output_path}")
         return output_path
     except Exception as e:
@@ -56,8 +118,8 @@ async def generate_chapter_image(chapter_summary: str) -> str:
 async def summarize_section(text: str) -> str:
     summary_prompt = build_summarization_prompt(text)
     try:
-        response = await openai.chat.completions.create(
-            model=MODEL_TEXT, messages=[{"role": "user", "content": summary_prompt}],
+        response = await limited_chat_completion(
+            get_openai_client(), model=MODEL_TEXT, messages=[{"role": "user", "content": summary_prompt}],
             temperature=0.2, max_tokens=200
         )
         return response.choices[0].message.content.strip()
@@ -65,23 +127,296 @@ async def summarize_section(text: str) -> str:
         return text[:300] + "..."
 
 
-async def generate_content_block(prompt: str) -> str: # Simplified to just take a prompt
-    """Generates a block of text from a given prompt."""
+def _parse_image_brief(brief) -> Optional[dict]:
+    if not isinstance(brief, dict):
+        return None
+    summary, image_prompt = brief.get("summary"), brief.get("image_prompt")
+    if not (isinstance(summary, str) and summary.strip() and isinstance(image_prompt, str) and image_prompt.strip()):
+        return None
+    return {"summary": summary.strip(), "image_prompt": image_prompt.strip().strip('"')}
+
+
+async def generate_image_brief(text: str) -> dict:
+    """
+    The chapter's image summary and safe DALL-E prompt from a single JSON call.
+    If the call fails, falls back to the start of the text as the summary and no prompt,
+    which generate_chapter_image then writes itself.
+    """
+    try:
+        with stage_timer("image_brief"):
+            response = await limited_chat_completion(
+                get_openai_client(), model=MODEL_TEXT, messages=[{"role": "user", "content": build_image_brief_prompt(text)}],
+                response_format={"type": "json_object"}, temperature=0.5, max_tokens=IMAGE_BRIEF_MAX_TOKENS
+            )
+        brief = _parse_image_brief(json.loads(response.choices[0].message.content))
+        if brief:
+            return brief
+        print("  - Image brief was incomplete; summarizing instead.")
+    except Exception as e:
+        print(f"  - Could not generate image brief: {e}")
+    return {"summary": text[:300] + "...", "image_prompt": None}
+
+
+async def generate_image_briefs(texts: list) -> list:
+    """
+    generate_image_brief for several chapters, in concurrent calls of up to
+    IMAGE_BRIEF_BATCH_SIZE chapters each.
+    """
+    if len(texts) > IMAGE_BRIEF_BATCH_SIZE:
+        batches = [texts[i:i + IMAGE_BRIEF_BATCH_SIZE] for i in range(0, len(texts), IMAGE_BRIEF_BATCH_SIZE)]
+        return [brief for briefs in await asyncio.gather(*(generate_image_briefs(batch) for batch in batches)) for brief in briefs]
+    return await _generate_image_brief_batch(texts)
+
+
+async def _generate_image_brief_batch(texts: list) -> list:
+    """Briefs for several chapters in one call, falling back to one call per chapter."""
+    if len(texts) > 1:
+        try:
+            with stage_timer("image_brief_batch"):
+                response = await limited_chat_completion(
+                    get_openai_client(), model=MODEL_TEXT,
+                    messages=[{"role": "user", "content": build_batch_image_brief_prompt(texts)}],
+                    response_format={"type": "json_object"}, temperature=0.5,
+                    max_tokens=IMAGE_BRIEF_MAX_TOKENS * len(texts)
+                )
+            briefs = [_parse_image_brief(b) for b in json.loads(response.choices[0].message.content).get("briefs", [])]
+            if len(briefs) == len(texts) and all(briefs):
+                return briefs
+            print(f"  - Batched image briefs were incomplete ({len(briefs)} for {len(texts)} chapters); retrying per chapter.")
+        except Exception as e:
+            print(f"  - Could not generate batched image briefs: {e}")
+    return await asyncio.gather(*(generate_image_brief(text) for text in texts))
+
+
+async def generate_content_block(prompt: str, on_token: Optional[Callable[[str], None]] = None,
+                                 max_tokens: Optional[int] = None) -> str: # Simplified to just take a prompt
+    """
+    Generates a block of text from a given prompt. If `on_token` is given the
+    completion is streamed and each text delta is passed to it as it arrives.
+    """
     print(f"  - Generating content block...")
-    # This function is now simpler. The complex logic is in the prompt itself.
-    # For very large word counts per chapter, you might re-introduce the sectioning logic here.
-    response = await openai.chat.completions.create(
-        model=MODEL_TEXT, messages=[{"role": "user", "content": prompt}], temperature=0.75
+    # Long chapters are split into sections by generate_sectioned_chapter(); this is one completion.
+    options = {"max_tokens": max_tokens} if max_tokens else {}
+    if on_token:
+        streamed = await limited_chat_completion_stream(
+            get_openai_client(), on_token, model=MODEL_TEXT, messages=[{"role": "user", "content": prompt}],
+            temperature=0.75, **options
+        )
+        return streamed.text.strip()
+    response = await limited_chat_completion(
+        get_openai_client(), model=MODEL_TEXT, messages=[{"role": "user", "content": prompt}], temperature=0.75, **options
     )
     return response.choices[0].message.content.strip()
 
 
-async def generate_astrology_book(natal_chart_json: dict, target_word_count: int):
+class SectionStreamRelay:
+    """
+    Passes the deltas of concurrently written sections to `on_token` in reading order:
+    the earliest unfinished section streams live, later ones are buffered until it ends.
+    """
+
+    def __init__(self, on_token: Callable[[str], None], section_count: int):
+        self.on_token = on_token
+        self.buffers = [[] for _ in range(section_count)]
+        self.finished = [False] * section_count
+        self.current = 0
+
+    def token(self, index: int, text: str):
+        if index == self.current:
+            self.on_token(text)
+        else:
+            self.buffers[index].append(text)
+
+    def finish(self, index: int):
+        self.finished[index] = True
+        while self.current < len(self.finished) and self.finished[self.current]:
+            self.current += 1
+            if self.current < len(self.finished):
+                self.on_token("\n\n")
+                for text in self.buffers[self.current]:
+                    self.on_token(text)
+                self.buffers[self.current] = []
+
+
+async def generate_chapter_outline(chapter_details: dict, chart_digest: str, words: int, section_count: int) -> list:
+    """Plans a long chapter as `section_count` sections; returns [] if the plan is unusable."""
+    outline_prompt = build_chapter_outline_prompt(chapter_details, chart_digest, words, section_count)
+    with stage_timer("chapter_outline"):
+        response = await limited_chat_completion(
+            get_openai_client(),
+            model=MODEL_TEXT,
+            messages=[{"role": "user", "content": outline_prompt}],
+            response_format={"type": "json_object"},
+            temperature=0.4
+        )
+    try:
+        sections = json.loads(response.choices[0].message.content).get("sections", [])
+        if all(section.get("focus") and section.get("summary") for section in sections):
+            return sections
+    except (json.JSONDecodeError, AttributeError):
+        pass
+    return []
+
+
+async def generate_sectioned_chapter(chapter_details: dict, chart_digest: str, words: int,
+                                     on_token: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Writes a long chapter as sections: one outline call, then every section at once, each
+    given the outline as the summary of what comes before and after it. The chapter takes
+    about as long as its slowest section instead of one very long completion.
+    """
+    section_count = -(-words // SECTION_TARGET_WORDS) # ceiling division
+    outline = await generate_chapter_outline(chapter_details, chart_digest, words, section_count)
+    if len(outline) < 2:
+        print(f"  - Outline for '{chapter_details['theme_title']}' was unusable; writing it in one piece.")
+        chapter_prompt = build_dynamic_chapter_prompt(chapter_details, chart_digest, words)
+        return await generate_content_block(chapter_prompt, on_token=on_token)
+
+    section_words = words // len(outline)
+    relay = SectionStreamRelay(on_token, len(outline)) if on_token else None
+    print(f"  - Writing '{chapter_details['theme_title']}' as {len(outline)} sections of ~{section_words} words.")
+
+    async def write_section(index: int) -> str:
+        section_prompt = build_chapter_section_prompt(chapter_details, chart_digest, outline, index, section_words)
+        section_on_token = (lambda text: relay.token(index, text)) if relay else None
+        text = await generate_content_block(section_prompt, on_token=section_on_token, max_tokens=SECTION_MAX_TOKENS)
+        if relay:
+            relay.finish(index)
+        return text
+
+    sections = await asyncio.gather(*(write_section(i) for i in range(len(outline))))
+    return "\n\n".join(sections)
+
+
+def _emit(on_event: Optional[ProgressCallback], event: str, **payload):
+    if on_event:
+        on_event(event, payload)
+
+
+async def generate_chapter_text(index: int, chapter_details: dict, chart_digest: str, words_per_chapter: int,
+                                on_token: Optional[Callable[[str], None]] = None) -> str:
+    """Writes the text of a single chapter."""
+    section_title = chapter_details["theme_title"]
+    print(f"\n[Generating Content for Chapter {index+1}: {section_title}]")
+
+    with stage_timer("chapter_text"):
+        if words_per_chapter > SECTIONED_CHAPTER_THRESHOLD_WORDS:
+            return await generate_sectioned_chapter(chapter_details, chart_digest, words_per_chapter, on_token=on_token)
+
+        # Build the specific prompt for this chapter
+        chapter_prompt = build_dynamic_chapter_prompt(chapter_details, chart_digest, words_per_chapter)
+
+        # Generate the chapter text
+        return await generate_content_block(chapter_prompt, on_token=on_token)
+
+
+async def generate_chapter_illustration(index: int, section_text: str,
+                                       checkpoint: Optional[BookCheckpoint] = None,
+                                       brief: Optional[dict] = None) -> Optional[str]:
+    """
+    Summarizes a finished chapter and turns the summary into its image. Returns the image path.
+    `brief` is a summary and image prompt already made for this chapter (see IMAGE_BRIEF_MODE).
+    The summary, prompt and image are saved to `checkpoint` and reused from it when resuming.
+    """
+    saved = await checkpoint.load_chapter(index) if checkpoint else {}
+    if saved.get("image_path") and os.path.exists(saved["image_path"]):
+        print(f"\n[Chapter {index+1} image restored from checkpoint]")
+        return saved["image_path"]
+
+    print(f"\n[Illustrating Chapter {index+1}]")
+    image_summary, image_prompt = saved.get("summary"), saved.get("image_prompt")
+    if not image_summary:
+        if brief is None and IMAGE_BRIEF_MODE == "separate":
+            with stage_timer("image_summary"):
+                image_summary = await summarize_section(section_text)
+        else:
+            brief = brief or await generate_image_brief(section_text)
+            image_summary, image_prompt = brief["summary"], brief["image_prompt"]
+        if checkpoint:
+            await checkpoint.update_chapter(index, summary=image_summary, image_prompt=image_prompt)
+    image_path = await generate_chapter_image(image_summary, image_prompt)
+    if image_path and checkpoint:
+        await checkpoint.update_chapter(index, image_path=image_path)
+    if image_path:
+        # Build the print-sized derivative now, while text is still being written, so the
+        # PDF render only has to pick it up from the cache.
+        with stage_timer("print_image"):
+            await asyncio.to_thread(prepare_print_image, image_path)
+    return image_path
+
+
+async def call_architect(chart_digest: str, word_count_tier: str) -> dict:
+    structure_prompt = build_book_structure_prompt(chart_digest, word_count_tier)
+    with stage_timer("architect"):
+        structure_response = await limited_chat_completion(
+            get_openai_client(),
+            model=MODEL_TEXT,
+            messages=[{"role": "user", "content": structure_prompt}],
+            response_format={"type": "json_object"},
+            temperature=0.2
+        )
+    return json.loads(structure_response.choices[0].message.content)
+
+
+async def generate_book_structure(natal_chart_json: dict, chart_digest: str, word_count_tier: str,
+                                  use_cache: bool = True) -> dict:
+    """
+    The architect's chapter plan for this chart and tier. Plans are cached on disk, keyed
+    by the chart, tier, model and prompt, and concurrent requests for the same plan share
+    one call. Only usable plans (with chapters) are cached.
+    """
+    if not (ARCHITECT_CACHE_ENABLED and use_cache):
+        return await call_architect(chart_digest, word_count_tier)
+
+    key = canonical_hash({
+        "chart": natal_chart_json,
+        "tier": word_count_tier,
+        "model": MODEL_TEXT,
+        "prompt": build_book_structure_prompt(chart_digest, word_count_tier),
+    })
+
+    async def load() -> dict:
+        cache = _get_architect_cache()
+        cached = await cache.aget(key)
+        if cached is not None:
+            print("Using cached book structure for this chart and tier.")
+            return cached
+        book_structure = await call_architect(chart_digest, word_count_tier)
+        if book_structure.get("chapters"):
+            await cache.aset(key, book_structure)
+        return book_structure
+
+    return await _architect_requests.do(key, load)
+
+
+async def generate_astrology_book(natal_chart_json: dict, target_word_count: int, max_concurrent_chapters: int = None,
+                                  on_event: Optional[ProgressCallback] = None, stream_text: StreamText = False,
+                                  on_chapter: Optional[Callable[[int, dict], None]] = None,
+                                  checkpoint: Optional[BookCheckpoint] = None, use_structure_cache: bool = True):
     """
     Generates a thematically structured book by first analyzing the chart for core
     dynamics, then writing chapters based on that analysis.
+
+    Chapters are written concurrently, at most `max_concurrent_chapters` at a time
+    (defaults to MAX_CONCURRENT_CHAPTERS), and returned in the architect's order.
+    Each chapter's illustration is produced by a separate image stage as soon as its
+    text is done, so images overlap with the remaining text generation.
+
+    If `on_event` is given it receives "stage", "chapters_planned", "chapter_started",
+    "chapter_written" (text done) and "chapter_done" (text and image done) progress
+    events, plus a "token" event per text delta when `stream_text` is set. `stream_text`
+    may be a callable, checked as each chapter starts, when whether anyone reads the text
+    changes during the run.
+
+    `on_chapter(index, chapter)` is called with each finished chapter dict (heading,
+    content, image_path) as soon as it is done, e.g. to start laying it out early.
+
+    With a `checkpoint`, the structure and each chapter's text, summary and image are
+    saved as they complete, and stages already in the checkpoint are not redone.
+    `use_structure_cache=False` asks the architect for a fresh plan instead of a cached one.
     """
     print("\n--- STAGE 1: ARCHITECTING THE BOOK STRUCTURE ---")
+    _emit(on_event, "stage", stage="architect")
     
     # Determine the word count tier for the Architect prompt
     if target_word_count <= 20000:
@@ -93,15 +428,20 @@ async def generate_astrology_book(natal_chart_json: dict, target_word_count: int
         
     print(f"Targeting {word_count_tier} for a ~{target_word_count} word book.")
 
+    # The writers only need the placements, houses, angles and aspects. Digest the chart once
+    # and send that to every call instead of the full indented API response.
+    chart_digest = build_chart_digest(natal_chart_json)
+
     # 1. Call the Architect AI to get the book's structure
-    structure_prompt = build_book_structure_prompt(natal_chart_json, word_count_tier)
-    structure_response = await openai.chat.completions.create(
-        model=MODEL_TEXT,
-        messages=[{"role": "user", "content": structure_prompt}],
-        response_format={"type": "json_object"},
-        temperature=0.2
-    )
-    book_structure = json.loads(structure_response.choices[0].message.content)
+    book_structure = await checkpoint.load("structure") if checkpoint else None
+    if book_structure:
+        print("Book structure restored from checkpoint.")
+    else:
+        book_structure = await generate_book_structure(
+            natal_chart_json, chart_digest, word_count_tier, use_cache=use_structure_cache
+        )
+        if checkpoint and book_structure.get("chapters"):
+            await checkpoint.save("structure", book_structure)
     dynamic_chapters = book_structure.get("chapters", [])
 
     if not dynamic_chapters:
@@ -110,29 +450,71 @@ async def generate_astrology_book(natal_chart_json: dict, target_word_count: int
     print(f"--- Book structure defined with {len(dynamic_chapters)} thematic chapters. ---")
     for i, chap in enumerate(dynamic_chapters):
         print(f"  Chapter {i+1}: {chap['theme_title']}")
+    _emit(on_event, "chapters_planned", total=len(dynamic_chapters))
 
     # 2. Allocate word counts and generate content for each dynamic chapter
     # Simple allocation for now. Can be made more sophisticated later.
     words_per_chapter = int(target_word_count / len(dynamic_chapters))
     
-    chapters_data = []
-    print("\n--- STAGE 2: WRITING THE CHAPTERS ---")
-    for i, chapter_details in enumerate(dynamic_chapters):
-        section_title = chapter_details["theme_title"]
-        print(f"\n[Generating Content for Chapter {i+1}: {section_title}]")
-        
-        # Build the specific prompt for this chapter
-        chapter_prompt = build_dynamic_chapter_prompt(chapter_details, natal_chart_json, words_per_chapter)
-        
-        # Generate the chapter text
-        section_text = await generate_content_block(chapter_prompt)
-        
-        # Generate the summary and image for the chapter
-        image_summary = await summarize_section(section_text)
-        image_path = await generate_chapter_image(image_summary)
-        
-        chapters_data.append({"heading": section_title, "content": section_text, "image_path": image_path})
-        await asyncio.sleep(5) # Rate limiting
+    limit = max(1, max_concurrent_chapters or MAX_CONCURRENT_CHAPTERS)
+    text_semaphore = asyncio.Semaphore(limit)
+    image_semaphore = asyncio.Semaphore(max(1, MAX_CONCURRENT_IMAGES))
+    image_tasks = {}
+
+    async def illustrate_chapter(i: int, section_text: str, brief: Optional[dict] = None) -> Optional[str]:
+        async with image_semaphore:
+            image_path = await generate_chapter_illustration(i, section_text, checkpoint=checkpoint, brief=brief)
+        _emit(on_event, "chapter_done", index=i, heading=dynamic_chapters[i]["theme_title"])
+        if on_chapter:
+            on_chapter(i, {"heading": dynamic_chapters[i]["theme_title"], "content": section_text, "image_path": image_path})
+        return image_path
+
+    def streaming() -> bool:
+        return stream_text() if callable(stream_text) else stream_text
+
+    async def write_chapter(i: int, chapter_details: dict) -> str:
+        section_text = (await checkpoint.load_chapter(i)).get("content") if checkpoint else None
+        if section_text:
+            print(f"\n[Chapter {i+1} text restored from checkpoint]")
+            _emit(on_event, "chapter_started", index=i, heading=chapter_details["theme_title"])
+            if streaming():
+                _emit(on_event, "token", index=i, text=section_text)
+        else:
+            async with text_semaphore:
+                _emit(on_event, "chapter_started", index=i, heading=chapter_details["theme_title"])
+                on_token = (lambda text: _emit(on_event, "token", index=i, text=text)) if streaming() else None
+                section_text = await generate_chapter_text(i, chapter_details, chart_digest, words_per_chapter, on_token=on_token)
+            if checkpoint:
+                await checkpoint.update_chapter(i, content=section_text)
+        _emit(on_event, "chapter_written", index=i, heading=chapter_details["theme_title"])
+        # Hand the chapter to the image stage and free the text slot for the next chapter
+        if IMAGE_BRIEF_MODE != "batch":
+            image_tasks[i] = asyncio.create_task(illustrate_chapter(i, section_text))
+        return section_text
+
+    # No "stage" event here: chapters_planned has just moved jobs to "chapter 1"
+    print(f"\n--- STAGE 2: WRITING THE CHAPTERS (up to {limit} at a time, images in parallel) ---")
+    try:
+        # gather() preserves the input order, so chapters stay in the architect's sequence
+        chapter_texts = await asyncio.gather(
+            *(write_chapter(i, chapter_details) for i, chapter_details in enumerate(dynamic_chapters))
+        )
+        if IMAGE_BRIEF_MODE == "batch":
+            # Chapters whose summary is already checkpointed don't need a brief
+            saved = await asyncio.gather(*(checkpoint.load_chapter(i) for i in range(len(dynamic_chapters)))) if checkpoint else []
+            pending = [i for i in range(len(dynamic_chapters)) if not (saved and saved[i].get("summary"))]
+            briefs = dict(zip(pending, await generate_image_briefs([chapter_texts[i] for i in pending]))) if pending else {}
+            for i, section_text in enumerate(chapter_texts):
+                image_tasks[i] = asyncio.create_task(illustrate_chapter(i, section_text, briefs.get(i)))
+        image_paths = await asyncio.gather(*(image_tasks[i] for i in range(len(dynamic_chapters))))
+    finally:
+        for task in image_tasks.values():
+            task.cancel() # No-op for finished tasks; stops orphaned image work if a chapter failed
+
+    chapters_data = [
+        {"heading": chapter_details["theme_title"], "content": section_text, "image_path": image_path}
+        for chapter_details, section_text, image_path in zip(dynamic_chapters, chapter_texts, image_paths)
+    ]
 
     # 3. Generate static Preface/Intro/Outro (optional, but good for framing)
     # You can keep these or remove them for a purely analytical book.
@@ -0,0 +1,113 @@
+# app/cache.py
+import asyncio
+import hashlib
+import json
+import os
+import time
+from app.shared_state import connect_sqlite
+
+
+def canonical_hash(value) -> str:
+    """A stable SHA-256 over a JSON-serializable value (key order and whitespace don't matter)."""
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class SQLiteCache:
+    """
+    A small persistent key -> JSON value cache backed by a single SQLite file.
+
+    Entries older than `ttl_seconds` are treated as missing, and once the table grows
+    past `max_entries` the least recently used entries are evicted. Each operation
+    opens its own connection, so the cache is safe to use from worker threads.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+    def _connect(self):
+        # Every server process uses this file: WAL, a busy timeout, and the write lock up front
+        return connect_sqlite(self.path, immediate=True)
+
+    def get(self, key: str):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl_seconds and created_at < now - self.ttl_seconds:
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key: str, value):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            self._evict(conn, now)
+
+    def delete(self, key: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self, conn, now: float):
+        if self.ttl_seconds:
+            conn.execute("DELETE FROM entries WHERE created_at < ?", (now - self.ttl_seconds,))
+        if self.max_entries:
+            conn.execute(
+                "DELETE FROM entries WHERE key IN ("
+                " SELECT key FROM entries ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    async def aget(self, key: str):
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, value):
+        await asyncio.to_thread(self.set, key, value)
+
+    async def adelete(self, key: str):
+        await asyncio.to_thread(self.delete, key)
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one: the first caller starts the
+    work and everyone else arriving before it finishes awaits the same result.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key: str, fn):
+        """Runs `fn()` (a coroutine factory) unless a call for `key` is already in flight."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        # shield() so one impatient caller being cancelled doesn't cancel the shared call
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._inflight
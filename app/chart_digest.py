@@ -0,0 +1,72 @@
+# app/chart_digest.py
+import json
+
+SIGNS = [
+    "Aries", "Taurus", "Gemini", "Cancer", "Leo", "Virgo",
+    "Libra", "Scorpio", "Sagittarius", "Capricorn", "Aquarius", "Pisces",
+]
+# Aspects wider than this add little to the interpretation and are left out.
+MAX_ASPECT_ORB = 8.0
+
+
+def _degree(value) -> str:
+    return f"{float(value):.1f}"
+
+
+def _sign_position(longitude) -> str:
+    """An ecliptic longitude (0-360) as "Sign degree", e.g. 258.2 -> "Sagittarius 18.2"."""
+    longitude = float(longitude) % 360
+    return f"{SIGNS[int(longitude // 30)]} {_degree(longitude % 30)}"
+
+
+def _is_retrograde(planet: dict) -> bool:
+    return str(planet.get("is_retro", "false")).lower() == "true"
+
+
+def _placement_line(planet: dict) -> str:
+    line = f"{planet['name']}: {planet['sign']} {_degree(planet['norm_degree'])}"
+    if planet.get("house"):
+        line += f", house {planet['house']}"
+    if _is_retrograde(planet):
+        line += ", R"
+    return line
+
+
+def build_chart_digest(natal_chart_json: dict) -> str:
+    """
+    Condenses an AstrologyAPI western_horoscope response into the facts the writers use:
+    placements (sign, degree, house, retrograde), house cusps, angles and aspects within
+    MAX_ASPECT_ORB, tightest first. Speeds, ids and raw longitudes are dropped, and the
+    layout is fixed, so the same chart always yields the same text. A response in an
+    unexpected shape falls back to compact JSON rather than failing the book.
+    """
+    try:
+        lines = ["PLACEMENTS (body: sign degree, house; R = retrograde)"]
+        planets = list(natal_chart_json.get("planets", []))
+        if isinstance(natal_chart_json.get("lilith"), dict):
+            planets.append({"name": "Lilith", **natal_chart_json["lilith"]})
+        lines += [_placement_line(planet) for planet in planets]
+
+        houses = natal_chart_json.get("houses", [])
+        if houses:
+            lines.append("HOUSE CUSPS")
+            lines.append(" | ".join(f"{h['house']} {h['sign']} {_degree(float(h['degree']) % 30)}" for h in houses))
+
+        angles = [(label, natal_chart_json[key]) for label, key in
+                  (("Ascendant", "ascendant"), ("Midheaven", "midheaven"), ("Vertex", "vertex"))
+                  if natal_chart_json.get(key) is not None]
+        if angles:
+            lines.append("ANGLES")
+            lines.append(" | ".join(f"{label}: {_sign_position(value)}" for label, value in angles))
+
+        aspects = sorted(
+            (a for a in natal_chart_json.get("aspects", []) if float(a.get("orb", 0)) <= MAX_ASPECT_ORB),
+            key=lambda a: float(a.get("orb", 0))
+        )
+        if aspects:
+            lines.append("ASPECTS (orb in degrees, tightest first)")
+            lines += [f"{a['aspecting_planet']} {a['type'].lower()} {a['aspected_planet']} {_degree(a['orb'])}" for a in aspects]
+        return "\n".join(lines)
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        print(f"Could not digest the chart data ({e}); using compact JSON instead.")
+        return json.dumps(natal_chart_json, sort_keys=True, separators=(",", ":"))
@@ -0,0 +1,124 @@
+# app/checkpoints.py
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from app.cache import canonical_hash
+from app.shared_state import file_lock, prune_lock_files
+
+load_dotenv()
+
+# Each stage of a book (birth data, chart, structure, every chapter's text, summary and
+# image) is saved as it completes, so retrying a failed request picks up where it stopped.
+CHECKPOINTS_ENABLED = os.getenv("CHECKPOINTS_ENABLED", "true").lower() not in ("0", "false", "no")
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "cache/checkpoints")
+# Checkpoints of books nobody retried are deleted after this long.
+CHECKPOINT_TTL_SECONDS = int(os.getenv("CHECKPOINT_TTL_SECONDS", str(7 * 24 * 3600)))
+CHECKPOINT_PRUNE_INTERVAL_SECONDS = 3600
+
+
+def request_fingerprint(birth_date: str, birth_time: str, birth_location: str, target_word_count: int) -> str:
+    """Identifies a book request; resubmitting the same form resumes the same checkpoint."""
+    return canonical_hash([
+        " ".join(birth_date.split()).lower(),
+        " ".join(birth_time.split()).lower(),
+        " ".join(birth_location.split()).lower(),
+        int(target_word_count),
+    ])
+
+
+class BookCheckpoint:
+    """
+    The saved stages of one book: a directory of small JSON files, one per stage.
+    Writes are atomic (temp file + rename), so a crash never leaves a half-written stage.
+    The methods are coroutines: the file I/O runs in a thread, off the event loop.
+    """
+
+    def __init__(self, key: str, root: str = CHECKPOINT_DIR):
+        self.key = key
+        self.path = os.path.join(root, key)
+        # Chapter updates read, merge and rewrite a stage; concurrent ones must not interleave
+        self._update_lock = threading.Lock()
+
+    def _stage_path(self, stage: str) -> str:
+        return os.path.join(self.path, f"{stage}.json")
+
+    def _load(self, stage: str):
+        try:
+            with open(self._stage_path(stage), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _save(self, stage: str, value):
+        os.makedirs(self.path, exist_ok=True)
+        fd, partial_path = tempfile.mkstemp(dir=self.path, suffix=".part")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(partial_path, self._stage_path(stage))
+
+    def _update_chapter(self, index: int, fields: dict):
+        with self._update_lock:
+            stage = f"chapter-{index}"
+            self._save(stage, {**(self._load(stage) or {}), **fields})
+
+    async def load(self, stage: str):
+        """The saved output of `stage`, or None if that stage hasn't completed."""
+        return await asyncio.to_thread(self._load, stage)
+
+    async def save(self, stage: str, value):
+        await asyncio.to_thread(self._save, stage, value)
+
+    async def load_chapter(self, index: int) -> dict:
+        return await self.load(f"chapter-{index}") or {}
+
+    async def update_chapter(self, index: int, **fields):
+        """Merges `fields` (content, summary, image_path) into chapter `index`'s checkpoint."""
+        await asyncio.to_thread(self._update_chapter, index, fields)
+
+    async def clear(self):
+        """Deletes the checkpoint once the book is finished."""
+        await asyncio.to_thread(shutil.rmtree, self.path, ignore_errors=True)
+
+
+def prune_checkpoints(root: str = CHECKPOINT_DIR):
+    """Removes checkpoints that haven't been written to within CHECKPOINT_TTL_SECONDS."""
+    if not os.path.isdir(root):
+        return
+    cutoff = time.time() - CHECKPOINT_TTL_SECONDS
+    for entry in os.scandir(root):
+        if entry.is_dir() and entry.stat().st_mtime < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+async def prune_checkpoints_periodically():
+    """
+    Runs prune_checkpoints, and prune_lock_files for the per-request lock files, off the
+    event loop now and every CHECKPOINT_PRUNE_INTERVAL_SECONDS.
+    """
+    while True:
+        await asyncio.to_thread(prune_checkpoints)
+        await asyncio.to_thread(prune_lock_files)
+        await asyncio.sleep(CHECKPOINT_PRUNE_INTERVAL_SECONDS)
+
+
+@asynccontextmanager
+async def claim_checkpoint(birth_date: str, birth_time: str, birth_location: str, target_word_count: int):
+    """
+    Yields the checkpoint for this request, held exclusively for the block, or None when
+    checkpointing is disabled or another run of the same request (in any server process)
+    is using it. That run owns the saved stages; this one writes its book from scratch.
+    """
+    if not CHECKPOINTS_ENABLED:
+        yield None
+        return
+    key = request_fingerprint(birth_date, birth_time, birth_location, target_word_count)
+    async with file_lock(f"checkpoint-{key}", wait=False) as acquired:
+        if not acquired:
+            print("Another run of this request is using its checkpoint; writing without one.")
+        yield BookCheckpoint(key) if acquired else None
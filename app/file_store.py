@@ -0,0 +1,221 @@
+# app/file_store.py
+import glob
+import hashlib
+import os
+import tempfile
+import time
+from dotenv import load_dotenv
+from app.shared_state import connect_sqlite
+
+load_dotenv()
+
+# Point these at shared storage when several hosts serve the same books.
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", "generated_images")
+BOOK_STORE_DIR = os.getenv("BOOK_STORE_DIR", "generated_books")
+# The content of html/epub books, kept to render their PDF on demand. It includes the
+# customer's chart and birth data, so it lives outside the publicly served BOOK_STORE_DIR.
+BOOK_DATA_DIR = os.getenv("BOOK_DATA_DIR", "cache/book_data")
+IMAGE_STORE_QUOTA_MB = int(os.getenv("IMAGE_STORE_QUOTA_MB", "2048"))
+BOOK_STORE_QUOTA_MB = int(os.getenv("BOOK_STORE_QUOTA_MB", "5120"))
+# Files used more recently than this are never evicted, even when unreferenced, so an
+# image isn't removed while the book that will reference it is still being written.
+EVICTION_GRACE_SECONDS = int(os.getenv("STORE_EVICTION_GRACE_SECONDS", "3600"))
+
+INDEX_FILENAME = ".index.sqlite3"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileStore:
+    """
+    A directory of generated files with a metadata index and a byte quota.
+
+    Files are written atomically (temp file + rename). In content-addressed mode a file
+    is named by the SHA-256 of its bytes, so identical content is stored once. The index
+    (an SQLite file inside the directory) records each file's size, creation and last-use
+    times and the books referencing it. When the directory goes over its quota the least
+    recently used unreferenced files are deleted; in content-addressed mode, together with
+    their print derivatives (abc.print200.jpg next to abc.png). Files of other stores that
+    merely share a stem (a book's X.html and X.pdf) are evicted independently.
+    """
+
+    def __init__(self, root: str, quota_bytes: int, content_addressed: bool = True, on_evict=None):
+        # Absolute, so the paths handed out still resolve when the PDF renderer resolves
+        # <img src> against the project root rather than the working directory
+        self.root = os.path.abspath(root)
+        self.quota_bytes = quota_bytes
+        self.content_addressed = content_addressed
+        self.on_evict = on_evict
+        os.makedirs(root, exist_ok=True)
+        self.index_path = os.path.join(root, INDEX_FILENAME)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                " name TEXT PRIMARY KEY, size INTEGER NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS refs (name TEXT NOT NULL, book_id TEXT NOT NULL, PRIMARY KEY (name, book_id))")
+        self.adopt_untracked()
+
+    def _connect(self):
+        # Every server process uses this file: WAL, a busy timeout, and the write lock up front
+        return connect_sqlite(self.index_path, immediate=True)
+
+    def temp_path(self, suffix: str = "") -> str:
+        """A fresh temporary file inside the store (same filesystem, so the final rename is atomic)."""
+        fd, path = tempfile.mkstemp(dir=self.root, suffix=suffix + ".part")
+        os.close(fd)
+        return path
+
+    def put_file(self, temp_path: str, extension: str = "", name: str = None) -> str:
+        """
+        Moves a finished temp file into the store and returns its path. Content-addressed
+        stores name it by hash (and drop the duplicate if it already exists); otherwise
+        `name` is used.
+        """
+        if self.content_addressed:
+            name = f"{file_sha256(temp_path)}{extension}"
+        final_path = os.path.join(self.root, name)
+        now = time.time()
+        if self.content_addressed and os.path.exists(final_path):
+            os.remove(temp_path) # Same bytes are already stored
+        else:
+            os.replace(temp_path, final_path)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO files (name, size, created_at, last_used) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET size = excluded.size, last_used = excluded.last_used",
+                (name, os.path.getsize(final_path), now, now)
+            )
+        self.enforce_quota()
+        return final_path
+
+    def put_bytes(self, data: bytes, extension: str = "", name: str = None) -> str:
+        temp_path = self.temp_path(extension)
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        return self.put_file(temp_path, extension, name)
+
+    def add_reference(self, path: str, book_id: str):
+        """Marks a file as used by a book; referenced files are never evicted."""
+        name = os.path.basename(path)
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO refs (name, book_id) VALUES (?, ?)", (name, book_id))
+            conn.execute("UPDATE files SET last_used = ? WHERE name = ?", (time.time(), name))
+
+    def remove_references(self, book_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM refs WHERE book_id = ?", (book_id,))
+
+    def touch(self, path: str):
+        """Records a use of a stored file (a download, a reuse), so LRU eviction spares it."""
+        with self._connect() as conn:
+            conn.execute("UPDATE files SET last_used = ? WHERE name = ?", (time.time(), os.path.basename(path)))
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(os.path.join(self.root, os.path.basename(path)))
+
+    def enforce_quota(self):
+        """Evicts least recently used, unreferenced files until the store fits its quota."""
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+            if total <= self.quota_bytes:
+                return
+            candidates = conn.execute(
+                "SELECT name, size FROM files WHERE last_used < ?"
+                " AND name NOT IN (SELECT name FROM refs) ORDER BY last_used",
+                (time.time() - EVICTION_GRACE_SECONDS,)
+            ).fetchall()
+            evicted = []
+            for name, size in candidates:
+                if total <= self.quota_bytes:
+                    break
+                self._delete_file(name)
+                conn.execute("DELETE FROM files WHERE name = ?", (name,))
+                total -= size
+                evicted.append(name)
+        if evicted:
+            print(f"Evicted {len(evicted)} file(s) from {self.root} to stay within its quota.")
+        if self.on_evict:
+            for name in evicted:
+                self.on_evict(name)
+
+    def _delete_file(self, name: str):
+        paths = [os.path.join(self.root, name)]
+        if self.content_addressed:
+            stem = os.path.splitext(name)[0]
+            paths += glob.glob(os.path.join(self.root, glob.escape(stem) + ".print*"))
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def has_stem(self, stem: str) -> bool:
+        """Whether any indexed file is named `stem`.<extension> (e.g. any format of a book)."""
+        with self._connect() as conn:
+            # A range instead of LIKE, which would treat "_" in the stem as a wildcard
+            return conn.execute(
+                "SELECT 1 FROM files WHERE name > ? AND name < ? LIMIT 1", (stem + ".", stem + "/")
+            ).fetchone() is not None
+
+    def adopt_untracked(self):
+        """Indexes files that predate the store (e.g. old random-named images) as unreferenced."""
+        with self._connect() as conn:
+            known = {row[0] for row in conn.execute("SELECT name FROM files")}
+            for entry in os.scandir(self.root):
+                name = entry.name
+                # Skip the index itself, temp files and derivatives (abc.print200.jpg)
+                if not entry.is_file() or name.startswith(".") or name.endswith(".part") or name.count(".") != 1:
+                    continue
+                if name not in known:
+                    stat = entry.stat()
+                    conn.execute(
+                        "INSERT INTO files (name, size, created_at, last_used) VALUES (?, ?, ?, ?)",
+                        (name, stat.st_size, stat.st_mtime, stat.st_mtime)
+                    )
+
+
+_image_store = None
+_book_store = None
+
+
+def get_image_store() -> FileStore:
+    """Chapter images, named by content hash."""
+    global _image_store
+    if _image_store is None:
+        _image_store = FileStore(IMAGE_STORE_DIR, IMAGE_STORE_QUOTA_MB * 1024 * 1024)
+    return _image_store
+
+
+def book_data_path(name: str) -> str:
+    """Where the content of book `name` (without extension) is kept."""
+    return os.path.join(BOOK_DATA_DIR, f"{name}.json")
+
+
+def _forget_book(filename: str):
+    """
+    Called when a file is evicted from the book store. It no longer pins its chapter
+    images. The book's kept content is dropped only with its last format: an html book
+    whose on-demand PDF was evicted must still be able to render it again.
+    """
+    get_image_store().remove_references(filename)
+    stem = os.path.splitext(filename)[0]
+    data_path = book_data_path(stem)
+    if os.path.exists(data_path) and not get_book_store().has_stem(stem):
+        os.remove(data_path)
+        get_image_store().remove_references(os.path.basename(data_path))
+
+
+def get_book_store() -> FileStore:
+    """Finished books. They keep their readable names because users download them by URL."""
+    global _book_store
+    if _book_store is None:
+        _book_store = FileStore(
+            BOOK_STORE_DIR, BOOK_STORE_QUOTA_MB * 1024 * 1024, content_addressed=False, on_evict=_forget_book
+        )
+    return _book_store
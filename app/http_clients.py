@@ -0,0 +1,99 @@
+# app/http_clients.py
+import os
+from typing import TYPE_CHECKING
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import AsyncOpenAI
+
+load_dotenv()
+
+# Connection pool tuning shared by every outbound client.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+# Long chapter completions can legitimately take minutes.
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "600"))
+# Unset means the public API; benchmarks point this at a local stand-in.
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() not in ("0", "false", "no")
+
+_http_client = None
+_openai_client = None
+
+
+def _http2_supported() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2 # noqa: F401 -- installed with httpx[http2]
+        return True
+    except ImportError:
+        return False
+
+
+def create_http_client(timeout: float) -> "httpx.AsyncClient":
+    """
+    A keep-alive (and, when available, HTTP/2) client with the configured pool limits.
+    httpx is imported here, on first use, like openai: it is not needed to import the app.
+    """
+    import httpx
+    return httpx.AsyncClient(
+        http2=_http2_supported(),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
+
+def get_http_client() -> "httpx.AsyncClient":
+    """The shared client for AstrologyAPI calls and image downloads."""
+    global _http_client
+    if _http_client is None:
+        # Normally created by the app lifespan; created lazily for scripts and workers.
+        _http_client = create_http_client(HTTP_TIMEOUT)
+    return _http_client
+
+
+def get_openai_client() -> "AsyncOpenAI":
+    """
+    The shared OpenAI client, created (and the openai package imported) on first use.
+    Retries are left to app.rate_limiter so it sees every 429.
+    """
+    global _openai_client
+    if _openai_client is None:
+        from openai import AsyncOpenAI
+        _openai_client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=OPENAI_BASE_URL,
+            max_retries=0,
+            timeout=OPENAI_TIMEOUT,
+            http_client=create_http_client(OPENAI_TIMEOUT),
+        )
+    return _openai_client
+
+
+async def init_clients():
+    """
+    Opens the pooled HTTP client. Called once from the FastAPI lifespan handler; the OpenAI
+    client follows with the first book, so replicas that only serve files start faster.
+    """
+    get_http_client()
+    print(f"HTTP clients ready (HTTP/2: {_http2_supported()}, max connections: {HTTP_MAX_CONNECTIONS}).")
+
+
+async def close_clients():
+    """Closes the pooled clients and their connections on shutdown."""
+    global _http_client, _openai_client
+    if _openai_client is not None:
+        await _openai_client.close()
+        _openai_client = None
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -0,0 +1,57 @@
+# app/image_processing.py
+import os
+import tempfile
+
+# Chapter images are printed full-bleed on the 140x216 mm book page (see @page in the exporter).
+PAGE_WIDTH_MM = 140
+PAGE_HEIGHT_MM = 216
+MM_PER_INCH = 25.4
+PRINT_IMAGE_DPI = int(os.getenv("PRINT_IMAGE_DPI", "200"))
+PRINT_IMAGE_FORMAT = os.getenv("PRINT_IMAGE_FORMAT", "JPEG").upper() # JPEG or WEBP
+PRINT_IMAGE_QUALITY = int(os.getenv("PRINT_IMAGE_QUALITY", "85"))
+
+EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp"}
+
+
+def print_pixel_size(dpi: int) -> tuple:
+    """The largest pixel size that is still useful on the page at the given DPI."""
+    return (round(PAGE_WIDTH_MM / MM_PER_INCH * dpi), round(PAGE_HEIGHT_MM / MM_PER_INCH * dpi))
+
+
+def derivative_path(source_path: str, dpi: int = PRINT_IMAGE_DPI, image_format: str = PRINT_IMAGE_FORMAT) -> str:
+    """Where the print derivative of `source_path` lives: next to it, e.g. abc.print200.jpg."""
+    stem, _ = os.path.splitext(source_path)
+    return f"{stem}.print{dpi}.{EXTENSIONS[image_format]}"
+
+
+def prepare_print_image(source_path: str, dpi: int = PRINT_IMAGE_DPI, image_format: str = PRINT_IMAGE_FORMAT) -> str:
+    """
+    Returns a print-ready copy of a chapter image: scaled down (never up) to fit the page
+    at `dpi` and re-encoded as JPEG/WebP. The derivative is cached next to the original
+    and only rebuilt when the original is newer. Falls back to the original on any error.
+    """
+    from PIL import Image # only needed once a book has images
+    target_path = derivative_path(source_path, dpi, image_format)
+    try:
+        if os.path.exists(target_path) and os.path.getmtime(target_path) >= os.path.getmtime(source_path):
+            return target_path
+
+        with Image.open(source_path) as image:
+            image = image.convert("RGB") # JPEG has no alpha channel; DALL-E PNGs are opaque anyway
+            image.thumbnail(print_pixel_size(dpi), Image.LANCZOS)
+            save_options = {"quality": PRINT_IMAGE_QUALITY, "dpi": (dpi, dpi)}
+            if image_format == "JPEG":
+                save_options.update(optimize=True, progressive=True)
+            # A unique temp file: books sharing an image may build its derivative at the same time
+            fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(target_path) or ".", suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    image.save(f, format=image_format, **save_options)
+                os.replace(partial_path, target_path)
+            except BaseException:
+                os.remove(partial_path)
+                raise
+        return target_path
+    except Exception as e:
+        print(f"  - Could not prepare print image for {source_path}: {e}")
+        return source_path
@@ -0,0 +1,227 @@
+# app/jobs.py
+import asyncio
+import functools
+import json
+import os
+import socket
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from dotenv import load_dotenv
+from app.metrics import JOBS_IN_FLIGHT
+from app.shared_state import SHARED_STATE_DIR, connect_sqlite
+
+load_dotenv()
+
+# Number of books generated at the same time by the background workers.
+BOOK_JOB_WORKERS = int(os.getenv("BOOK_JOB_WORKERS", "2"))
+# Jobs waiting beyond this are rejected instead of queued.
+BOOK_JOB_QUEUE_SIZE = int(os.getenv("BOOK_JOB_QUEUE_SIZE", "50"))
+# Finished jobs are forgotten after this many seconds.
+BOOK_JOB_RETENTION_SECONDS = int(os.getenv("BOOK_JOB_RETENTION_SECONDS", "3600"))
+# Job records are kept here, so any server process can answer GET /jobs/{id}.
+BOOK_JOB_STORE_PATH = os.getenv("BOOK_JOB_STORE_PATH", os.path.join(SHARED_STATE_DIR, "jobs.sqlite3"))
+# The progress events a job record reflects (see JobManager._record_event)
+RECORDED_EVENTS = {"stage", "chapters_planned", "chapter_done"}
+
+
+class JobQueueFullError(Exception):
+    """Raised when a job is submitted while the queue is already full."""
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """
+    Job records in an SQLite file shared by every server process. Each record is stored
+    as JSON together with its owner ("host:pid" of the process running the job), so the
+    jobs of a process that died can be told apart from ones still running.
+    """
+
+    def __init__(self, path: str = BOOK_JOB_STORE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, owner TEXT NOT NULL,"
+                " status TEXT NOT NULL, updated_at REAL NOT NULL, record TEXT NOT NULL)"
+            )
+
+    def _connect(self):
+        return connect_sqlite(self.path, immediate=True)
+
+    def create(self, job: dict, owner: str):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (job_id, owner, status, updated_at, record) VALUES (?, ?, ?, ?, ?)",
+                (job["job_id"], owner, job["status"], job["updated_at"], json.dumps(job))
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT record FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id: str, **fields):
+        with self._connect() as conn:
+            row = conn.execute("SELECT record FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            job = {**json.loads(row[0]), **fields, "updated_at": time.time()}
+            conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ?, record = ? WHERE job_id = ?",
+                (job["status"], job["updated_at"], json.dumps(job), job_id)
+            )
+
+    def prune(self, cutoff: float):
+        """Forgets finished jobs last updated before `cutoff`."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE status IN ('completed', 'failed') AND updated_at < ?", (cutoff,))
+
+    def fail_abandoned(self, host: str):
+        """Marks queued/running jobs of dead processes on `host` as failed."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT job_id, owner FROM jobs WHERE status IN ('queued', 'running') AND owner LIKE ?", (f"{host}:%",)
+            ).fetchall()
+        for job_id, owner in rows:
+            if not _pid_alive(int(owner.rsplit(":", 1)[1])):
+                self.update(job_id, status="failed", error="The server process running this job stopped before the book was finished.")
+
+
+class JobManager:
+    """
+    Runs book generation in a bounded pool of background workers.
+
+    `runner` is an async callable `runner(payload, on_event)` that performs the whole
+    pipeline and returns the result dict. Progress events it emits are folded into
+    the job record, which is what GET /jobs/{id} returns. Records live in a JobStore,
+    so with several server processes any of them can report on any job; the queue and
+    workers are per process, and a job runs in the process that accepted it.
+
+    Store writes can wait up to SQLITE_BUSY_TIMEOUT_MS for other processes, so they run on
+    a dedicated thread, one at a time, which also keeps a job's updates in order.
+    """
+
+    def __init__(self, runner, workers: int = BOOK_JOB_WORKERS, queue_size: int = BOOK_JOB_QUEUE_SIZE):
+        self.runner = runner
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.store = None
+        self.host = socket.gethostname()
+        self._queue = None
+        self._tasks = []
+        self._store_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+
+    async def _in_store_thread(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._store_thread, functools.partial(function, *args, **kwargs))
+
+    async def start(self):
+        self.store = await asyncio.to_thread(JobStore)
+        await self._in_store_thread(self.store.fail_abandoned, self.host)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        print(f"Started {self.workers} book generation worker(s).")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, payload) -> dict:
+        """Queues a job and returns its (public) record straight away."""
+        await self._in_store_thread(self._prune)
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "stage": "queued",
+            "chapters_completed": 0,
+            "chapters_total": None,
+            "pdf_file": None,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        if self._queue.full():
+            raise JobQueueFullError("The book generation queue is full. Please try again in a few minutes.")
+        # Recorded before it is queued, so a worker never updates a job that doesn't exist yet
+        await self._in_store_thread(self.store.create, job, owner=f"{self.host}:{os.getpid()}")
+        try:
+            self._queue.put_nowait((job_id, payload))
+        except asyncio.QueueFull: # filled up while the record was written
+            await self._in_store_thread(self.store.update, job_id, status="failed", error="The queue was full.")
+            raise JobQueueFullError("The book generation queue is full. Please try again in a few minutes.")
+        JOBS_IN_FLIGHT.labels(status="queued").inc()
+        return dict(job)
+
+    async def get(self, job_id: str):
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def _update(self, job_id: str, **fields):
+        await self._in_store_thread(self.store.update, job_id, **fields)
+
+    def _on_event(self, job_id: str, event: str, payload: dict):
+        """Called on the event loop for every progress event; queues the write and returns."""
+        if event not in RECORDED_EVENTS:
+            return # e.g. chapter text, which a job doesn't store
+        asyncio.get_running_loop().run_in_executor(self._store_thread, self._apply_event, job_id, event, payload)
+
+    def _apply_event(self, job_id: str, event: str, payload: dict):
+        try:
+            self._record_event(job_id, event, payload)
+        except Exception as e:
+            print(f"Could not record progress of job {job_id}: {e}")
+
+    def _record_event(self, job_id: str, event: str, payload: dict):
+        if event == "stage":
+            self.store.update(job_id, stage=payload["stage"])
+        elif event == "chapters_planned":
+            self.store.update(job_id, chapters_total=payload["total"], stage="chapter 1")
+        elif event == "chapter_done":
+            job = self.store.get(job_id)
+            if not job:
+                return
+            completed = job["chapters_completed"] + 1
+            fields = {"chapters_completed": completed}
+            if job["chapters_total"] and completed < job["chapters_total"]:
+                fields["stage"] = f"chapter {completed + 1}"
+            self.store.update(job_id, **fields)
+
+    def _prune(self):
+        self.store.prune(time.time() - BOOK_JOB_RETENTION_SECONDS)
+
+    async def _worker(self, n: int):
+        while True:
+            job_id, payload = await self._queue.get()
+            JOBS_IN_FLIGHT.labels(status="queued").dec()
+            try:
+                await self._update(job_id, status="running", stage="starting")
+                result = await self.runner(payload, lambda event, data: self._on_event(job_id, event, data))
+                await self._update(job_id, status="completed", stage="done", result=result, pdf_file=result.get("pdf_file"))
+                print(f"Job {job_id} completed on worker {n}.")
+            except asyncio.CancelledError:
+                await self._update(job_id, status="failed", error="The server shut down before the book was finished.")
+                raise
+            except Exception as e:
+                print(f"Job {job_id} failed on worker {n}: {e}")
+                traceback.print_exc()
+                await self._update(job_id, status="failed", error=str(e))
+            finally:
+                self._queue.task_done()
@@ -1,35 +1,86 @@
 # app/main.py
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse # <-- Added FileResponse for the frontend
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse, Response, JSONResponse # <-- Added FileResponse for the frontend
 from fastapi.staticfiles import StaticFiles # <-- Added StaticFiles for PDF downloads
-from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
-from app.book_writer import generate_astrology_book
-from app.book_pdf_exporter import save_book_as_pdf
+from app.book_writer import StreamText, generate_astrology_book
+from app.render_pool import start_render_pool, stop_render_pool, render_book, IncrementalRender
 from app.astrology_api_client import get_natal_chart_data
 from app.prompt_builder import build_data_extraction_prompt 
+from app.birth_data_parser import parse_birth_data
+from app.rate_limiter import limited_chat_completion
+from app.jobs import JobManager, JobQueueFullError
+from app.http_clients import init_clients, close_clients, get_openai_client
+from app.checkpoints import claim_checkpoint, prune_checkpoints_periodically, request_fingerprint
+from app.book_reuse import BOOK_REUSE_ENABLED, EventFanout, book_runs, find_finished_book, remember_finished_book
+from app.book_ebook_exporter import OUTPUT_FORMATS, save_book_as_ebook, load_book_data
+from app.cache import SingleFlight, canonical_hash
+from app.shared_state import file_lock
+from app.admission import ADMISSION_QUEUE_SECONDS, OverloadedError, admitted, health_report
+from app.file_store import BOOK_STORE_DIR, get_book_store
+from app.metrics import stage_timer, STAGE_SECONDS, BOOKS_TOTAL, JOBS_IN_FLIGHT, PDF_RENDER_SECONDS, PDF_SIZE_BYTES
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from contextlib import asynccontextmanager
+import asyncio
 from dotenv import load_dotenv
 import os
 import re
+import time
 import traceback
 import json
-from openai import AsyncOpenAI
+import uuid
 from datetime import datetime 
+from typing import Optional
 
 load_dotenv()
 
-# Initialize OpenAI client for the parsing step
-openai = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 MODEL_TEXT = "gpt-4-1106-preview" # Use a smart model for parsing
+# Parse the form fields offline first; the LLM is only used when that fails
+LOCAL_BIRTH_PARSER_ENABLED = os.getenv("LOCAL_BIRTH_PARSER_ENABLED", "true").lower() not in ("0", "false", "no")
+# "single_pass" lays out the whole book in a render worker once it is written; "incremental"
+# gives the book a worker process of its own, which lays out each chapter as soon as it is
+# done and stitches the book at the end.
+PDF_RENDER_MODE = os.getenv("PDF_RENDER_MODE", "single_pass").lower()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pooled keep-alive clients shared by every module that talks to OpenAI or AstrologyAPI
+    await init_clients()
+    # Background workers for the asynchronous /jobs/ API
+    await job_manager.start()
+    # Warm worker processes for PDF rendering, so books render in parallel off the event loop
+    await start_render_pool()
+    # Deletes checkpoints of books nobody retried, and lock files nobody has used lately
+    checkpoint_pruner = asyncio.create_task(prune_checkpoints_periodically())
+    yield
+    checkpoint_pruner.cancel()
+    await job_manager.stop()
+    await stop_render_pool()
+    await close_clients()
 
 app = FastAPI(
     title="Personal Portrait Generator",
     description="An API to generate a personalized interpretation book based on a plain text birth prompt.",
-    version="3.0.0"
+    version="3.0.0",
+    lifespan=lifespan
 )
 
+class BookFiles(StaticFiles):
+    """The book store as static files. Every download counts as a use, so the store evicts least recently downloaded books first."""
+
+    async def get_response(self, path: str, scope):
+        # Only the books themselves are public: not the store's index or temp files, nor
+        # book content JSON left there by older versions (it holds the customer's birth data)
+        if os.path.basename(path).startswith(".") or path.endswith((".json", ".part")):
+            raise HTTPException(status_code=404, detail="Not Found")
+        response = await super().get_response(path, scope)
+        if response.status_code < 400:
+            await asyncio.to_thread(get_book_store().touch, path)
+        return response
+
 # This is necessary for the frontend to be able to link to the generated PDF
-app.mount("/generated_books", StaticFiles(directory="generated_books"), name="generated_books")
+os.makedirs(BOOK_STORE_DIR, exist_ok=True)
+app.mount("/generated_books", BookFiles(directory=BOOK_STORE_DIR), name="generated_books")
 
 # <<<====== 1. UPDATE BookRequest to match the new form fields ======>>>
 class BookRequest(BaseModel):
@@ -38,13 +89,16 @@ class BookRequest(BaseModel):
     birth_location: str = Field(..., description="The user's birth location, e.g., 'West Palm Beach, Florida'")
     # UPDATED FIELD:
     target_word_count: int = Field(15000, description="Desired book length: 15000, 30000, or 50000")
+    reuse_book_structure: bool = Field(True, description="Reuse a cached chapter plan for the same chart and length; false asks for a fresh one")
+    regenerate: bool = Field(False, description="Write a new book from scratch, even if an identical order finished recently, is in progress or left saved stages")
+    output_format: str = Field("pdf", description="pdf, html (a self-contained web page) or epub; the PDF of an html/epub book is rendered when first downloaded")
 
 def sanitize_filename(text: str) -> str:
     """Removes invalid characters from a string to make it a valid filename."""
     sanitized = re.sub(r'[\\/*?:"<>|]', "", text)
     return sanitized[:50].strip().replace(' ', '_')
 
-# YOUR ORIGINAL FUNCTION - UNTOUCHED
+# The fallback for birth details the offline parser can't resolve (see resolve_birth_data)
 async def extract_birth_data_from_prompt(prompt: str) -> dict:
     """
     Uses an LLM to parse a natural language prompt into structured birth data,
@@ -54,7 +108,8 @@ async def extract_birth_data_from_prompt(prompt: str) -> dict:
     extraction_prompt = build_data_extraction_prompt(prompt)
     
     try:
-        response = await openai.chat.completions.create(
+        response = await limited_chat_completion(
+            get_openai_client(),
             model=MODEL_TEXT,
             messages=[{"role": "user", "content": extraction_prompt}],
             response_format={"type": "json_object"},
@@ -75,65 +130,396 @@ async def extract_birth_data_from_prompt(prompt: str) -> dict:
         print(f"Failed to parse prompt with AI: {e}")
         raise ValueError("Could not understand the provided birth information. Please try again with a clear format like 'Month Day, Year, Time, City, State'.")
 
+async def resolve_birth_data(request: BookRequest) -> dict:
+    """
+    Turns the form fields into structured birth data. The offline parser and gazetteer
+    handle the common case instantly; anything it can't resolve goes to the LLM.
+    """
+    if LOCAL_BIRTH_PARSER_ENABLED:
+        birth_data = parse_birth_data(request.birth_date, request.birth_time, request.birth_location)
+        if birth_data:
+            print("Parsed birth data locally:", birth_data)
+            return birth_data
+        print("Local parser could not resolve the birth details, falling back to AI parsing.")
+
+    user_prompt = f"{request.birth_date} at {request.birth_time} in {request.birth_location}"
+    return await extract_birth_data_from_prompt(user_prompt)
+
 # This function is needed to serve your index.html file
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
     return FileResponse('index.html')
 
 
-@app.post("/generate-book/", summary="Generate a Personal Portrait Book")
-async def generate_book(request: BookRequest):
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Pipeline metrics in the Prometheus text format."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/health", summary="Server Health and Load")
+async def health():
     """
-    Generates a complete PDF book from a simple text prompt containing birth info.
+    Memory, CPU and render-budget pressure of this server process. Answers 503 while new
+    books would be held back, so a load balancer can route orders to another instance.
     """
+    report = await asyncio.to_thread(health_report)
+    return JSONResponse(report, status_code=200 if report["status"] == "ok" else 503)
+
+
+def validate_book_request(request: BookRequest):
     if not all([request.birth_date, request.birth_time, request.birth_location]):
         raise HTTPException(status_code=400, detail="Date, time, and location fields cannot be empty.")
-    
-    user_prompt = f"{request.birth_date} at {request.birth_time} in {request.birth_location}"
-    
+
     # <<<====== 2. VALIDATE the new word count field ======>>>
     if request.target_word_count not in [15000, 30000, 50000]:
         raise HTTPException(status_code=400, detail="Word count must be one of: 15000, 30000, 50000.")
 
-    print(f"--- Starting Book Generation for prompt: '{user_prompt}' ---")
+    if request.output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Output format must be one of: {', '.join(OUTPUT_FORMATS)}.")
+
+
+# Progress listeners of each generation that identical orders can attach to, by order key
+_book_fanouts = {}
+
+
+def book_order_key(request: BookRequest) -> str:
+    """
+    Identifies orders for the same book: "3:30 PM" and "15:30", or "September 4, 1986" and
+    "1986-09-04", are the same order. Birth details the offline parser can't resolve are
+    compared as typed (whitespace and case normalized).
+    """
+    birth_data = parse_birth_data(request.birth_date, request.birth_time, request.birth_location)
+    if birth_data is None:
+        order = request_fingerprint(request.birth_date, request.birth_time, request.birth_location, request.target_word_count)
+    else:
+        order = ["birth_data", birth_data, request.target_word_count]
+    return canonical_hash([order, request.output_format])
+
+
+async def run_book_pipeline(request: BookRequest, on_event=None, stream_text: bool = False,
+                            admission_wait: Optional[float] = ADMISSION_QUEUE_SECONDS) -> dict:
+    """
+    Runs the whole pipeline (parse -> chart -> architect -> chapters -> render) for one
+    request and returns the API response. `on_event(event, payload)` receives progress,
+    including chapter text deltas when `stream_text` is set. A new generation waits up to
+    `admission_wait` seconds (None: indefinitely) for the server to have room for it, then
+    raises OverloadedError.
+
+    An identical order (same birth data, length and format; see book_order_key) that finished
+    within the reuse window is answered with its book, and one that is still running, in this
+    or another server process, is joined instead of started again. Progress events go to every
+    order waiting in this process; a shared generation streams its chapter text while a
+    streaming order is waiting on it (checked as each chapter starts). The shared generation keeps running if a waiting client
+    disconnects, so a retry finds the book.
+    """
+    if request.regenerate or not BOOK_REUSE_ENABLED:
+        return await generate_new_book(request, on_event, stream_text, admission_wait)
+
+    key = book_order_key(request)
+    finished = await find_finished_book(key)
+    if finished:
+        print(f"Reusing the book of an identical order: {finished['pdf_file']}")
+        BOOKS_TOTAL.labels(outcome="reused").inc()
+        return finished
+
+    fanout = _book_fanouts.get(key)
+    if fanout is None:
+        fanout = _book_fanouts[key] = EventFanout()
+    else:
+        print("An identical order is already being generated; waiting for it.")
+        BOOKS_TOTAL.labels(outcome="coalesced").inc()
+    fanout.add(on_event, streaming=stream_text)
+
+    async def generate() -> dict:
+        try:
+            # Other server processes coalesce on the same lock file
+            async with file_lock(f"book-{key}"):
+                finished = await find_finished_book(key)
+                if finished:
+                    print(f"Another server process generated this book: {finished['pdf_file']}")
+                    return finished
+                result = await generate_new_book(request, fanout, lambda: fanout.streaming, admission_wait)
+                await remember_finished_book(key, os.path.basename(result.get("book_file") or result["pdf_file"]), result)
+                return result
+        finally:
+            _book_fanouts.pop(key, None)
 
     try:
-        birth_data = await extract_birth_data_from_prompt(user_prompt)
-        natal_chart_data = await get_natal_chart_data(**birth_data)
+        return dict(await book_runs.do(key, generate))
+    finally:
+        fanout.remove(on_event)
+
 
-        book_title = "The Architecture of You" # A more fitting title
-        print(f"Generating book components for: '{book_title}'...")
+async def generate_new_book(request: BookRequest, on_event=None, stream_text: StreamText = False,
+                            admission_wait: Optional[float] = ADMISSION_QUEUE_SECONDS) -> dict:
+    """run_book_pipeline without reuse: always generates, and records the pipeline metrics."""
+    def on_wait(reasons: list):
+        print(f"Server is busy ({'; '.join(reasons)}); waiting before starting this book.")
+        if on_event:
+            on_event("stage", {"stage": "waiting for capacity"})
 
+    async with admitted(admission_wait, on_wait):
+        start = time.perf_counter()
+        with JOBS_IN_FLIGHT.labels(status="running").track_inprogress():
+            try:
+                result = await _run_book_pipeline(request, on_event, stream_text)
+            except Exception:
+                BOOKS_TOTAL.labels(outcome="failed").inc()
+                raise
+        BOOKS_TOTAL.labels(outcome="completed").inc()
+        STAGE_SECONDS.labels(stage="total").observe(time.perf_counter() - start)
+        return result
+
+
+async def _run_book_pipeline(request: BookRequest, on_event, stream_text: StreamText) -> dict:
+    user_prompt = f"{request.birth_date} at {request.birth_time} in {request.birth_location}"
+    print(f"--- Starting Book Generation for prompt: '{user_prompt}' ---")
+
+    if request.regenerate:
+        # A fresh book: neither resumes nor disturbs an earlier attempt's saved stages
+        return await _write_book(request, on_event, stream_text, checkpoint=None)
+    # Stages saved by an earlier, failed attempt at the same request are reused
+    async with claim_checkpoint(request.birth_date, request.birth_time, request.birth_location, request.target_word_count) as checkpoint:
+        return await _write_book(request, on_event, stream_text, checkpoint)
+
+
+async def _write_book(request: BookRequest, on_event, stream_text: StreamText, checkpoint) -> dict:
+    def emit(event: str, **payload):
+        if on_event:
+            on_event(event, payload)
+
+    emit("stage", stage="parse")
+    birth_data = await checkpoint.load("birth_data") if checkpoint else None
+    if birth_data is None:
+        with stage_timer("parse"):
+            birth_data = await resolve_birth_data(request)
+        if checkpoint:
+            await checkpoint.save("birth_data", birth_data)
+    emit("stage", stage="chart")
+    natal_chart_data = await checkpoint.load("chart") if checkpoint else None
+    if natal_chart_data is None:
+        with stage_timer("chart"):
+            natal_chart_data = await get_natal_chart_data(**birth_data)
+        if checkpoint:
+            await checkpoint.save("chart", natal_chart_data)
+
+    book_title = "The Architecture of You" # A more fitting title
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # The random suffix keeps names unique across server processes and hosts
+    book_name = f"{sanitize_filename(book_title)}_{timestamp}_{uuid.uuid4().hex[:8]}"
+    filename = f"{book_name}.pdf"
+    print(f"Generating book components for: '{book_title}'...")
+
+    output_pdf = request.output_format == "pdf"
+    incremental = IncrementalRender(book_title, filename, request.target_word_count) if output_pdf and PDF_RENDER_MODE == "incremental" else None
+    try:
         # <<<====== 3. PASS target_word_count to the book writer ======>>>
-        book_data = await generate_astrology_book(
-            natal_chart_json=natal_chart_data,
-            target_word_count=request.target_word_count # Pass the new parameter
-        )
+        with stage_timer("writing"):
+            book_data = await generate_astrology_book(
+                natal_chart_json=natal_chart_data,
+                target_word_count=request.target_word_count, # Pass the new parameter
+                on_event=on_event,
+                stream_text=stream_text,
+                on_chapter=incremental.add_chapter if incremental else None,
+                checkpoint=checkpoint,
+                use_structure_cache=request.reuse_book_structure
+            )
         print("Book components generated successfully.")
+        emit("stage", stage="render")
+        if not output_pdf:
+            with stage_timer("render"):
+                output_path = await asyncio.to_thread(save_book_as_ebook, request.output_format, book_title, book_data, book_name)
+            if checkpoint:
+                await checkpoint.clear()
+            print("\n--- SUCCESS ---")
+            print(f"Personalized book saved to: {output_path}")
+            return {
+                "title": book_title,
+                "book_file": f"/generated_books/{os.path.basename(output_path)}",
+                "pdf_file": f"/books/{book_name}/pdf",
+                "preview": book_preview(book_data)
+            }
 
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{sanitize_filename(book_title)}_{timestamp}.pdf"
         print(f"Generating unique PDF: {filename}...")
-        
-        output_pdf_path = await run_in_threadpool(
-            save_book_as_pdf,
-            title=book_title,
-            book_data=book_data,
-            filename=filename
-        )
-        print("\n--- SUCCESS ---")
-        print(f"Personalized book saved to: {output_pdf_path}")
-        
-        pdf_url = f"/generated_books/{filename}"
+        with stage_timer("render"), PDF_RENDER_SECONDS.labels(mode="incremental" if incremental else "single_pass").time():
+            if incremental:
+                output_pdf_path = await incremental.finish(book_data)
+            else:
+                output_pdf_path = await render_book(
+                    title=book_title,
+                    book_data=book_data,
+                    filename=filename
+                )
+        PDF_SIZE_BYTES.observe(os.path.getsize(output_pdf_path))
+        if checkpoint:
+            await checkpoint.clear() # The book exists; a new request for it starts fresh
+    finally:
+        if incremental:
+            await incremental.close()
+    print("\n--- SUCCESS ---")
+    print(f"Personalized book saved to: {output_pdf_path}")
+
+    pdf_url = f"/generated_books/{filename}"
+
+    return {
+        "title": book_title,
+        "pdf_file": pdf_url,
+        "preview": book_preview(book_data)
+    }
 
-        return {
-            "title": book_title,
-            "pdf_file": pdf_url,
-            "preview": book_data.get('prologue_text', '') + "\n\n" + book_data.get('chapters', [{}])[0].get('content', '')[:1500] + "..."
-        }
 
+def book_preview(book_data: dict) -> str:
+    return book_data.get('prologue_text', '') + "\n\n" + book_data.get('chapters', [{}])[0].get('content', '')[:1500] + "..."
+
+async def run_queued_book(request: BookRequest, on_event) -> dict:
+    # A queued job is already waiting its turn, so it waits out pressure instead of failing
+    return await run_book_pipeline(request, on_event, admission_wait=None)
+
+job_manager = JobManager(runner=run_queued_book)
+
+
+@app.post("/generate-book/", summary="Generate a Personal Portrait Book")
+async def generate_book(request: BookRequest):
+    """
+    Generates a complete PDF book from a simple text prompt containing birth info.
+    The connection is held open until the PDF is ready; see POST /jobs/ for the
+    non-blocking variant. Answers 503 with Retry-After when the server is too busy to
+    start the book.
+    """
+    validate_book_request(request)
+
+    try:
+        return await run_book_pipeline(request)
+
+    except OverloadedError as e:
+        print(f"Book not admitted: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         print(f"\n--- AN ERROR OCCURRED ---")
         print(f"An error occurred during book generation: {e}")
         traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+SSE_KEEPALIVE_SECONDS = 15
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/generate-book/stream", summary="Generate a Book and Stream Its Progress")
+async def generate_book_stream(request: BookRequest):
+    """
+    Same pipeline as /generate-book/, but answers immediately with a Server-Sent Events
+    stream: "stage", "chapters_planned", "chapter_started", "token" (chapter text as it is
+    written), "chapter_done", and finally "done" with the pdf_file or "error". When the
+    server is too busy to start the book, "error" carries a retry_after in seconds.
+    """
+    validate_book_request(request)
+    events = asyncio.Queue()
+
+    async def run():
+        try:
+            result = await run_book_pipeline(
+                request, on_event=lambda event, data: events.put_nowait((event, data)), stream_text=True
+            )
+            events.put_nowait(("done", result))
+        except OverloadedError as e:
+            print(f"Book not admitted: {e}")
+            events.put_nowait(("error", {"detail": str(e), "retry_after": e.retry_after}))
+        except Exception as e:
+            print(f"\n--- AN ERROR OCCURRED ---")
+            print(f"An error occurred during streamed book generation: {e}")
+            traceback.print_exc()
+            events.put_nowait(("error", {"detail": str(e)}))
+
+    async def event_stream():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(events.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n" # Stops proxies from closing an idle stream
+                    continue
+                yield format_sse(event, data)
+                if event in ("done", "error"):
+                    break
+        finally:
+            # The client went away; nobody is left to receive this book
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Concurrent downloads of the same not-yet-rendered PDF share one render
+_pdf_renders = SingleFlight()
+
+
+@app.get("/books/{book_name}/pdf", summary="Download a Book as PDF")
+async def download_book_pdf(book_name: str):
+    """
+    Serves the PDF of a book generated as html or epub, rendering it on the first download.
+    """
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", book_name):
+        raise HTTPException(status_code=404, detail="Book not found.")
+    filename = f"{book_name}.pdf"
+    pdf_path = os.path.join(BOOK_STORE_DIR, filename)
+    if not os.path.exists(pdf_path):
+        saved = await asyncio.to_thread(load_book_data, book_name)
+        if saved is None:
+            raise HTTPException(status_code=404, detail="Book not found. It may have expired.")
+
+        async def render() -> str:
+            async with file_lock(f"pdf-{book_name}"):
+                if os.path.exists(pdf_path): # rendered by another server process meanwhile
+                    return pdf_path
+                with stage_timer("render"), PDF_RENDER_SECONDS.labels(mode="on_demand").time():
+                    path = await render_book(title=saved["title"], book_data=saved["book_data"], filename=filename)
+                PDF_SIZE_BYTES.observe(os.path.getsize(path))
+                return path
+
+        try:
+            pdf_path = await _pdf_renders.do(book_name, render)
+        except Exception as e:
+            print(f"Could not render the PDF of {book_name}: {e}")
+            traceback.print_exc()
+            raise HTTPException(status_code=500, detail=str(e))
+    else:
+        await asyncio.to_thread(get_book_store().touch, pdf_path)
+    return FileResponse(pdf_path, media_type="application/pdf", filename=filename)
+
+
+@app.post("/jobs/", status_code=202, summary="Queue a Personal Portrait Book")
+async def create_book_job(request: BookRequest):
+    """
+    Queues a book for generation by the background workers and returns a job id
+    immediately. Poll GET /jobs/{job_id} for the stage and the final pdf_file.
+    """
+    validate_book_request(request)
+
+    try:
+        job = await job_manager.submit(request)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "60"})
+
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['job_id']}"
+    }
+
+
+@app.get("/jobs/{job_id}", summary="Check a Book Generation Job")
+async def get_book_job(job_id: str):
+    """Reports the job's status, current stage (parse, chart, architect, chapter N, render) and pdf_file."""
+    job = await job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found. It may have expired.")
+    return job
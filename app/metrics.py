@@ -0,0 +1,73 @@
+# app/metrics.py
+from prometheus_client import Counter, Gauge, Histogram
+
+# Prometheus metrics for the book pipeline, exposed by GET /metrics in main.py.
+# Values are per process: with several server processes, scrape each of them.
+
+# Seconds to hours: a whole 50k book can take tens of minutes.
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+STAGE_SECONDS = Histogram(
+    "book_stage_duration_seconds",
+    "Time spent in each stage of book generation.",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+OPENAI_REQUEST_SECONDS = Histogram(
+    "openai_request_duration_seconds",
+    "OpenAI call latency, including rate-limit waits and retries.",
+    ["limiter"],
+    buckets=STAGE_BUCKETS,
+)
+OPENAI_TOKENS = Counter(
+    "openai_tokens_total",
+    "Tokens reported in response.usage.",
+    ["model", "kind"], # kind: prompt or completion
+)
+OPENAI_ERRORS = Counter(
+    "openai_errors_total",
+    "Failed OpenAI calls, including ones that were retried.",
+    ["limiter", "error"], # error: rate_limited, connection, server
+)
+JOBS_IN_FLIGHT = Gauge(
+    "book_jobs_in_flight",
+    "Books waiting in the /jobs/ queue (queued) or being generated by any endpoint (running).",
+    ["status"],
+)
+# Export both series from the start, not only after the first job
+for status in ("queued", "running"):
+    JOBS_IN_FLIGHT.labels(status=status)
+BOOKS_TOTAL = Counter(
+    "books_total",
+    "Finished book generations.",
+    ["outcome"], # completed, failed, reused (an identical recent book) or coalesced (joined a running one)
+)
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejections_total",
+    "Book generations turned away with 503 because the server was under pressure.",
+    ["reason"], # rss, memory, cpu or concurrency; one rejection can count under several
+)
+PDF_RENDER_SECONDS = Histogram(
+    "pdf_render_duration_seconds",
+    "Time to lay out and write a book PDF.",
+    ["mode"],
+    buckets=STAGE_BUCKETS,
+)
+PDF_SIZE_BYTES = Histogram(
+    "pdf_size_bytes",
+    "Size of the generated book PDFs.",
+    buckets=(256e3, 512e3, 1e6, 2e6, 5e6, 10e6, 20e6, 50e6, 100e6),
+)
+
+
+def stage_timer(stage: str):
+    """Context manager / decorator that records the duration of a pipeline stage."""
+    return STAGE_SECONDS.labels(stage=stage).time()
+
+
+def record_usage(model: str, usage):
+    """Adds a response's usage (if the API reported one) to the token counters."""
+    if usage is None:
+        return
+    OPENAI_TOKENS.labels(model=model, kind="prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+    OPENAI_TOKENS.labels(model=model, kind="completion").inc(getattr(usage, "completion_tokens", 0) or 0)
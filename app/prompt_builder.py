@@ -92,10 +92,11 @@ Based on the following summary of a personal interpretation, write a single, des
 Create a single-paragraph DALL-E prompt that captures the symbolic essence of this summary. Make it safe for all audiences and focus on visual metaphor.
 """
 
-def build_book_structure_prompt(natal_chart_json: dict, word_count_tier: str) -> str:
+def build_book_structure_prompt(chart_digest: str, word_count_tier: str) -> str:
     """
     Builds a prompt for an expert-level AI to analyze a natal chart and propose
     a book structure based on its core psychological dynamics.
+    `chart_digest` is the compact chart text from app.chart_digest.build_chart_digest().
     """
     return f"""
 You are a master psychological interpreter and book architect. Your task is to analyze the provided symbolic data (a natal chart) and design a thematic structure for a deeply personal book.
@@ -119,7 +120,7 @@ You are a master psychological interpreter and book architect. Your task is to a
 
 **SYMBOLIC DATA TO ANALYZE:**
 ---
-{json.dumps(natal_chart_json, indent=2)}
+{chart_digest}
 ---
 
 **EXAMPLE JSON OUTPUT STRUCTURE:**
@@ -143,9 +144,10 @@ You are a master psychological interpreter and book architect. Your task is to a
 # ==============================================================================
 # PROMPT 2: THE WRITER - Writes a single, dynamically-defined chapter
 # ==============================================================================
-def build_dynamic_chapter_prompt(chapter_details: dict, natal_chart_json: dict, word_target: int) -> str:
+def build_dynamic_chapter_prompt(chapter_details: dict, chart_digest: str, word_target: int) -> str:
     """
     Builds the main prompt for generating a single, thematic chapter of the book.
+    `chart_digest` is the compact chart text, computed once per book.
     """
     return f"""
 You are an expert, insightful, and compassionate writer, creating a deeply personal book for an individual.
@@ -162,7 +164,7 @@ Using the full symbolic data provided below as your source of truth, write a flo
 
 **SYMBOLIC DATA (Your sole source of truth for this interpretation):**
 ---
-{json.dumps(natal_chart_json, indent=2)}
+{chart_digest}
 ---
 
 YOUR TASK:
@@ -171,6 +173,74 @@ Aim for a word count of approximately {word_target} words.
 Begin writing the content directly. Do not repeat the section title or add any introductory pleasantries.
 """
 
+def build_chapter_outline_prompt(chapter_details: dict, chart_digest: str, word_target: int, section_count: int) -> str:
+    """
+    Builds a prompt that plans a long chapter as a sequence of sections, so the sections
+    can be written concurrently and still read as one chapter.
+    """
+    return f"""
+You are an expert, insightful, and compassionate writer planning one chapter of a deeply personal book. The chapter will be written in {section_count} consecutive sections of about {word_target // section_count} words each, for approximately {word_target} words in total.
+
+**CRITICAL INSTRUCTION: You MUST NOT use any astrological or technical terminology** in the plan. Translate everything into psychological and experiential language.
+
+**CHAPTER FOCUS:**
+- **Title:** "{chapter_details['theme_title']}"
+- **Core Idea:** "{chapter_details['summary']}"
+- **Key Concepts to Weave In:** {', '.join(chapter_details['keywords'])}
+
+**SYMBOLIC DATA (Your sole source of truth for this interpretation):**
+---
+{chart_digest}
+---
+
+YOUR TASK:
+Divide the chapter into exactly {section_count} sections that build on each other, from opening the theme to a resolved, hopeful close. Each section must cover distinct ground so the sections never repeat each other.
+Return ONLY a JSON object with a single key "sections": a list of exactly {section_count} objects, each with:
+- "focus": what the section explores, in one sentence.
+- "summary": 2-3 sentences on what the section says and the insight the reader leaves it with.
+"""
+
+
+def build_chapter_section_prompt(chapter_details: dict, chart_digest: str, outline: list, section_index: int, word_target: int) -> str:
+    """
+    Builds the prompt for one section of a sectioned chapter. The outline stands in for the
+    text of the other sections, which are being written at the same time.
+    """
+    section = outline[section_index]
+    story_so_far = " ".join(s["summary"] for s in outline[:section_index]) or "Nothing yet; this section opens the chapter."
+    coming_next = outline[section_index + 1]["summary"] if section_index + 1 < len(outline) else "Nothing; this section closes the chapter."
+    if section_index == 0:
+        placement = "This is the opening section: draw the reader into the chapter's theme."
+    elif section_index == len(outline) - 1:
+        placement = "This is the closing section: bring the chapter to a resolved, hopeful close."
+    else:
+        placement = "This is a middle section: continue seamlessly from what came before, without re-introducing the theme."
+    return f"""
+You are an expert, insightful, and compassionate writer, creating a deeply personal book for an individual.
+You are writing section {section_index + 1} of {len(outline)} of a chapter. The other sections are written separately from the same plan and will be joined to yours.
+
+**CRITICAL INSTRUCTION: You MUST NOT use any astrological or technical terminology.** Do not mention "Sun sign," "Moon," "ascendant," "Virgo," "zodiac," "houses," or any similar jargon. Your task is to **TRANSLATE** the meaning of the data into plain, insightful language about the person's personality, emotions, and life path. Write in a warm, knowing, second-person voice ("You are...", "You find...", "Your nature is...").
+
+**CHAPTER FOCUS:**
+- **Title:** "{chapter_details['theme_title']}"
+- **Core Idea:** "{chapter_details['summary']}"
+- **Key Concepts to Weave In:** {', '.join(chapter_details['keywords'])}
+
+**THE CHAPTER SO FAR (summary of the preceding sections):** {story_so_far}
+**THIS SECTION:** {section['focus']} {section['summary']}
+**THE NEXT SECTION (leave this ground to it):** {coming_next}
+
+**SYMBOLIC DATA (Your sole source of truth for this interpretation):**
+---
+{chart_digest}
+---
+
+YOUR TASK:
+{placement}
+Write only this section, in approximately {word_target} words of flowing prose separated into paragraphs by blank lines.
+Do not add headings, section numbers or introductory pleasantries, and do not repeat what the preceding sections covered.
+"""
+
 # (You can keep the summarization and safe image prompts as they are, they are still useful)
 def build_summarization_prompt(section_text: str) -> str:
     """Builds a prompt to summarize a generated section for image generation."""
@@ -201,5 +271,42 @@ Based on the following summary of a personal interpretation, write a single, des
 Create a single-paragraph DALL-E prompt that captures the symbolic essence of this summary. Make it safe for all audiences and focus on visual metaphor.
 """
 
+IMAGE_BRIEF_RULES = """- "summary": 2-3 sentences on the core themes, archetypes, and emotional tone of the text.
+- "image_prompt": a single, descriptive paragraph for an AI image generator (like DALL-E 3) that captures the symbolic essence of the summary. It must be symbolic, artistic, and abstract, focused on archetypal themes, natural elements, and cosmic energy. Do NOT depict specific, recognizable human figures; use archetypal descriptions like "a veiled feminine figure made of starlight," "a powerful craftsman forging a sword from a fallen star," or "a seeker looking out over a vast, otherworldly landscape." The mood should be mystical, elegant, and awe-inspiring, and the style "A beautiful and evocative digital painting with rich, deep colors and ethereal light, in a vertical 1024x1792 aspect ratio." Make it safe for all audiences and focus on visual metaphor."""
+
+
+def build_image_brief_prompt(section_text: str) -> str:
+    """
+    Summarizes a chapter and writes its safe DALL-E prompt in one call, replacing
+    build_summarization_prompt followed by build_safe_image_prompt_generation_prompt.
+    """
+    return f"""
+Read the following chapter of a personal interpretation. Its artwork will be generated from your answer.
+
+TEXT:
+---
+{section_text}
+---
+
+Return ONLY a JSON object with two keys:
+{IMAGE_BRIEF_RULES}
+"""
+
+
+def build_batch_image_brief_prompt(section_texts: list) -> str:
+    """build_image_brief_prompt for every chapter of a book at once."""
+    chapters = "\n\n".join(
+        f"CHAPTER {i + 1}:\n---\n{text}\n---" for i, text in enumerate(section_texts)
+    )
+    return f"""
+Read the following {len(section_texts)} chapters of a personal interpretation. Each chapter's artwork will be generated from your answer.
+
+{chapters}
+
+Return ONLY a JSON object with a single key "briefs": a list of exactly {len(section_texts)} objects, one per chapter and in chapter order, each with:
+{IMAGE_BRIEF_RULES}
+Give every chapter its own distinct imagery.
+"""
+
 # Note: build_data_extraction_prompt remains unchanged.
 # Note: build_astrology_section_prompt is now OBSOLETE.
\ No newline at end of file
@@ -0,0 +1,322 @@
+# app/rate_limiter.py
+import asyncio
+import email.utils
+import os
+import random
+import time
+from collections import deque, namedtuple
+from dotenv import load_dotenv
+from app.metrics import OPENAI_ERRORS, OPENAI_REQUEST_SECONDS, record_usage
+from app.shared_state import SHARED_STATE_DIR, connect_sqlite
+
+load_dotenv()
+
+# Budgets are shared by every request being served. With the "shared" backend they are
+# also shared by every server process on the host (uvicorn --workers N), so set them to the
+# account's limits; "process" gives each process its own full budget.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "shared").lower()
+RATE_LIMIT_STATE_PATH = os.getenv("RATE_LIMIT_STATE_PATH", os.path.join(SHARED_STATE_DIR, "rate_limits.sqlite3"))
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "150000"))
+OPENAI_IMAGES_PER_MINUTE = int(os.getenv("OPENAI_IMAGES_PER_MINUTE", "7"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+# Used to reserve budget for completions that don't set max_tokens; corrected from response.usage afterwards.
+DEFAULT_COMPLETION_TOKENS = int(os.getenv("OPENAI_DEFAULT_COMPLETION_TOKENS", "2000"))
+
+WINDOW_SECONDS = 60.0
+MAX_BACKOFF_SECONDS = 60.0
+
+
+class RateLimiter:
+    """
+    A sliding one-minute window budget for requests and (optionally) tokens.
+
+    Callers wait in FIFO order until both budgets have room. When the API answers
+    with a 429 the whole limiter pauses for the Retry-After period and shrinks its
+    effective budget, which then recovers gradually as calls succeed again.
+    """
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int = 0):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._window = deque()  # [timestamp, tokens] entries, oldest first
+        self._window_tokens = 0
+        self._paused_until = 0.0
+        self._scale = 1.0
+        self._lock = asyncio.Lock()
+
+    def _expire(self, now: float):
+        while self._window and self._window[0][0] <= now - WINDOW_SECONDS:
+            _, tokens = self._window.popleft()
+            self._window_tokens -= tokens
+
+    def _wait_time(self, now: float, tokens: int) -> float:
+        if self._paused_until > now:
+            return self._paused_until - now
+        if not self._window:
+            return 0.0
+        request_budget = max(1, int(self.requests_per_minute * self._scale))
+        if len(self._window) >= request_budget:
+            return self._window[0][0] + WINDOW_SECONDS - now
+        if self.tokens_per_minute:
+            token_budget = max(1, int(self.tokens_per_minute * self._scale))
+            if self._window_tokens + tokens > token_budget:
+                return self._window[0][0] + WINDOW_SECONDS - now
+        return 0.0
+
+    async def acquire(self, tokens: int = 0) -> list:
+        """Waits until the request fits in the budget and records it. Returns the window entry."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    entry = [now, tokens]
+                    self._window.append(entry)
+                    self._window_tokens += tokens
+                    return entry
+                await asyncio.sleep(wait)
+
+    def settle(self, entry: list, actual_tokens: int):
+        """Replaces the estimated token cost of a call with the real one from response.usage."""
+        if any(e is entry for e in self._window):
+            self._window_tokens += actual_tokens - entry[1]
+        entry[1] = actual_tokens
+
+    def back_off(self, seconds: float):
+        """Pauses every caller for `seconds` and shrinks the effective budget."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._scale = max(0.1, self._scale * 0.75)
+
+    def _recover(self):
+        self._scale = min(1.0, self._scale + 0.02)
+
+    async def _on_success(self, entry: list, actual_tokens):
+        """Settles the call's real token cost (None if unreported) and lets the budget recover."""
+        if actual_tokens is not None:
+            self.settle(entry, actual_tokens)
+        self._recover()
+
+    async def _on_rate_limited(self, seconds: float):
+        self.back_off(seconds)
+
+    async def run(self, call, estimated_tokens: int = 0, consume=None):
+        """
+        Runs `call` (a zero-argument coroutine factory) inside the budget, retrying
+        rate-limit and transient errors up to OPENAI_MAX_RETRIES times.
+
+        For streamed responses `consume(response)` is awaited after the call opens;
+        whatever it returns (e.g. a StreamedCompletion) becomes the result.
+        """
+        with OPENAI_REQUEST_SECONDS.labels(limiter=self.name).time():
+            return await self._run(call, estimated_tokens, consume)
+
+    async def _run(self, call, estimated_tokens: int, consume):
+        # Imported on first use: the openai package takes longer to import than the rest of the app
+        from openai import APIConnectionError, InternalServerError, RateLimitError
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            entry = await self.acquire(estimated_tokens)
+            try:
+                response = await call()
+            except RateLimitError as e:
+                OPENAI_ERRORS.labels(limiter=self.name, error="rate_limited").inc()
+                if attempt == OPENAI_MAX_RETRIES:
+                    raise
+                delay = _retry_after_seconds(e) or _backoff_seconds(attempt)
+                print(f"  - [{self.name}] Rate limited (429), backing off for {delay:.1f}s...")
+                await self._on_rate_limited(delay)
+                continue
+            except (APIConnectionError, InternalServerError) as e:
+                OPENAI_ERRORS.labels(limiter=self.name, error="connection" if isinstance(e, APIConnectionError) else "server").inc()
+                if attempt == OPENAI_MAX_RETRIES:
+                    raise
+                delay = _backoff_seconds(attempt)
+                print(f"  - [{self.name}] Transient API error ({e.__class__.__name__}), retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+                continue
+
+            if consume is not None:
+                response = await consume(response)
+            usage = getattr(response, "usage", None)
+            await self._on_success(entry, getattr(usage, "total_tokens", None) if usage is not None else None)
+            return response
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    A RateLimiter whose window, pause and budget scale live in SQLite, so every process
+    using the same state file draws from one budget. Within a process callers still queue
+    in FIFO order; the window uses wall-clock time, which all processes agree on. The
+    transactions run in threads: with other processes holding the write lock they can wait
+    up to SQLITE_BUSY_TIMEOUT_MS, which must not stall the event loop.
+    """
+
+    def __init__(self, name: str, requests_per_minute: int, tokens_per_minute: int = 0,
+                 path: str = RATE_LIMIT_STATE_PATH):
+        super().__init__(name, requests_per_minute, tokens_per_minute)
+        self.path = path
+        self._ready = False
+
+    def _connect(self):
+        if not self._ready:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with connect_sqlite(self.path, immediate=True) as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS calls ("
+                    " id INTEGER PRIMARY KEY AUTOINCREMENT, limiter TEXT NOT NULL, ts REAL NOT NULL, tokens INTEGER NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS calls_limiter_ts ON calls (limiter, ts)")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS limiters ("
+                    " name TEXT PRIMARY KEY, paused_until REAL NOT NULL, scale REAL NOT NULL)"
+                )
+                conn.execute("INSERT OR IGNORE INTO limiters (name, paused_until, scale) VALUES (?, 0, 1.0)", (self.name,))
+            self._ready = True
+        return connect_sqlite(self.path, immediate=True)
+
+    def _try_acquire(self, tokens: int) -> tuple:
+        """Records the call if the shared budget has room: (entry, 0), else (None, seconds to wait)."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM calls WHERE limiter = ? AND ts <= ?", (self.name, now - WINDOW_SECONDS))
+            paused_until, scale = conn.execute(
+                "SELECT paused_until, scale FROM limiters WHERE name = ?", (self.name,)
+            ).fetchone()
+            if paused_until > now:
+                return None, paused_until - now
+            count, window_tokens, oldest = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(tokens), 0), MIN(ts) FROM calls WHERE limiter = ?", (self.name,)
+            ).fetchone()
+            if count:
+                if count >= max(1, int(self.requests_per_minute * scale)):
+                    return None, oldest + WINDOW_SECONDS - now
+                if self.tokens_per_minute and window_tokens + tokens > max(1, int(self.tokens_per_minute * scale)):
+                    return None, oldest + WINDOW_SECONDS - now
+            cursor = conn.execute("INSERT INTO calls (limiter, ts, tokens) VALUES (?, ?, ?)", (self.name, now, tokens))
+            return [cursor.lastrowid, tokens], 0.0
+
+    async def acquire(self, tokens: int = 0) -> list:
+        async with self._lock:
+            while True:
+                entry, wait = await asyncio.to_thread(self._try_acquire, tokens)
+                if entry is not None:
+                    return entry
+                await asyncio.sleep(max(wait, 0.05))
+
+    def _settle_and_recover(self, entry: list, actual_tokens):
+        """settle() and _recover() in one transaction."""
+        with self._connect() as conn:
+            if actual_tokens is not None:
+                conn.execute("UPDATE calls SET tokens = ? WHERE id = ?", (actual_tokens, entry[0]))
+            conn.execute("UPDATE limiters SET scale = MIN(1.0, scale + 0.02) WHERE name = ? AND scale < 1.0", (self.name,))
+        if actual_tokens is not None:
+            entry[1] = actual_tokens
+
+    def settle(self, entry: list, actual_tokens: int):
+        with self._connect() as conn:
+            conn.execute("UPDATE calls SET tokens = ? WHERE id = ?", (actual_tokens, entry[0]))
+        entry[1] = actual_tokens
+
+    def back_off(self, seconds: float):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE limiters SET paused_until = MAX(paused_until, ?), scale = MAX(0.1, scale * 0.75) WHERE name = ?",
+                (time.time() + seconds, self.name)
+            )
+
+    def _recover(self):
+        with self._connect() as conn:
+            conn.execute("UPDATE limiters SET scale = MIN(1.0, scale + 0.02) WHERE name = ? AND scale < 1.0", (self.name,))
+
+    async def _on_success(self, entry: list, actual_tokens):
+        await asyncio.to_thread(self._settle_and_recover, entry, actual_tokens)
+
+    async def _on_rate_limited(self, seconds: float):
+        await asyncio.to_thread(self.back_off, seconds)
+
+
+def _backoff_seconds(attempt: int) -> float:
+    return min(MAX_BACKOFF_SECONDS, 2 ** attempt) + random.uniform(0, 1)
+
+
+def _retry_after_seconds(error) -> float:
+    """Reads the server's requested delay from a 429 response, if it sent one."""
+    headers = error.response.headers if error.response is not None else {}
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                retry_date = email.utils.parsedate_to_datetime(retry_after)
+                return max(0.0, retry_date.timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return 0.0
+
+
+def estimate_tokens(messages: list, max_tokens: int = None) -> int:
+    """Rough prompt + completion token estimate (about four characters per token)."""
+    prompt_chars = sum(len(str(m.get("content", ""))) for m in messages)
+    return prompt_chars // 4 + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+# Result of a streamed chat completion once every chunk has been read.
+StreamedCompletion = namedtuple("StreamedCompletion", ["text", "usage"])
+
+
+# The limiters every call goes through. Text and image models have separate quotas upstream.
+_limiter_class = SharedRateLimiter if RATE_LIMIT_BACKEND == "shared" else RateLimiter
+text_limiter = _limiter_class("chat", OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE)
+image_limiter = _limiter_class("images", OPENAI_IMAGES_PER_MINUTE)
+
+
+async def limited_chat_completion(client, **kwargs):
+    """client.chat.completions.create(**kwargs), throttled by the shared text limiter."""
+    estimated = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+    response = await text_limiter.run(lambda: client.chat.completions.create(**kwargs), estimated_tokens=estimated)
+    record_usage(kwargs["model"], getattr(response, "usage", None))
+    return response
+
+
+async def limited_image_generation(client, **kwargs):
+    """client.images.generate(**kwargs), throttled by the shared image limiter."""
+    return await image_limiter.run(lambda: client.images.generate(**kwargs))
+
+
+async def limited_chat_completion_stream(client, on_token, **kwargs) -> StreamedCompletion:
+    """
+    Streams a chat completion through the shared text limiter, calling `on_token(text)`
+    for every content delta. Returns the full text and the usage reported at the end.
+    """
+    estimated = estimate_tokens(kwargs["messages"], kwargs.get("max_tokens"))
+
+    async def consume(stream) -> StreamedCompletion:
+        parts = []
+        usage = None
+        async for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                delta = chunk.choices[0].delta.content
+                parts.append(delta)
+                on_token(delta)
+        return StreamedCompletion("".join(parts), usage)
+
+    streamed = await text_limiter.run(
+        lambda: client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs),
+        estimated_tokens=estimated,
+        consume=consume
+    )
+    record_usage(kwargs["model"], streamed.usage)
+    return streamed
@@ -0,0 +1,192 @@
+# app/render_pool.py
+import asyncio
+import multiprocessing
+import os
+from contextlib import AsyncExitStack
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+from app.admission import render_memory, render_cost_mb, tier_memory_mb
+
+load_dotenv()
+
+# Number of worker processes rendering PDFs. WeasyPrint layout is CPU-bound and holds the
+# GIL, so each concurrent render needs its own process. 0 renders in a thread instead.
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_executor = None
+# Incremental renders each hold a worker process of their own; at most RENDER_WORKERS of
+# them run at once (created on first use, so it binds to the running loop)
+_incremental_slots = None
+# In the worker process of an incremental render: its IncrementalBookRenderer
+_incremental_renderer = None
+
+
+def _init_worker():
+    """Runs once in each worker: imports WeasyPrint and loads the template, CSS and fonts."""
+    try:
+        from app.book_pdf_exporter import warm_up
+        warm_up()
+    except Exception as e:
+        # Never fail the initializer: that would break the whole pool. The render reports it.
+        print(f"Render worker {os.getpid()} could not warm up: {e}")
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _render(title: str, book_data: dict, filename: str) -> str:
+    from app.book_pdf_exporter import save_book_as_pdf
+    return save_book_as_pdf(title=title, book_data=book_data, filename=filename)
+
+
+def _get_incremental_renderer(title: str, filename: str):
+    global _incremental_renderer
+    if _incremental_renderer is None:
+        from app.book_pdf_exporter import IncrementalBookRenderer
+        _incremental_renderer = IncrementalBookRenderer(title, filename)
+    return _incremental_renderer
+
+
+def _add_incremental_chapter(title: str, filename: str, index: int, chapter: dict):
+    _get_incremental_renderer(title, filename).add_chapter(index, chapter)
+
+
+def _finish_incremental(title: str, filename: str, book_data: dict) -> str:
+    return _get_incremental_renderer(title, filename).finish(book_data)
+
+
+def _create_executor(workers: int = RENDER_WORKERS) -> ProcessPoolExecutor:
+    # "spawn" rather than fork: the server process has event loop and client threads running
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    )
+
+
+def _start_single_worker() -> ProcessPoolExecutor:
+    executor = _create_executor(workers=1)
+    executor.submit(_ping) # spawns the worker, which warms up while the chapter is queued
+    return executor
+
+
+def _report_warm_up(future: asyncio.Future):
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        print(f"PDF render workers could not start: {future.exception()}")
+    else:
+        print(f"Started {RENDER_WORKERS} PDF render worker(s).")
+
+
+async def start_render_pool():
+    """
+    Starts the worker processes. They spawn and import WeasyPrint in the background, so
+    server startup doesn't wait for them; the first book takes far longer to write.
+    """
+    global _executor
+    if RENDER_WORKERS <= 0 or _executor is not None:
+        return
+    _executor = _create_executor()
+    loop = asyncio.get_running_loop()
+    # Workers are spawned on demand; one task per worker starts (and warms) all of them now
+    warming = asyncio.gather(*(loop.run_in_executor(_executor, _ping) for _ in range(RENDER_WORKERS)))
+    warming.add_done_callback(_report_warm_up)
+
+
+async def stop_render_pool():
+    global _executor
+    if _executor is not None:
+        executor, _executor = _executor, None
+        await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+
+async def render_book(title: str, book_data: dict, filename: str) -> str:
+    """
+    Renders a book to the book store in a worker process and returns the output path.
+    The arguments are plain data, so they pickle cheaply across the process boundary.
+    Waits until the render's estimated memory fits in the render budget.
+    """
+    async with render_memory.reserve(render_cost_mb(book_data)):
+        return await _render_in_pool(title, book_data, filename)
+
+
+async def _render_in_pool(title: str, book_data: dict, filename: str) -> str:
+    global _executor
+    if RENDER_WORKERS <= 0:
+        from app.book_pdf_exporter import save_book_as_pdf
+        return await asyncio.to_thread(save_book_as_pdf, title, book_data, filename)
+    if _executor is None:
+        # Scripts and workers that never ran the lifespan get a pool on first use
+        _executor = _create_executor()
+    executor = _executor
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, _render, title, book_data, filename)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); replace the pool so later books still render
+        if _executor is executor:
+            print("PDF render pool broke; starting a fresh one.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            _executor = _create_executor()
+        raise
+
+
+class IncrementalRender:
+    """
+    Async front end for book_pdf_exporter.IncrementalBookRenderer: chapters are laid out
+    while the rest of the book is still being written.
+
+    Each incremental render gets a worker process of its own, which keeps the laid-out
+    chapters until the final stitch, so neither the layout (which holds the GIL) nor the
+    pages burden the server process. At the first chapter the render waits for one of
+    RENDER_WORKERS incremental slots and for its estimated memory in the render budget;
+    only then is the worker spawned. Both are held until close().
+    """
+
+    def __init__(self, title: str, filename: str, word_count: int):
+        self.title = title
+        self.filename = filename
+        self.cost_mb = tier_memory_mb(word_count)
+        self._executor = None
+        self._chapter_futures = []
+        self._reservation = AsyncExitStack()
+        self._reserving = None
+
+    async def _reserve(self):
+        global _incremental_slots
+        if _incremental_slots is None:
+            _incremental_slots = asyncio.Semaphore(max(1, RENDER_WORKERS))
+        await self._reservation.enter_async_context(_incremental_slots)
+        await self._reservation.enter_async_context(render_memory.reserve(self.cost_mb))
+        # The worker is spawned by its first submit, which blocks, so that happens off the loop
+        self._executor = await asyncio.to_thread(_start_single_worker)
+
+    async def _run(self, function, *args):
+        if self._reserving is None:
+            self._reserving = asyncio.ensure_future(self._reserve())
+        # Shielded: a cancelled chapter must not cancel the reservation the others share
+        await asyncio.shield(self._reserving)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, self.title, self.filename, *args)
+
+    def add_chapter(self, index: int, chapter: dict):
+        """Queues layout of a finished chapter. Must be called from the event loop."""
+        self._chapter_futures.append(asyncio.ensure_future(self._run(_add_incremental_chapter, index, chapter)))
+
+    async def finish(self, book_data: dict) -> str:
+        """Waits for the queued chapters, then lays out the rest and returns the PDF path."""
+        await asyncio.gather(*self._chapter_futures)
+        return await self._run(_finish_incremental, book_data)
+
+    async def close(self):
+        """Drops layouts that haven't started, ends the worker process and releases the memory."""
+        for future in self._chapter_futures:
+            future.cancel()
+        if self._reserving is not None:
+            self._reserving.cancel() # no-op once the reservation is held
+        if self._executor is not None:
+            await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+        await self._reservation.aclose()
@@ -0,0 +1,151 @@
+# app/shared_state.py
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dotenv import load_dotenv
+
+try:
+    import fcntl
+except ImportError: # Windows: locks only coordinate the threads and tasks of one process
+    fcntl = None
+
+load_dotenv()
+
+# State that every server process on the host shares (uvicorn --workers N): job records,
+# rate-limit budgets and lock files live here, next to the SQLite caches. Several hosts can
+# share it over a filesystem with working POSIX locks; SQLite's WAL mode does not work on
+# network filesystems, so such setups should give each host its own SHARED_STATE_DIR.
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", "cache/shared")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "30000"))
+LOCK_POLL_SECONDS = 0.2
+# Lock files not held by anyone are deleted once they are this old (see prune_lock_files)
+LOCK_FILE_TTL_SECONDS = 3600
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+def shared_path(name: str) -> str:
+    os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+    return os.path.join(SHARED_STATE_DIR, name)
+
+
+@contextmanager
+def connect_sqlite(path: str, immediate: bool = False):
+    """
+    A connection that commits on success and rolls back on error. WAL lets readers in other
+    processes proceed while one writes, and busy_timeout makes writers queue instead of
+    failing with "database is locked". `immediate` takes the write lock up front, for
+    read-modify-write transactions.
+    """
+    conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+    try:
+        conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def _lock_path(name: str) -> str:
+    directory = shared_path("locks")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{name}.lock")
+
+
+def _try_lock(f) -> bool:
+    if fcntl is None:
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(f.name, threading.Lock())
+        return lock.acquire(blocking=False)
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def _unlock(f):
+    if fcntl is None:
+        _local_locks[f.name].release()
+    else:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _is_current(f, path: str) -> bool:
+    """Whether the open lock file `f` is still the one at `path` (prune_lock_files may have removed it)."""
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(f.fileno())
+    return (opened.st_dev, opened.st_ino) == (current.st_dev, current.st_ino)
+
+
+@asynccontextmanager
+async def file_lock(name: str, wait: bool = True):
+    """
+    An exclusive lock on `name`, held across every process sharing SHARED_STATE_DIR.
+    Waiting polls instead of blocking, so the event loop keeps running. Locks are released
+    by the OS if the holder dies. With `wait=False` the block runs straight away and the
+    lock yields whether it was acquired.
+    """
+    path = _lock_path(name)
+    while True:
+        f = open(path, "a")
+        try:
+            acquired = _try_lock(f)
+            while wait and not acquired:
+                await asyncio.sleep(LOCK_POLL_SECONDS)
+                acquired = _try_lock(f)
+        except BaseException:
+            f.close()
+            raise
+        if not acquired or _is_current(f, path):
+            break
+        # The file was pruned while we waited for it; lock the one that replaces it
+        _unlock(f)
+        f.close()
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            _unlock(f)
+        f.close()
+
+
+def prune_lock_files(max_age_seconds: float = LOCK_FILE_TTL_SECONDS):
+    """
+    Deletes the lock files (one per book, checkpoint, ...) that nobody holds and that are
+    older than `max_age_seconds`. A file is only removed while this holds its lock, and
+    file_lock re-checks the path after locking, so a waiter never ends up on a deleted file.
+    """
+    directory = os.path.join(SHARED_STATE_DIR, "locks")
+    if fcntl is None or not os.path.isdir(directory):
+        return
+    cutoff = time.time() - max_age_seconds
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(".lock"):
+            continue
+        try:
+            if entry.stat().st_mtime >= cutoff:
+                continue
+            with open(entry.path, "a") as f:
+                if not _try_lock(f):
+                    continue # held right now
+                try:
+                    if _is_current(f, entry.path):
+                        os.remove(entry.path)
+                finally:
+                    _unlock(f)
+        except OSError:
+            pass # removed by another process meanwhile
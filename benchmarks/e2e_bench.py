@@ -0,0 +1,182 @@
+# benchmarks/e2e_bench.py
+"""
+Runs the real server end to end against local stand-ins for AstrologyAPI and OpenAI
+(benchmarks.fake_upstreams) and reports latency, throughput and time per stage.
+
+    python -m benchmarks.e2e_bench [--users 4] [--books 8] [--tiers 15000 30000 50000]
+                                   [--latency 0.3] [--seconds-per-token 0.002]
+                                   [--image-seconds 8] [--rate-429 0.05] [--output-scale 1.0]
+
+Both servers run as subprocesses in a scratch directory, so nothing is written to the
+project's generated_* folders and no network access or API keys are needed. Any extra
+environment (e.g. PDF_RENDER_MODE=incremental, OPENAI_TOKENS_PER_MINUTE=...) is passed
+through to the app server. The app's own rate limits still apply, so image-heavy runs are
+bounded by OPENAI_IMAGES_PER_MINUTE exactly as in production; raise it to model a higher tier.
+"""
+import argparse
+import asyncio
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BIRTH_DETAILS = [
+    ("1986-09-04", "15:30", "West Palm Beach, Florida"),
+    ("1992-03-17", "06:45", "Chicago, Illinois"),
+    ("1978-12-01", "23:10", "London, United Kingdom"),
+    ("2001-07-22", "12:00", "Sydney, Australia"),
+]
+STAGE_METRIC = re.compile(r'^book_stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} ([0-9.e+-]+)$')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(module: str, port: int, env: dict, cwd: str, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", module, "--host", "127.0.0.1", "--port", str(port)],
+        env={**os.environ, **env, "PYTHONPATH": PROJECT_ROOT}, cwd=cwd, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_until_up(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def scrape_stage_times(client: httpx.AsyncClient, app_url: str) -> dict:
+    """{stage: [sum, count]} from the app's /metrics."""
+    stages = defaultdict(lambda: [0.0, 0.0])
+    for line in (await client.get(f"{app_url}/metrics")).text.splitlines():
+        match = STAGE_METRIC.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            stages[stage][0 if kind == "sum" else 1] = float(value)
+    return stages
+
+
+async def run_tier(app_url: str, word_count: int, users: int, books: int) -> dict:
+    latencies, failures = [], []
+    remaining = iter(range(books))
+
+    async def user(client: httpx.AsyncClient, n: int):
+        for book in remaining: # users share one iterator, so `books` books are made in total
+            date, time_of_day, location = BIRTH_DETAILS[(n + book) % len(BIRTH_DETAILS)]
+            start = time.perf_counter()
+            response = await client.post(f"{app_url}/generate-book/", json={
+                "birth_date": date, "birth_time": time_of_day, "birth_location": location,
+                "target_word_count": word_count,
+            })
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                failures.append(f"{response.status_code}: {response.text[:200]}")
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        before = await scrape_stage_times(client, app_url)
+        start = time.perf_counter()
+        await asyncio.gather(*(user(client, n) for n in range(users)))
+        elapsed = time.perf_counter() - start
+        after = await scrape_stage_times(client, app_url)
+
+    stage_means = {}
+    for stage, (total, count) in after.items():
+        calls = count - before[stage][1]
+        if calls:
+            stage_means[stage] = ((total - before[stage][0]) / calls, int(calls))
+    return {"latencies": latencies, "failures": failures, "elapsed": elapsed, "stages": stage_means}
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def report(word_count: int, users: int, result: dict):
+    latencies = result["latencies"]
+    print(f"\n=== {word_count // 1000}k words, {users} concurrent user(s) ===")
+    if latencies:
+        print(f"books: {len(latencies)} ok, {len(result['failures'])} failed in {result['elapsed']:.1f}s "
+              f"-> {len(latencies) / result['elapsed'] * 3600:.1f} books/hour")
+        print(f"latency: p50 {percentile(latencies, 50):.1f}s  p95 {percentile(latencies, 95):.1f}s  "
+              f"p99 {percentile(latencies, 99):.1f}s  mean {statistics.mean(latencies):.1f}s")
+    for failure in result["failures"][:3]:
+        print(f"failed: {failure}")
+    if result["stages"]:
+        print(f"{'stage':>18} {'mean (s)':>9} {'count':>6}")
+        for stage, (mean, count) in sorted(result["stages"].items(), key=lambda item: -item[1][0]):
+            print(f"{stage:>18} {mean:>9.2f} {count:>6}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=4, help="concurrent clients")
+    parser.add_argument("--books", type=int, default=8, help="books per tier")
+    parser.add_argument("--tiers", type=int, nargs="+", default=[15000, 30000, 50000])
+    parser.add_argument("--latency", type=float, default=0.3, help="fixed upstream latency (s)")
+    parser.add_argument("--seconds-per-token", type=float, default=0.002)
+    parser.add_argument("--image-seconds", type=float, default=8.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="share of OpenAI calls answered with 429")
+    parser.add_argument("--output-scale", type=float, default=1.0, help="multiplier on requested word counts")
+    args = parser.parse_args()
+
+    fake_port, app_port = free_port(), free_port()
+    fake_url, app_url = f"http://127.0.0.1:{fake_port}", f"http://127.0.0.1:{app_port}"
+    fake_env = {
+        "FAKE_LATENCY_SECONDS": str(args.latency),
+        "FAKE_SECONDS_PER_TOKEN": str(args.seconds_per_token),
+        "FAKE_IMAGE_SECONDS": str(args.image_seconds),
+        "FAKE_429_RATE": str(args.rate_429),
+        "FAKE_OUTPUT_SCALE": str(args.output_scale),
+    }
+    app_env = {
+        "ASTROLOGY_API_BASE_URL": f"{fake_url}/astrology",
+        "ASTROLOGY_API_USER_ID": "benchmark",
+        "ASTROLOGY_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"{fake_url}/openai/v1",
+        "OPENAI_API_KEY": "benchmark",
+        # Every book should pay for every stage
+        "CHART_CACHE_ENABLED": os.getenv("CHART_CACHE_ENABLED", "false"),
+        "CHECKPOINTS_ENABLED": "false",
+        "ARCHITECT_CACHE_ENABLED": os.getenv("ARCHITECT_CACHE_ENABLED", "false"),
+        "BOOK_REUSE_ENABLED": "false",
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        servers = [
+            start_server("benchmarks.fake_upstreams:app", fake_port, fake_env, workdir, os.path.join(workdir, "fake.log")),
+            start_server("app.main:app", app_port, app_env, workdir, os.path.join(workdir, "app.log")),
+        ]
+        try:
+            await wait_until_up(f"{fake_url}/docs")
+            await wait_until_up(f"{app_url}/metrics")
+            for word_count in args.tiers:
+                report(word_count, args.users, await run_tier(app_url, word_count, args.users, args.books))
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+            print(f"\n(app server log tail)\n" + "".join(open(os.path.join(workdir, "app.log")).readlines()[-5:]))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,173 @@
+# benchmarks/fake_upstreams.py
+"""
+Local stand-ins for AstrologyAPI and the OpenAI chat, image and image-download endpoints,
+used by benchmarks.e2e_bench. Answers have realistic shapes and sizes; latency, 429s and
+output length are set with environment variables:
+
+    FAKE_LATENCY_SECONDS      fixed delay before every answer (default 0.3)
+    FAKE_SECONDS_PER_TOKEN    extra delay per completion token (default 0.002, ~500 tok/s)
+    FAKE_IMAGE_SECONDS        delay of an image generation (default 8)
+    FAKE_429_RATE             share of OpenAI calls answered with a 429 (default 0)
+    FAKE_OUTPUT_SCALE         multiplier on the requested word counts (default 1.0)
+
+Run with: uvicorn benchmarks.fake_upstreams:app --port 8100
+Point the app at it with ASTROLOGY_API_BASE_URL=http://127.0.0.1:8100/astrology and
+OPENAI_BASE_URL=http://127.0.0.1:8100/openai/v1.
+"""
+import asyncio
+import io
+import json
+import os
+import random
+import re
+import struct
+import time
+import uuid
+import zlib
+from functools import lru_cache
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from PIL import Image
+
+LATENCY_SECONDS = float(os.getenv("FAKE_LATENCY_SECONDS", "0.3"))
+SECONDS_PER_TOKEN = float(os.getenv("FAKE_SECONDS_PER_TOKEN", "0.002"))
+IMAGE_SECONDS = float(os.getenv("FAKE_IMAGE_SECONDS", "8"))
+RATE_429 = float(os.getenv("FAKE_429_RATE", "0"))
+OUTPUT_SCALE = float(os.getenv("FAKE_OUTPUT_SCALE", "1.0"))
+
+CHART_FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "sample_natal_chart.json")
+TOKENS_PER_WORD = 1.33
+STREAM_CHUNK_WORDS = 8
+WORDS = (
+    "you carry a quiet strength that others sense before you speak and your need for "
+    "security sits beside a restless curiosity that keeps pulling you toward the horizon"
+).split()
+
+app = FastAPI(title="Fake upstreams for benchmarks")
+
+
+@lru_cache(maxsize=1)
+def sample_chart() -> dict:
+    with open(CHART_FIXTURE) as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=1)
+def sample_png() -> bytes:
+    """A 1024x1792 PNG of roughly DALL-E's size on disk."""
+    image = Image.effect_noise((256, 448), 64).convert("RGB").resize((1024, 1792))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def unique_png() -> bytes:
+    """sample_png() with a random text chunk, so every download hashes differently in the image store."""
+    data = sample_png()
+    payload = b"Comment\x00" + uuid.uuid4().hex.encode()
+    chunk = struct.pack(">I", len(payload)) + b"tEXt" + payload + struct.pack(">I", zlib.crc32(b"tEXt" + payload))
+    return data[:-12] + chunk + data[-12:] # before the IEND chunk
+
+
+def prose(words: int) -> str:
+    paragraphs = []
+    for start in range(0, max(words, 1), 120):
+        count = min(120, words - start) or 1
+        paragraphs.append(" ".join(random.choice(WORDS) for _ in range(count)).capitalize() + ".")
+    return "\n\n".join(paragraphs)
+
+
+def completion_text(prompt: str, json_mode: bool) -> str:
+    """Picks an answer of the right shape for whichever prompt the app sent."""
+    if json_mode and '"briefs"' in prompt:
+        count = int(re.search(r"exactly (\d+)", prompt).group(1))
+        return json.dumps({"briefs": [{"summary": prose(40), "image_prompt": prose(60)} for _ in range(count)]})
+    if json_mode and '"image_prompt"' in prompt:
+        return json.dumps({"summary": prose(40), "image_prompt": prose(60)})
+    if json_mode and '"sections"' in prompt:
+        count = int(re.search(r"exactly (\d+)", prompt).group(1))
+        return json.dumps({"sections": [
+            {"focus": f"Part {i + 1} of the theme.", "summary": prose(40)} for i in range(count)
+        ]})
+    if json_mode and '"chapters"' in prompt:
+        count = 4 if "Core Dynamics" in prompt else 6 if "Primary & Secondary" in prompt else 8
+        return json.dumps({"chapters": [
+            {"theme_title": f"Theme {i + 1}", "summary": prose(30), "keywords": WORDS[:6]} for i in range(count)
+        ]})
+    if json_mode:
+        return json.dumps({"day": 4, "month": 9, "year": 1986, "hour": 15, "min": 30,
+                           "latitude": 26.7153, "longitude": -80.0534, "timezone_offset": -4.0})
+    match = re.search(r"approximately (\d+) words", prompt)
+    if match:
+        return prose(int(int(match.group(1)) * OUTPUT_SCALE))
+    return prose(60) # summaries and image prompts
+
+
+def too_many_requests():
+    if random.random() < RATE_429:
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached (injected).", "type": "requests", "code": "rate_limit_exceeded"}},
+            status_code=429, headers={"retry-after-ms": "500"}
+        )
+    return None
+
+
+@app.post("/astrology/western_horoscope")
+async def western_horoscope():
+    await asyncio.sleep(LATENCY_SECONDS)
+    return sample_chart()
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    limited = too_many_requests()
+    if limited:
+        return limited
+    prompt = " ".join(str(m.get("content", "")) for m in body["messages"])
+    json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+    text = completion_text(prompt, json_mode)
+    prompt_tokens = len(prompt) // 4
+    completion_tokens = int(len(text.split()) * TOKENS_PER_WORD)
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+             "total_tokens": prompt_tokens + completion_tokens}
+    base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()), "model": body["model"]}
+
+    if not body.get("stream"):
+        await asyncio.sleep(LATENCY_SECONDS + completion_tokens * SECONDS_PER_TOKEN)
+        return {**base, "object": "chat.completion", "usage": usage, "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+        ]}
+
+    async def stream():
+        await asyncio.sleep(LATENCY_SECONDS)
+        words = text.split(" ")
+        for start in range(0, len(words), STREAM_CHUNK_WORDS):
+            delta = " ".join(words[start:start + STREAM_CHUNK_WORDS]) + " "
+            await asyncio.sleep(STREAM_CHUNK_WORDS * TOKENS_PER_WORD * SECONDS_PER_TOKEN)
+            chunk = {**base, "object": "chat.completion.chunk", "usage": None, "choices": [
+                {"index": 0, "delta": {"content": delta}, "finish_reason": None}
+            ]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.post("/openai/v1/images/generations")
+async def images_generations(request: Request):
+    limited = too_many_requests()
+    if limited:
+        return limited
+    await asyncio.sleep(IMAGE_SECONDS)
+    return {"created": int(time.time()), "data": [
+        {"url": str(request.base_url) + f"images/{uuid.uuid4().hex}.png", "revised_prompt": None}
+    ]}
+
+
+@app.get("/images/{name}")
+async def image_download(name: str):
+    await asyncio.sleep(LATENCY_SECONDS)
+    return Response(unique_png(), media_type="image/png")
@@ -0,0 +1,78 @@
+# benchmarks/import_profile.py
+"""
+Profiles `import app.main` in a fresh interpreter and checks it against a startup budget.
+Run from the project root:
+
+    python -m benchmarks.import_profile [--budget 1.0] [--repeat 3] [--top 15]
+
+Prints the slowest modules (cumulative, from python -X importtime) and the best import
+time over --repeat runs. Exits with status 1 if that time is over --budget seconds or if
+a module that must stay deferred to first use (--forbid, by default weasyprint, openai,
+jinja2, PIL and httpx) was imported, so it can gate CI.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "1.0"))
+DEFERRED_MODULES = ["weasyprint", "openai", "jinja2", "PIL", "httpx"]
+PROBE = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "import app.main\n"
+    "print(time.perf_counter() - start)\n"
+    "print(' '.join(sorted(sys.modules)))\n"
+)
+
+
+def profile_once() -> tuple:
+    """(seconds, imported module names, {module: cumulative microseconds}) for one cold import."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=PROJECT_ROOT, env={**os.environ, "PYTHONPATH": PROJECT_ROOT},
+        capture_output=True, text=True, check=True,
+    )
+    seconds, modules = completed.stdout.splitlines()[:2]
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        cumulative[name.strip()] = int(cumulative_us)
+    return float(seconds), set(modules.split()), cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_SECONDS, help="seconds allowed for import app.main")
+    parser.add_argument("--repeat", type=int, default=3, help="cold imports to run; the fastest counts")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+    parser.add_argument("--forbid", nargs="*", default=DEFERRED_MODULES, help="packages that must not be imported")
+    args = parser.parse_args()
+
+    runs = [profile_once() for _ in range(max(1, args.repeat))]
+    seconds, modules, cumulative = min(runs, key=lambda run: run[0])
+
+    print(f"{'cumulative (ms)':>16}  module")
+    for name, micros in sorted(cumulative.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{micros / 1000:>16.1f}  {name}")
+
+    failures = []
+    print(f"\nimport app.main: {seconds:.3f}s (best of {len(runs)}), budget {args.budget:.3f}s")
+    if seconds > args.budget:
+        failures.append(f"import took {seconds:.3f}s, over the {args.budget:.3f}s budget")
+    for package in args.forbid:
+        if any(name == package or name.startswith(package + ".") for name in modules):
+            failures.append(f"{package} is imported at startup; import it where it is first used")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# benchmarks/prompt_report.py
+"""
+Reports the input size of the architect and chapter prompts per book tier, with the full
+indented chart JSON (the old prompts) vs the chart digest. Chapters long enough to be
+written in sections count their outline and section prompts. Run from the project root:
+
+    python -m benchmarks.prompt_report [--chart benchmarks/fixtures/sample_natal_chart.json]
+
+Token counts use tiktoken when it is installed, otherwise about four characters per token.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.chart_digest import build_chart_digest # noqa: E402
+from app.prompt_builder import ( # noqa: E402
+    build_book_structure_prompt, build_dynamic_chapter_prompt, build_chapter_outline_prompt, build_chapter_section_prompt
+)
+from app.book_writer import SECTIONED_CHAPTER_THRESHOLD_WORDS, SECTION_TARGET_WORDS # noqa: E402
+
+DEFAULT_CHART = os.path.join(os.path.dirname(__file__), "fixtures", "sample_natal_chart.json")
+# (word count, architect tier, chapters: the top of the architect's range for the tier)
+TIERS = [
+    (15000, "Core Dynamics (~15k words)", 4),
+    (30000, "Primary & Secondary Themes (~30k words)", 6),
+    (50000, "Full Arc (~50k+ words)", 8),
+]
+SAMPLE_CHAPTER = {
+    "theme_title": "The Tug-of-War Between Your Heart and Your Mind",
+    "summary": "This chapter explores the tension between emotional security and intellectual freedom.",
+    "keywords": ["security", "freedom", "intuition", "logic", "belonging", "independence"],
+}
+
+SAMPLE_SECTION = {
+    "focus": "How the pull toward safety shapes the way you open up to the people closest to you.",
+    "summary": "You guard your inner world until trust is proven, then give it completely. "
+               "The reader sees that this caution is a form of care, not coldness.",
+}
+
+
+def make_token_counter():
+    try:
+        import tiktoken
+        encoding = tiktoken.encoding_for_model("gpt-4")
+        return lambda text: len(encoding.encode(text)), "tiktoken"
+    except ImportError:
+        return lambda text: len(text) // 4, "~4 chars/token"
+
+
+def chapter_prompt_tokens(count_tokens, chart_text: str, words: int) -> int:
+    """Input tokens of one chapter, as book_writer.generate_chapter_text sends it."""
+    if words <= SECTIONED_CHAPTER_THRESHOLD_WORDS:
+        return count_tokens(build_dynamic_chapter_prompt(SAMPLE_CHAPTER, chart_text, words))
+    # Long chapters: one outline prompt, then one prompt per section
+    section_count = -(-words // SECTION_TARGET_WORDS)
+    outline = [SAMPLE_SECTION] * section_count
+    total = count_tokens(build_chapter_outline_prompt(SAMPLE_CHAPTER, chart_text, words, section_count))
+    for index in range(section_count):
+        total += count_tokens(build_chapter_section_prompt(SAMPLE_CHAPTER, chart_text, outline, index, words // section_count))
+    return total
+
+
+def book_prompt_tokens(count_tokens, chart_text: str, tier: str, word_count: int, chapters: int) -> tuple:
+    architect = count_tokens(build_book_structure_prompt(chart_text, tier))
+    chapter = chapter_prompt_tokens(count_tokens, chart_text, word_count // chapters)
+    return architect, chapter, architect + chapter * chapters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--chart", default=DEFAULT_CHART, help="a western_horoscope API response (JSON)")
+    parser.add_argument("--price-per-million", type=float, default=10.0, help="input token price in USD")
+    args = parser.parse_args()
+
+    with open(args.chart) as f:
+        chart = json.load(f)
+    count_tokens, method = make_token_counter()
+    full_json = json.dumps(chart, indent=2)
+    digest = build_chart_digest(chart)
+    print(f"Chart data: {count_tokens(full_json)} tokens as indented JSON, {count_tokens(digest)} as a digest ({method}).\n")
+
+    print(f"{'tier':>6} {'chapters':>8} {'prompt':>10} {'before':>8} {'after':>8} {'saved':>7}")
+    for word_count, tier, chapters in TIERS:
+        before = book_prompt_tokens(count_tokens, full_json, tier, word_count, chapters)
+        after = book_prompt_tokens(count_tokens, digest, tier, word_count, chapters)
+        for label, old, new in zip(("architect", "chapter", "book"), before, after):
+            print(f"{word_count // 1000:>5}k {chapters:>8} {label:>10} {old:>8} {new:>8} {(old - new) / old:>7.0%}")
+        saved_cost = (before[2] - after[2]) * args.price_per_million / 1_000_000
+        print(f"{'':>6} {'':>8} {'':>10} saves ${saved_cost:.3f} of input per book\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# benchmarks/render_bench.py
+"""
+Measures PDF render time for synthetic 15k/30k/50k-word books.
+
+"cold" clears the compiled template, stylesheet and font configuration before every
+render, which is what each book used to pay; "warm" reuses them the way the server does
+after its first book. Run from the project root:
+
+    python -m benchmarks.render_bench [--runs 3] [--images]
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import book_pdf_exporter # noqa: E402
+
+WORD_COUNTS = [15000, 30000, 50000]
+CHAPTERS = 10
+PARAGRAPH_WORDS = 120
+SAMPLE_WORDS = (
+    "the moon in your fourth house speaks of a deep need for roots and a home that "
+    "feels safe while venus in gemini brings curiosity and a restless warmth to love"
+).split()
+
+
+def make_paragraph(words: int) -> str:
+    return " ".join(SAMPLE_WORDS[i % len(SAMPLE_WORDS)] for i in range(words)).capitalize() + "."
+
+
+def make_text(words: int) -> str:
+    return "\n\n".join(make_paragraph(PARAGRAPH_WORDS) for _ in range(max(1, words // PARAGRAPH_WORDS)))
+
+
+def make_book(total_words: int, with_images: bool) -> dict:
+    """A book shaped like generate_astrology_book()'s output, 10% front/back matter."""
+    images = sorted(glob.glob("generated_images/*.png")) if with_images else []
+    chapter_words = int(total_words * 0.9) // CHAPTERS
+    matter_words = int(total_words * 0.1) // 3
+    return {
+        "preface_text": make_text(matter_words),
+        "prologue_text": make_text(matter_words),
+        "epilogue_text": make_text(matter_words),
+        "chapters": [
+            {
+                "heading": f"Chapter {i + 1}: The Planets at Play",
+                "content": make_text(chapter_words),
+                "image_path": images[i % len(images)] if images else None,
+            }
+            for i in range(CHAPTERS)
+        ],
+    }
+
+
+def clear_render_caches():
+    book_pdf_exporter.get_template_environment.cache_clear()
+    book_pdf_exporter.get_render_resources.cache_clear()
+
+
+def time_render(book: dict, output_dir: str, cold: bool) -> float:
+    if cold:
+        clear_render_caches()
+    target = os.path.join(output_dir, "bench.pdf")
+    start = time.perf_counter()
+    book_pdf_exporter.render_book_pdf("Benchmark Book", book, target)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--images", action="store_true", help="use images from generated_images/")
+    args = parser.parse_args()
+
+    print(f"{'words':>7} {'cold (s)':>10} {'warm (s)':>10} {'saved':>7}")
+    with tempfile.TemporaryDirectory() as output_dir:
+        for words in WORD_COUNTS:
+            book = make_book(words, args.images)
+            if args.images:
+                book = book_pdf_exporter.with_print_images(book)
+            cold = statistics.median(time_render(book, output_dir, cold=True) for _ in range(args.runs))
+            book_pdf_exporter.warm_up()
+            warm = statistics.median(time_render(book, output_dir, cold=False) for _ in range(args.runs))
+            print(f"{words:>7} {cold:>10.2f} {warm:>10.2f} {(cold - warm) / cold:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
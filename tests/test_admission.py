@@ -0,0 +1,86 @@
+# tests/test_admission.py
+"""The render memory budget and the RENDER_MEMORY_MB_BY_TIER parser."""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.admission import DEFAULT_RENDER_MEMORY_MB_BY_TIER, MemoryBudget, parse_tier_costs # noqa: E402
+
+
+def test_parse_tier_costs():
+    assert parse_tier_costs("15000:300,30000:550") == {15000: 300, 30000: 550}
+    assert parse_tier_costs(" 15000 : 300 , 30000:550, ") == {15000: 300, 30000: 550} # spaces, trailing comma
+
+
+def test_parse_tier_costs_skips_malformed_entries(capsys):
+    assert parse_tier_costs("15000:300,30000,abc:1,50000:0,-1:5,1:2:3,50000:900") == {15000: 300, 50000: 900}
+    reported = capsys.readouterr().out
+    for entry in ("'30000'", "'abc:1'", "'50000:0'", "'-1:5'", "'1:2:3'"):
+        assert entry in reported
+
+
+def test_parse_tier_costs_falls_back_to_the_defaults():
+    assert parse_tier_costs("") == DEFAULT_RENDER_MEMORY_MB_BY_TIER
+    assert parse_tier_costs(",") == DEFAULT_RENDER_MEMORY_MB_BY_TIER
+    assert parse_tier_costs("nonsense") == DEFAULT_RENDER_MEMORY_MB_BY_TIER
+    # A copy: callers can't change the defaults through it
+    assert parse_tier_costs("") is not DEFAULT_RENDER_MEMORY_MB_BY_TIER
+
+
+def test_memory_budget_waits_until_the_cost_fits():
+    async def scenario():
+        budget = MemoryBudget(1000)
+        order = []
+        release_big = asyncio.Event()
+
+        async def render(name: str, cost_mb: int, done: asyncio.Event = None):
+            async with budget.reserve(cost_mb):
+                order.append(name)
+                if done:
+                    await done.wait()
+
+        big = asyncio.create_task(render("big", 900, release_big))
+        await asyncio.sleep(0)
+        small = asyncio.create_task(render("small", 300))
+        await asyncio.sleep(0)
+        assert order == ["big"]
+        assert budget.report() == {"reserved_mb": 900, "capacity_mb": 1000, "waiting": 1}
+
+        release_big.set()
+        await asyncio.gather(big, small)
+        assert order == ["big", "small"]
+        assert budget.report() == {"reserved_mb": 0, "capacity_mb": 1000, "waiting": 0}
+
+    asyncio.run(scenario())
+
+
+def test_memory_budget_caps_an_oversized_cost_and_releases_on_error():
+    async def scenario():
+        budget = MemoryBudget(500)
+        async with budget.reserve(2000): # larger than the whole budget: runs alone instead of never
+            assert budget.reserved_mb == 500
+        try:
+            async with budget.reserve(200):
+                raise RuntimeError("render failed")
+        except RuntimeError:
+            pass
+        assert budget.reserved_mb == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_no_trace():
+    async def scenario():
+        budget = MemoryBudget(100)
+        async with budget.reserve(100):
+            waiter = asyncio.create_task(budget.reserve(50).__aenter__())
+            await asyncio.sleep(0)
+            assert budget.waiting == 1
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            assert budget.report() == {"reserved_mb": 100, "capacity_mb": 100, "waiting": 0}
+        assert budget.reserved_mb == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,62 @@
+# tests/test_birth_data_parser.py
+"""The offline birth data parser: DST-aware UTC offsets, and ambiguous places left to the LLM fallback."""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.birth_data_parser import geocode_location, parse_birth_data, timezone_offset_hours # noqa: E402
+
+
+def test_offset_follows_daylight_saving_time():
+    assert parse_birth_data("1986-09-04", "15:30", "West Palm Beach, Florida")["tzone"] == -4.0 # EDT
+    assert parse_birth_data("1986-12-04", "15:30", "West Palm Beach, Florida")["tzone"] == -5.0 # EST
+    assert parse_birth_data("July 22, 2001", "12:00 PM", "London, UK")["tzone"] == 1.0 # BST
+    assert parse_birth_data("22 January 2001", "12:00", "London, UK")["tzone"] == 0.0
+    # Southern hemisphere: daylight saving time in January, not in July
+    assert parse_birth_data("2001-01-22", "12:00", "Sydney, Australia")["tzone"] == 11.0
+    assert parse_birth_data("2001-07-22", "12:00", "Sydney, Australia")["tzone"] == 10.0
+
+
+def test_offset_on_the_day_clocks_change():
+    # US clocks went forward at 2:00 on 5 April 1987 and back at 2:00 on 25 October 1987
+    assert timezone_offset_hours("America/New_York", 1987, 4, 5, 1, 30) == -5.0
+    assert timezone_offset_hours("America/New_York", 1987, 4, 5, 3, 30) == -4.0
+    assert timezone_offset_hours("America/New_York", 1987, 10, 25, 0, 30) == -4.0
+    assert timezone_offset_hours("America/New_York", 1987, 10, 25, 3, 30) == -5.0
+
+
+def test_parsed_fields_and_location():
+    birth_data = parse_birth_data("September 4th, 1986", "3.30 p.m.", "Chicago IL 60601")
+    assert birth_data == {
+        "day": 4, "month": 9, "year": 1986, "hour": 15, "minute": 30,
+        "lat": 41.8781, "lon": -87.6298, "tzone": -5.0,
+    }
+
+
+def test_ambiguous_city_needs_a_qualifier():
+    assert geocode_location("Portland") is None
+    assert geocode_location("Portland, Oregon")["timezone"] == "America/Los_Angeles"
+    assert geocode_location("Portland, ME")["timezone"] == "America/New_York"
+    assert parse_birth_data("1990-05-01", "08:00", "Springfield") is None
+
+
+def test_unresolved_details_fall_back_to_the_llm(monkeypatch):
+    from app import main
+
+    prompts = []
+
+    async def fake_extractor(prompt: str) -> dict:
+        prompts.append(prompt)
+        return {"resolved": "by the LLM"}
+
+    monkeypatch.setattr(main, "LOCAL_BIRTH_PARSER_ENABLED", True)
+    monkeypatch.setattr(main, "extract_birth_data_from_prompt", fake_extractor)
+    ambiguous = main.BookRequest(birth_date="1990-05-01", birth_time="08:00", birth_location="Portland")
+    assert asyncio.run(main.resolve_birth_data(ambiguous)) == {"resolved": "by the LLM"}
+    assert prompts == ["1990-05-01 at 08:00 in Portland"]
+
+    resolved = main.BookRequest(birth_date="1990-05-01", birth_time="08:00", birth_location="Portland, Oregon")
+    assert asyncio.run(main.resolve_birth_data(resolved))["tzone"] == -7.0 # PDT
+    assert len(prompts) == 1
@@ -0,0 +1,87 @@
+# tests/test_file_store.py
+"""Eviction in the FileStore: least recently used first, and only the evicted file's own derivatives."""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import file_store # noqa: E402
+from app.file_store import FileStore # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def no_grace_period(monkeypatch):
+    monkeypatch.setattr(file_store, "EVICTION_GRACE_SECONDS", 0)
+
+
+def set_last_used(store: FileStore, name: str, when: float):
+    with sqlite3.connect(store.index_path) as conn:
+        conn.execute("UPDATE files SET last_used = ? WHERE name = ?", (when, name))
+
+
+def indexed(store: FileStore) -> set:
+    with sqlite3.connect(store.index_path) as conn:
+        return {row[0] for row in conn.execute("SELECT name FROM files")}
+
+
+def test_book_formats_sharing_a_stem_are_evicted_independently(tmp_path):
+    store = FileStore(str(tmp_path), quota_bytes=10**6, content_addressed=False)
+    store.put_bytes(b"h" * 100, name="Book_1.html")
+    store.put_bytes(b"p" * 100, name="Book_1.pdf")
+    set_last_used(store, "Book_1.html", 1) # downloaded long ago
+    store.touch("Book_1.pdf") # just downloaded
+
+    store.quota_bytes = 150
+    store.enforce_quota()
+
+    assert not os.path.exists(tmp_path / "Book_1.html")
+    assert os.path.exists(tmp_path / "Book_1.pdf")
+    assert indexed(store) == {"Book_1.pdf"}
+
+
+def test_image_eviction_removes_only_its_print_derivatives(tmp_path):
+    store = FileStore(str(tmp_path), quota_bytes=10**6)
+    old = store.put_bytes(b"old image", extension=".png")
+    kept = store.put_bytes(b"kept image", extension=".png")
+    old_derivatives = [os.path.splitext(old)[0] + suffix for suffix in (".print200.jpg", ".print300.webp")]
+    kept_derivative = os.path.splitext(kept)[0] + ".print200.jpg"
+    for path in old_derivatives + [kept_derivative]:
+        with open(path, "wb") as f:
+            f.write(b"derivative")
+    set_last_used(store, os.path.basename(old), 1)
+
+    store.quota_bytes = len(b"kept image")
+    store.enforce_quota()
+
+    assert not any(os.path.exists(path) for path in [old] + old_derivatives)
+    assert os.path.exists(kept) and os.path.exists(kept_derivative)
+
+
+def test_book_content_is_kept_until_the_last_format_is_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_store, "BOOK_DATA_DIR", str(tmp_path / "book_data"))
+    monkeypatch.setattr(file_store, "_image_store", FileStore(str(tmp_path / "images"), quota_bytes=10**6))
+    monkeypatch.setattr(file_store, "_book_store", FileStore(
+        str(tmp_path / "books"), quota_bytes=10**6, content_addressed=False, on_evict=file_store._forget_book
+    ))
+    books = file_store.get_book_store()
+    os.makedirs(file_store.BOOK_DATA_DIR)
+    with open(file_store.book_data_path("Book_1"), "w") as f:
+        f.write("{}")
+    books.put_bytes(b"h" * 100, name="Book_1.html")
+    books.put_bytes(b"p" * 100, name="Book_1.pdf") # rendered on demand from the kept content
+
+    # The on-demand PDF goes first: the html book must still be able to render it again
+    set_last_used(books, "Book_1.pdf", 1)
+    books.quota_bytes = 150
+    books.enforce_quota()
+    assert indexed(books) == {"Book_1.html"}
+    assert os.path.exists(file_store.book_data_path("Book_1"))
+
+    set_last_used(books, "Book_1.html", 1)
+    books.quota_bytes = 0
+    books.enforce_quota()
+    assert indexed(books) == set()
+    assert not os.path.exists(file_store.book_data_path("Book_1"))
@@ -0,0 +1,35 @@
+# tests/test_import_budget.py
+"""
+Startup-time regression test: a cold `import app.main` must stay within the import budget
+(IMPORT_BUDGET_SECONDS, 1.0s by default) and must not import the packages that are only
+loaded on first use. See benchmarks/import_profile.py for the per-module breakdown.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.import_profile import DEFAULT_BUDGET_SECONDS, DEFERRED_MODULES, profile_once # noqa: E402
+
+REPEAT = 3 # the fastest of a few cold imports, so one slow run on a busy machine doesn't fail
+
+
+def best_profile() -> tuple:
+    return min((profile_once() for _ in range(REPEAT)), key=lambda run: run[0])
+
+
+def test_import_app_main_within_budget():
+    seconds, _, cumulative = best_profile()
+    slowest = sorted(cumulative.items(), key=lambda item: -item[1])[:10]
+    assert seconds <= DEFAULT_BUDGET_SECONDS, (
+        f"import app.main took {seconds:.3f}s, over the {DEFAULT_BUDGET_SECONDS:.3f}s budget; slowest: {slowest}"
+    )
+
+
+def test_deferred_modules_not_imported_at_startup():
+    _, modules, _ = profile_once()
+    imported = [
+        package for package in DEFERRED_MODULES
+        if any(name == package or name.startswith(package + ".") for name in modules)
+    ]
+    assert not imported, f"imported at startup instead of on first use: {imported}"
@@ -0,0 +1,51 @@
+# tests/test_incremental_render.py
+"""
+The incremental renderer must produce the same book as the single-pass render: the same
+number of pages, and table-of-contents numbers that match where each section actually starts.
+Needs WeasyPrint with Pango; skipped where those libraries are not installed.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+try:
+    from app.book_pdf_exporter import IncrementalBookRenderer, layout_book # noqa: E402
+except OSError as e: # WeasyPrint raises OSError when Pango can't be loaded
+    pytest.skip(f"WeasyPrint can't render here: {e}", allow_module_level=True)
+
+PARAGRAPH = "The stars keep their own counsel, and the chart reads them slowly. " * 40
+
+
+def sample_book(chapters: int = 6) -> dict:
+    return {
+        "preface_text": PARAGRAPH,
+        "prologue_text": PARAGRAPH * 2,
+        "epilogue_text": PARAGRAPH,
+        "chapters": [
+            {"heading": f"Chapter heading {number}", "content": PARAGRAPH * (number % 3 + 1), "image_path": None}
+            for number in range(1, chapters + 1)
+        ],
+    }
+
+
+def anchor_page(document, anchor: str) -> int:
+    return next(number for number, page in enumerate(document.pages, start=1) if anchor in page.anchors)
+
+
+def test_incremental_render_matches_single_pass():
+    book_data = sample_book()
+    single_pass = layout_book("Test Book", book_data)
+
+    renderer = IncrementalBookRenderer("Test Book", "Test_Book.pdf")
+    for index in (3, 0, 5): # some chapters arrive before the rest of the book, out of order
+        renderer.add_chapter(index, book_data["chapters"][index])
+    incremental, toc_pages = renderer.layout(book_data)
+
+    assert len(incremental.pages) == len(single_pass.pages)
+    assert set(toc_pages) == {"#preface", "#prologue", "#epilogue"} | {f"#chapter-{n}" for n in range(1, 7)}
+    for href, page in toc_pages.items():
+        assert page == anchor_page(single_pass, href[1:]), href
+        assert page == anchor_page(incremental, href[1:]), href
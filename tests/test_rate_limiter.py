@@ -0,0 +1,116 @@
+# tests/test_rate_limiter.py
+"""
+The OpenAI rate limiters, in-process and shared: the one-minute window releases requests
+and tokens as they age out, and a 429 pauses every caller and shrinks the budget until
+successful calls let it recover. Time is simulated, so nothing here really sleeps.
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import rate_limiter # noqa: E402
+from app.rate_limiter import RateLimiter, SharedRateLimiter, WINDOW_SECONDS # noqa: E402
+
+real_sleep = asyncio.sleep
+
+
+class FakeClock:
+    """Stands in for the time module (monotonic and wall clock alike); sleeping advances it."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.now += max(seconds, 0)
+        await real_sleep(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", fake)
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", fake.sleep)
+    return fake
+
+
+@pytest.fixture(params=["process", "shared"])
+def make_limiter(request, tmp_path):
+    def make(requests_per_minute: int, tokens_per_minute: int = 0):
+        if request.param == "shared":
+            return SharedRateLimiter("test", requests_per_minute, tokens_per_minute, path=str(tmp_path / "limits.sqlite3"))
+        return RateLimiter("test", requests_per_minute, tokens_per_minute)
+    return make
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_requests_wait_for_the_oldest_to_leave_the_window(clock, make_limiter):
+    limiter = make_limiter(requests_per_minute=2)
+    start = clock.now
+
+    async def scenario():
+        await limiter.acquire()
+        clock.now += 10
+        await limiter.acquire()
+        await limiter.acquire() # the window is full until the first call is a minute old
+        return clock.now - start
+
+    assert run(scenario()) == pytest.approx(WINDOW_SECONDS)
+
+
+def test_tokens_are_released_as_calls_age_out_or_settle_lower(clock, make_limiter):
+    limiter = make_limiter(requests_per_minute=100, tokens_per_minute=1000)
+    start = clock.now
+
+    async def scenario():
+        first = await limiter.acquire(600)
+        await limiter.acquire(300)
+        # The first call really used far fewer tokens than estimated: 600 more now fit
+        await limiter._on_success(first, 100)
+        await limiter.acquire(600)
+        assert clock.now == start
+        await limiter.acquire(600) # 1000 in the window; waits for the first call to expire
+        return clock.now - start
+
+    assert run(scenario()) == pytest.approx(WINDOW_SECONDS)
+
+
+def test_back_off_pauses_callers_and_shrinks_the_budget_until_it_recovers(clock, make_limiter):
+    limiter = make_limiter(requests_per_minute=4)
+    start = clock.now
+
+    async def fill_window() -> tuple:
+        """(calls that fit without waiting, the entries) from the current moment."""
+        entries, began = [], clock.now
+        while clock.now == began:
+            entries.append(await limiter.acquire())
+        return len(entries) - 1, entries
+
+    async def scenario():
+        await limiter._on_rate_limited(10)
+        await limiter.acquire()
+        assert clock.now - start == pytest.approx(10) # nobody calls during the pause
+
+        clock.now += WINDOW_SECONDS
+        fitted, entries = await fill_window()
+        assert fitted == 3 # 75% of the budget after a 429
+
+        for _ in range(13): # each success restores 2% of the budget
+            await limiter._on_success(entries[0], None)
+        clock.now += WINDOW_SECONDS
+        fitted, _ = await fill_window()
+        assert fitted == 4
+
+    run(scenario())
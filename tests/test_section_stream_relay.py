@@ -0,0 +1,51 @@
+# tests/test_section_stream_relay.py
+"""SectionStreamRelay: concurrently written sections stream in reading order, whatever order they finish in."""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.book_writer import SectionStreamRelay # noqa: E402
+
+
+def relay(section_count: int):
+    streamed = []
+    return SectionStreamRelay(streamed.append, section_count), streamed
+
+
+def test_first_section_streams_live_and_later_ones_wait():
+    sections, streamed = relay(3)
+    sections.token(1, "b1")
+    sections.token(0, "a1")
+    sections.token(2, "c1")
+    sections.token(0, "a2")
+    assert streamed == ["a1", "a2"]
+
+    sections.finish(0)
+    assert streamed == ["a1", "a2", "\n\n", "b1"]
+    sections.token(1, "b2") # now the current section: live
+    assert streamed[-1] == "b2"
+
+
+def test_sections_finishing_out_of_order_are_released_in_reading_order():
+    sections, streamed = relay(3)
+    sections.token(2, "c1")
+    sections.token(1, "b1")
+    sections.token(2, "c2")
+    sections.finish(2)
+    sections.finish(1)
+    assert streamed == [] # section 0 hasn't written anything yet
+
+    sections.token(0, "a1")
+    sections.finish(0)
+    assert streamed == ["a1", "\n\n", "b1", "\n\n", "c1", "c2"]
+    assert sections.current == 3
+
+
+def test_no_separator_after_the_last_section():
+    sections, streamed = relay(2)
+    sections.token(0, "a")
+    sections.token(1, "b")
+    sections.finish(1)
+    sections.finish(0)
+    assert streamed == ["a", "\n\n", "b"]
@@ -0,0 +1,72 @@
+# tests/test_shared_state.py
+"""Lock files: prune_lock_files removes only old, unheld ones, and file_lock survives a prune."""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import shared_state # noqa: E402
+from app.shared_state import file_lock, prune_lock_files # noqa: E402
+
+pytestmark = pytest.mark.skipif(shared_state.fcntl is None, reason="lock files are only pruned with POSIX locks")
+
+
+@pytest.fixture(autouse=True)
+def shared_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_state, "SHARED_STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(shared_state, "LOCK_POLL_SECONDS", 0.01)
+
+
+def lock_file(name: str) -> str:
+    return os.path.join(shared_state.SHARED_STATE_DIR, "locks", f"{name}.lock")
+
+
+def age(path: str, seconds: float):
+    then = os.stat(path).st_mtime - seconds
+    os.utime(path, (then, then))
+
+
+def test_prune_removes_only_old_unheld_lock_files():
+    async def scenario():
+        for name in ("old", "young"):
+            async with file_lock(name):
+                pass
+        age(lock_file("old"), 7200)
+        async with file_lock("held"):
+            age(lock_file("held"), 7200)
+            await asyncio.to_thread(prune_lock_files, 3600)
+            assert os.path.exists(lock_file("held"))
+        assert not os.path.exists(lock_file("old"))
+        assert os.path.exists(lock_file("young"))
+
+    asyncio.run(scenario())
+
+
+def test_waiter_relocks_a_lock_file_pruned_while_it_waited(monkeypatch):
+    monkeypatch.setattr(shared_state, "LOCK_POLL_SECONDS", 0.1)
+
+    async def scenario():
+        inside = []
+
+        async def hold(tag: str, seconds: float):
+            async with file_lock("book"):
+                inside.append(tag)
+                assert len(inside) == 1, "two holders at once"
+                await asyncio.sleep(seconds)
+                inside.remove(tag)
+
+        first = asyncio.create_task(hold("first", 0.02))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(hold("waiter", 0)) # opens the current file, then polls every 0.1s
+        await first
+        # Before the waiter polls again, a prune removes the released file...
+        prune_lock_files(max_age_seconds=-1)
+        assert not os.path.exists(lock_file("book"))
+        # ...and a newcomer locks its replacement; the waiter must not hold the old one alongside it
+        newcomer = asyncio.create_task(hold("newcomer", 0.2))
+        await asyncio.gather(waiter, newcomer)
+
+    asyncio.run(scenario())